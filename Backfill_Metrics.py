@@ -0,0 +1,299 @@
+import argparse
+import logging
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+import Metrics_Writer
+from Counter_Rates import SERIES_KEY, counter_frame, set_counter_rates
+from ETL_Routers import (get_documents, match_documents, load_router_group, parse_measure_time, iter_in_pool,
+                         create_config_dataframe_from_document, create_stat_dataframe_from_document, transform_frames)
+from Metrics_Rollup import RollupWriter
+from Metrics_Writer import MetricsWriter, NATURAL_KEY, get_client
+from State_Store import StateStore
+from Pipeline_Metrics import metrics, configure_logging, add_instrumentation_arguments
+
+logger = logging.getLogger("Backfill_Metrics")
+
+# Lists every Measure_Time key of every router, the days a traffic document covers
+ROUTER_DAYS_PROJECTION = {
+    "routers": {"$map": {
+        "input": {"$objectToArray": {"$ifNull": ["$routers", {}]}},
+        "as": "router",
+        "in": {"k": "$$router.k", "v": {"$map": {
+            "input": {"$objectToArray": {"$ifNull": ["$$router.v.Measure_Time", {}]}},
+            "as": "measurement",
+            "in": "$$measurement.k"
+        }}}
+    }}
+}
+
+
+def measure_day(measure_time):
+    # '21/04/2024  0:30:05' -> date(2024, 4, 21)
+    return datetime.strptime(parse_measure_time(measure_time)[0], "%d/%m/%Y").date()
+
+
+def discover_partitions(db, start, end, routers=None):
+    """
+    Lists the (day, router) partitions of a date range and the pairs feeding them.
+
+    Pairs are matched exactly as the ETL matches them, on documents
+    projected to their router keys, and the days of every traffic router
+    are read with one more projection, so no measurement is loaded.
+
+    Args:
+        db (Database): The Router_Ingested database.
+        start, end (date): First and last day to rebuild, inclusive.
+        routers (list): IP addresses to rebuild; None for every router.
+
+    Returns:
+        dict: Maps (day, ip_address) to its (config_id, traffic_id) pairs, in
+        ETL order, for the partitions in range, sorted by day then router.
+    """
+    with metrics.span("backfill.discover"):
+        config_documents, traffic_documents = get_documents(db, keys_only=True)
+        matched_documents = match_documents(list(config_documents), traffic_documents, set())
+        config_ids = {traffic_keys["_id"]: config_keys["_id"] for config_keys, traffic_keys in matched_documents}
+
+        partitions = defaultdict(list)
+        for traffic_doc in db["Router_Traffic"].aggregate([{"$sort": {"_id": 1}}, {"$project": ROUTER_DAYS_PROJECTION}]):
+            config_id = config_ids.get(traffic_doc["_id"])
+            if config_id is None:
+                continue
+            for router in traffic_doc["routers"]:
+                ip_address = router["k"]
+                if routers and ip_address not in routers:
+                    continue
+                for day in {measure_day(measure_time) for measure_time in router["v"]}:
+                    if start <= day <= end:
+                        partitions[(day, ip_address)].append((config_id, traffic_doc["_id"]))
+    # Pairs are matched in config order, and a later pair overwrites an earlier one's documents
+    pair_order = {traffic_keys["_id"]: position for position, (_, traffic_keys) in enumerate(matched_documents)}
+    return {partition: sorted(partitions[partition], key=lambda pair: pair_order[pair[1]])
+            for partition in sorted(partitions)}
+
+
+def load_router_day(collection, document_id, ip_address, day):
+    # One router of a stored document, reduced to the measurements of one day
+    document = load_router_group(collection, document_id, [ip_address])
+    router_data = document["routers"].get(ip_address)
+    if router_data and day is not None:
+        router_data["Measure_Time"] = {measure_time: entries for measure_time, entries in router_data.get("Measure_Time", {}).items()
+                                       if measure_day(measure_time) == day}
+    return document
+
+
+def previous_counter_values(collection, ip_address, day):
+    """
+    Reads the last stored value of each of a router's series on the day
+    before day, the previous values the partition's first deltas start from.
+
+    Returns:
+        DataFrame: SERIES_KEY, 'Timestamp' and 'Stat_Value' per series, or
+        None if nothing is stored for that day.
+    """
+    stored = list(collection.find(
+        {"IP_Address": ip_address, "Measure_Date": (day - timedelta(days=1)).strftime("%d/%m/%Y")},
+        {"_id": 0, **{field: 1 for field in SERIES_KEY + ["Measure_Date", "Measure_Time", "Stat_Value"]}}
+    ))
+    if not stored:
+        return None
+    frame = counter_frame(stored).sort_values("Timestamp", kind="stable")
+    return frame.drop_duplicates(SERIES_KEY, keep="last")[SERIES_KEY + ["Timestamp", "Stat_Value"]]
+
+
+def replace_partition(collection, writer, documents, ip_address, day):
+    """
+    Replaces the stored metrics of one router and day with documents.
+
+    Documents are upserted on NATURAL_KEY first, which replaces each stored
+    metric in place, and only then are the metrics no longer produced
+    deleted, so a reader never finds the partition empty or half missing.
+
+    Returns:
+        tuple: (documents written, stale documents deleted).
+    """
+    existing = list(collection.find({"IP_Address": ip_address, "Measure_Date": day.strftime("%d/%m/%Y")},
+                                    {field: 1 for field in NATURAL_KEY}))
+    result = writer.write(documents)
+    if result["errors"]:
+        # Stale documents are kept, so a failed partition never loses metrics
+        raise RuntimeError(f"{len(result['errors'])} documents of {ip_address} on {day} failed to write")
+    produced = {tuple(document.get(field) for field in NATURAL_KEY) for document in documents}
+    stale_ids = [document["_id"] for document in existing
+                 if tuple(document.get(field) for field in NATURAL_KEY) not in produced]
+    if stale_ids:
+        collection.delete_many({"_id": {"$in": stale_ids}})
+        # Queries cached between the upserts and the delete saw the stale documents
+        writer.record_changes([(day.isoformat(), ip_address)])
+    return len(documents), len(stale_ids)
+
+
+def rebuild_partition(db, writer, rollup_writer, day, ip_address, sources, batch_id, rates=True):
+    """
+    Rebuilds the processed metrics of one router on one day from the raw documents.
+
+    Each source pair contributes only this router's measurements of this
+    day, run through the same frames and merge as the ETL. Counter rates
+    continue from the values stored for the previous day, and the state
+    store's counter state is left alone, since a backfill rewrites history
+    rather than advancing it.
+
+    Args:
+        db (Database): The Router_Ingested database.
+        writer (MetricsWriter): Writer of Processed_Routers_Metrics.
+        rollup_writer (RollupWriter): Rollups to rebuild for the day; may be None.
+        day (date): The measure day, in the routers' local time.
+        ip_address (str): The router.
+        sources (list): (config_id, traffic_id) pairs from discover_partitions.
+        batch_id (str): Recorded on the rebuilt rollup rows.
+        rates (bool): Compute Stat_Delta / Interval_Seconds / Stat_Rate.
+
+    Returns:
+        int: The number of documents written.
+    """
+    documents = {}
+    for config_id, traffic_id in sources:
+        with metrics.span("backfill.load"):
+            config_doc = load_router_day(db["Router_Configuration"], config_id, ip_address, None)
+            traffic_doc = load_router_day(db["Router_Traffic"], traffic_id, ip_address, day)
+        config_df = create_config_dataframe_from_document(config_doc)
+        traffic_df = create_stat_dataframe_from_document(traffic_doc)
+        for document in transform_frames(traffic_df, config_df):
+            # A later pair replaces an earlier one's metric, as its upsert would in the ETL
+            documents[tuple(document.get(field) for field in NATURAL_KEY)] = document
+    documents = list(documents.values())
+
+    if rates and documents:
+        with metrics.span("backfill.counter_rates"):
+            set_counter_rates(documents, counter_frame(documents), previous_counter_values(writer.collection, ip_address, day))
+    with metrics.span("backfill.replace"):
+        written, deleted = replace_partition(writer.collection, writer, documents, ip_address, day)
+    metrics.increment("backfill.documents_written", written)
+    metrics.increment("backfill.documents_deleted", deleted)
+    if rollup_writer is not None:
+        with metrics.span("backfill.rollups"):
+            day_start = datetime.combine(day, time())
+            rollup_writer.replace(documents, batch_id, ip_address, day_start, day_start + timedelta(days=1))
+    return written
+
+
+_worker_targets = None
+
+def init_backfill_worker(source_uri, processed_uri, rollups):
+    # Clients copied from the parent are not fork-safe, so every worker opens its own
+    global _worker_targets
+    Metrics_Writer._clients.clear()
+    _worker_targets = (get_client(source_uri)["Router_Ingested"], MetricsWriter(processed_uri),
+                       RollupWriter(processed_uri) if rollups else None)
+
+def rebuild_router_in_worker(ip_address, days, batch_id, rates):
+    # A router's days are rebuilt in date order, so each one's first deltas continue from the day
+    # before as this backfill rebuilt it, whichever worker runs which router
+    metrics.reset()
+    db, writer, rollup_writer = _worker_targets
+    written = [rebuild_partition(db, writer, rollup_writer, day, ip_address, sources, batch_id, rates)
+               for day, sources in days]
+    return written, metrics.snapshot()
+
+
+def backfill(db, writer, rollup_writer, state_store, start, end, run_id, routers=None, rates=True, workers=1,
+             max_in_flight=None, source_uri=None, processed_uri=None):
+    """
+    Rebuilds every (day, router) partition of a date range, skipping the
+    ones run_id already completed.
+
+    A partition is checkpointed in the state store as soon as it is
+    replaced, so an interrupted backfill started again with the same
+    run_id resumes with the first partition not yet done. A partition's
+    first counter deltas continue from the router's previous day, so with
+    workers > 1 each worker process rebuilds all the days of one router in
+    date order, and the result is the same as a serial run; checkpoints are
+    recorded by this process as each router completes.
+
+    Args:
+        db (Database): The Router_Ingested database.
+        writer (MetricsWriter): Writer of Processed_Routers_Metrics (workers=1).
+        rollup_writer (RollupWriter): Rollups to rebuild (workers=1); may be None.
+        state_store (StateStore): Holds the checkpoints.
+        start, end (date): First and last day, inclusive.
+        run_id (str): Identifies the backfill for checkpointing.
+        routers (list): IP addresses to rebuild; None for every router.
+        workers (int): Worker processes; 1 runs in-process.
+        max_in_flight (int): Routers submitted to the workers but not yet done.
+        source_uri, processed_uri (str): Connection strings the workers use.
+
+    Returns:
+        int: The number of partitions rebuilt by this call.
+    """
+    partitions = discover_partitions(db, start, end, routers)
+    completed = state_store.completed_partitions(run_id)
+    tasks = [(day, ip_address, sources, run_id, rates) for (day, ip_address), sources in partitions.items()
+             if (day.isoformat(), ip_address) not in completed]
+    metrics.increment("backfill.partitions_skipped", len(partitions) - len(tasks))
+    logger.info("Backfill %s: %d partitions from %s to %s, %d already done.", run_id, len(partitions), start, end,
+                len(partitions) - len(tasks))
+
+    # Each result is (partitions, documents written to each)
+    if workers <= 1:
+        results = (([(day, ip_address)], [rebuild_partition(db, writer, rollup_writer, day, ip_address, sources, batch_id, rates)])
+                   for day, ip_address, sources, batch_id, rates in tasks)
+    else:
+        router_days = defaultdict(list)
+        for day, ip_address, sources, _, _ in tasks:
+            router_days[ip_address].append((day, sources))
+        router_tasks = [(ip_address, days, run_id, rates) for ip_address, days in router_days.items()]
+        results = (([(day, ip_address) for day, _ in days], written)
+                   for (ip_address, days, _, _), written in iter_in_pool(
+                       router_tasks, rebuild_router_in_worker, workers, max_in_flight,
+                       init_backfill_worker, (source_uri, processed_uri, rollup_writer is not None)))
+    rebuilt = 0
+    for done, written in results:
+        for (day, ip_address), documents in zip(done, written):
+            state_store.record_partition(run_id, day.isoformat(), ip_address, documents)
+            metrics.increment("backfill.partitions_rebuilt")
+            rebuilt += 1
+            logger.info("%s %s rebuilt: %d documents (%d / %d).", day, ip_address, documents, rebuilt, len(tasks))
+    return rebuilt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild Processed_Routers_Metrics for a date range from the ingested "
+                                                 "documents, one (day, router) partition at a time.")
+    parser.add_argument("--start", required=True, type=date.fromisoformat, help="First day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, type=date.fromisoformat, help="Last day to rebuild, inclusive (YYYY-MM-DD)")
+    parser.add_argument("--routers", nargs="+", default=None, metavar="IP", help="Only rebuild these routers")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes, each rebuilding one router's days in order (1 runs serially)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Routers queued to the workers at once (default: twice the worker count)")
+    parser.add_argument("--run-id", default=None,
+                        help="Checkpoint name; re-running with the same one resumes (default: derived from the range)")
+    parser.add_argument("--restart", action="store_true", help="Forget the run's checkpoints and rebuild every partition")
+    parser.add_argument("--no-rollups", action="store_true", help="Leave the hourly / daily rollups untouched")
+    parser.add_argument("--no-rates", action="store_true", help="Skip computing counter deltas and rates")
+    parser.add_argument("--source-uri", default="mongodb://localhost:27017/", help="MongoDB holding Router_Ingested")
+    parser.add_argument("--uri", default="mongodb://localhost:27017/", help="MongoDB holding Processed_DataBase")
+    parser.add_argument("--state-db", default=None, help="SQLite state store holding the checkpoints")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level, args.log_file)
+    if args.end < args.start:
+        parser.error("--end is before --start")
+
+    run_id = args.run_id or "backfill_{}_{}{}".format(args.start, args.end, "_" + "_".join(sorted(args.routers)) if args.routers else "")
+    state_store = StateStore(args.state_db) if args.state_db else StateStore()
+    if args.restart:
+        state_store.clear_partitions(run_id)
+
+    db = get_client(args.source_uri)["Router_Ingested"]
+    writer = MetricsWriter(args.uri)
+    rollup_writer = None if args.no_rollups else RollupWriter(args.uri)
+    with metrics.span("backfill.run"):
+        backfill(db, writer, rollup_writer, state_store, args.start, args.end, run_id, args.routers,
+                 not args.no_rates, args.workers, args.max_in_flight, args.source_uri, args.uri)
+    metrics.log_summary(logger)
+    if args.metrics_file:
+        metrics.export(args.metrics_file, args.metrics_format)
+
+if __name__ == "__main__":
+    main()
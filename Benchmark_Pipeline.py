@@ -0,0 +1,532 @@
+import os
+import sys
+import json
+import math
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import bson
+import pandas as pd
+from pymongo import MongoClient
+
+import ETL_Routers
+import Router_Files
+import Columnar_Layout
+import Metrics_Queries
+from Metrics_Writer import MetricsWriter, QUERY_INDEXES, LEGACY_QUERY_INDEXES
+from Counter_Rates import add_counter_rates
+from State_Store import StateStore
+from Pipeline_Metrics import peak_rss
+
+# Synthetic documents shaped like the Router_Configuration / Router_Traffic collections
+def make_documents(document_count, routers_per_document=20):
+    config_documents = []
+    traffic_documents = []
+    for doc_index in range(document_count):
+        measure_time = f"{doc_index % 28 + 1:02d}/04/2024  0:30:05"
+        routers = {
+            f"172.16.{doc_index % 250}.{router_index}": {"Measure_Time": {measure_time: {"Time": measure_time}}}
+            for router_index in range(routers_per_document)
+        }
+        config_documents.append({"_id": f"config-{doc_index}", "routers": routers})
+        traffic_documents.append({"_id": f"traffic-{doc_index}", "routers": routers})
+    return config_documents, traffic_documents
+
+# Reference copy of the nested-loop matcher that process_documents used before the traffic index
+def legacy_match_documents(config_documents, traffic_documents, processed_document_ids):
+    matched_documents = []
+    traffic_documents = traffic_documents[:]
+    for config_doc in config_documents:
+        if str(config_doc['_id']) in processed_document_ids:
+            continue
+        for ip_address, router_data in config_doc.get('routers', {}).items():
+            config_time = list(router_data.keys())[0] if router_data else None
+            if not config_time:
+                continue
+            for traffic_doc in traffic_documents[:]:
+                traffic_router_data = traffic_doc.get('routers', {}).get(ip_address, {})
+                traffic_time = list(traffic_router_data.keys())[0] if traffic_router_data else None
+                if config_time == traffic_time:
+                    matched_documents.append((config_doc, traffic_doc))
+                    traffic_documents.remove(traffic_doc)
+    return matched_documents
+
+def time_call(function, *args):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args)
+    return time.perf_counter() - start, result
+
+def benchmark_matching(document_counts, routers_per_document):
+    print(f"{'documents':>10} {'legacy (s)':>12} {'indexed (s)':>12} {'speedup':>9}")
+    for document_count in document_counts:
+        config_documents, traffic_documents = make_documents(document_count, routers_per_document)
+        legacy_time, legacy_pairs = time_call(legacy_match_documents, config_documents, traffic_documents, set())
+        indexed_time, indexed_pairs = time_call(ETL_Routers.match_documents, config_documents, traffic_documents, set())
+        if [(c["_id"], t["_id"]) for c, t in legacy_pairs] != [(c["_id"], t["_id"]) for c, t in indexed_pairs]:
+            raise AssertionError(f"Matchers disagree for {document_count} documents")
+        print(f"{document_count:>10} {legacy_time:>12.4f} {indexed_time:>12.4f} {legacy_time / indexed_time:>8.1f}x")
+
+# Stages timed by benchmark_stages, in pipeline order
+STAGES = ["parse", "validate", "match", "flatten", "frames", "merge", "create_documents", "insert"]
+
+# Database the insert stage writes to and drops afterwards, so a real mongod's data is never touched
+benchmark_database = "Benchmark_Pipeline"
+
+first_measure_day = date(2024, 4, 21)
+
+# Mapped interface statistics, the octet and discard counters the dashboard queries read first, and system statistics
+interface_oids = sorted((oid for oid in ETL_Routers.description_mapping if oid.startswith("IP-MIB-ipIfStats")),
+                        key=lambda oid: not (("Octets" in oid and "Mcast" not in oid) or "Discards" in oid))
+system_oids = [oid for oid in ETL_Routers.description_mapping if oid.startswith("IP-MIB-ipSystemStats")]
+
+# One Config and one Stat document for the given number of routers, interfaces and timestamps, using the mapped OIDs
+def make_router_documents(router_count, interface_count, timestamp_count, oid_count=20, measure_date="21/04/2024"):
+    oids = interface_oids[:oid_count]
+    general_oids = system_oids[:oid_count]
+    config_routers = {}
+    traffic_routers = {}
+    for router_index in range(router_count):
+        ip_address = f"10.{router_index // 250}.{router_index % 250}.1"
+        config_time = f"{measure_date}  0:00:00"
+        config_routers[ip_address] = {"Measure_Time": {config_time: {
+            "Time": config_time,
+            **{f"IF-MIB-ifDescr.{interface}": f"GigabitEthernet0/{interface}" for interface in range(1, interface_count + 1)}
+        }}}
+        measurements = {}
+        for timestamp_index in range(timestamp_count):
+            measure_time = f"{measure_date}  {timestamp_index // 60 % 24}:{timestamp_index % 60:02d}:05"
+            entries = {"Time": measure_time}
+            # General rows carry 'ipv4 ' as in the real files, so create_documents does not fold them into the interfaces
+            for oid_index, oid in enumerate(general_oids):
+                entries[f"{oid}.ipv4 "] = (timestamp_index + 1) * (oid_index + 1)
+            for oid_index, oid in enumerate(oids):
+                for interface in range(1, interface_count + 1):
+                    entries[f"{oid}.ipv4.{interface}"] = (timestamp_index + 1) * (interface + oid_index)
+            measurements[measure_time] = entries
+        traffic_routers[ip_address] = {"Measure_Time": measurements}
+    return {"routers": config_routers}, {"routers": traffic_routers}
+
+# Builds and merges the frames of one pair in a fresh process, so its peak RSS is not shared with the other layout
+def measure_frames(config_doc, traffic_doc, categorical):
+    baseline_rss = peak_rss()
+    tracemalloc.start()
+    build_time, (config_df, traffic_df) = time_call(lambda: (
+        ETL_Routers.create_config_dataframe_from_document(config_doc, categorical),
+        ETL_Routers.create_stat_dataframe_from_document(traffic_doc, categorical)
+    ))
+    ETL_Routers.align_categories(traffic_df, config_df, ['IP_Address'])
+    merge_time, merged_df = time_call(pd.merge, traffic_df, config_df, 'left', ['IP_Address', 'Interface_ID'])
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    frame_bytes = traffic_df.memory_usage(deep=True).sum() + merged_df.memory_usage(deep=True).sum()
+    # The growth over the imports is what the frames cost
+    rss_growth = peak_rss() - baseline_rss if baseline_rss is not None else None
+    return len(merged_df), build_time, merge_time, frame_bytes, traced_peak, rss_growth
+
+def benchmark_frames(router_count, interface_count, timestamp_count):
+    config_doc, traffic_doc = make_router_documents(router_count, interface_count, timestamp_count)
+    print(f"{'layout':>12} {'rows':>9} {'build (s)':>10} {'merge (s)':>10} {'frames (MB)':>12} {'traced (MB)':>12} {'peak RSS (MB)':>14}")
+    for categorical in (False, True):
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            rows, build_time, merge_time, frame_bytes, traced_peak, peak_rss = executor.submit(
+                measure_frames, config_doc, traffic_doc, categorical).result()
+        rss = f"{peak_rss / 1e6:>14.1f}" if peak_rss is not None else f"{'n/a':>14}"
+        print(f"{'categorical' if categorical else 'object':>12} {rows:>9} {build_time:>10.3f} {merge_time:>10.3f} "
+              f"{frame_bytes / 1e6:>12.1f} {traced_peak / 1e6:>12.1f} {rss}")
+
+# Writes one Config_Router_ and one Stat_Router_ file per day, named like the production exports
+def write_router_files(directory, router_count, interface_count, oid_count, timestamp_count, days=1):
+    paths = []
+    for day in range(days):
+        measure_day = first_measure_day + timedelta(days=day)
+        documents = make_router_documents(router_count, interface_count, timestamp_count, oid_count, measure_day.strftime("%d/%m/%Y"))
+        for prefix, document in zip(("Config_Router_", "Stat_Router_"), documents):
+            path = os.path.join(directory, f"{prefix}{measure_day:%d%m%Y}.json")
+            with open(path, "w") as f:
+                json.dump(document, f)
+            paths.append(path)
+    return paths
+
+def get_benchmark_client(mongo_uri=None):
+    if mongo_uri:
+        return MongoClient(mongo_uri)
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("mongomock is not installed; pass --mongo-uri to insert into a running mongod instead.")
+    return mongomock.MongoClient()
+
+def check_written(collection, expected):
+    # Each generated metric has its own natural key, so the upserts must store every one of them
+    written = collection.count_documents({})
+    if written != expected:
+        raise AssertionError(f"{expected} documents created but {written} stored in {collection.name}")
+
+# Stores one traffic document in each ingest layout and times reading it back into a stat frame
+def benchmark_layouts(router_count, interface_count, oid_count, timestamp_count, mongo_uri=None, repeats=3):
+    _, traffic_doc = make_router_documents(router_count, interface_count, timestamp_count, oid_count)
+    client = get_benchmark_client(mongo_uri)
+    db = client[benchmark_database]
+    try:
+        dictionary = Columnar_Layout.OidDictionary(db[Columnar_Layout.OID_COLLECTION])
+        encode_time, routers = time_call(Columnar_Layout.encode_routers, traffic_doc["routers"], dictionary)
+        columnar_doc = {"routers": routers, Columnar_Layout.LAYOUT_FIELD: Columnar_Layout.COLUMNAR}
+        ETL_Routers._oid_dictionary = dictionary
+        print(f"Encoded in {encode_time:.3f} s, {len(dictionary.entries)} dictionary entries")
+        print(f"{'layout':>10} {'BSON (MB)':>10} {'load (s)':>10} {'stat frame (s)':>15} {'rows':>9}")
+        for name, document in (("nested", traffic_doc), ("columnar", columnar_doc)):
+            collection = db[f"Traffic_{name}"]
+            document_id = collection.insert_one(dict(document)).inserted_id
+            # Best of repeats, the first one also warming the key parsing caches
+            load_time = frame_time = math.inf
+            for _ in range(repeats):
+                elapsed, stored = time_call(collection.find_one, {"_id": document_id})
+                load_time = min(load_time, elapsed)
+                elapsed, traffic_df = time_call(lambda: ETL_Routers.create_stat_dataframe_from_document(
+                    ETL_Routers.resolve_layout(db, stored)))
+                frame_time = min(frame_time, elapsed)
+            print(f"{name:>10} {len(bson.encode(document)) / 1e6:>10.2f} {load_time:>10.3f} {frame_time:>15.3f} {len(traffic_df):>9}")
+    finally:
+        ETL_Routers._oid_dictionary = None
+        client.drop_database(benchmark_database)
+
+def load_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def validate_json(file_name, json_data):
+    if file_name.startswith("Stat"):
+        return Router_Files.validate_stat_json(json_data)
+    return Router_Files.validate_config_json(json_data)
+
+def run_stages(paths, mongo_uri=None):
+    """
+    Runs the ingest and ETL stages over a set of files, timing each stage on its own.
+
+    Every stage finishes for all files before the next one starts. 'frames'
+    includes its own flattening, which 'flatten' times separately.
+
+    Args:
+        paths (list): Stat_ / Config_ JSON files.
+        mongo_uri (str): mongod to insert into; mongomock is used when None.
+
+    Returns:
+        dict: 'rows', 'documents', 'input_bytes' and 'stages', which maps each
+        stage to its 'seconds' and 'peak_rss' (process high-water mark in
+        bytes once the stage is done, None on Windows).
+    """
+    stages = {}
+
+    def stage(name, function):
+        seconds, result = time_call(function)
+        stages[name] = {"seconds": seconds, "peak_rss": peak_rss()}
+        return result
+
+    documents = stage("parse", lambda: {os.path.basename(path): load_json(path) for path in paths})
+    invalid = stage("validate", lambda: [name for name, json_data in documents.items() if not validate_json(name, json_data)])
+    if invalid:
+        raise AssertionError(f"Generated files failed validation: {invalid}")
+
+    for file_name, json_data in documents.items():
+        json_data["_id"] = file_name
+    config_documents = [json_data for file_name, json_data in documents.items() if file_name.startswith("Config")]
+    traffic_documents = [json_data for file_name, json_data in documents.items() if file_name.startswith("Stat")]
+
+    pairs = stage("match", lambda: ETL_Routers.match_documents(config_documents, traffic_documents, set()))
+    stage("flatten", lambda: [ETL_Routers.flatten_measurements(document) for pair in pairs for document in pair])
+    frames = stage("frames", lambda: [
+        (ETL_Routers.create_stat_dataframe_from_document(traffic_doc), ETL_Routers.create_config_dataframe_from_document(config_doc))
+        for config_doc, traffic_doc in pairs
+    ])
+    merged = stage("merge", lambda: [ETL_Routers.merge_frames(traffic_df, config_df) for traffic_df, config_df in frames])
+    outputs = stage("create_documents", lambda: [ETL_Routers.create_documents(merged_df) for merged_df in merged])
+
+    client = get_benchmark_client(mongo_uri)
+    writer = MetricsWriter(database=benchmark_database, client=client)
+    try:
+        stage("insert", lambda: [writer.write(output) for output in outputs])
+        check_written(writer.collection, sum(len(output) for output in outputs))
+    finally:
+        client.drop_database(benchmark_database)
+
+    return {
+        "rows": sum(len(merged_df) for merged_df in merged),
+        "documents": sum(len(output) for output in outputs),
+        "input_bytes": sum(os.path.getsize(path) for path in paths),
+        "stages": stages
+    }
+
+# Generates the files of one scale point and runs the stages over them
+def measure_scale(router_count, interface_count, oid_count, timestamp_count, days, mongo_uri):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_router_files(directory, router_count, interface_count, oid_count, timestamp_count, days)
+        return run_stages(paths, mongo_uri)
+
+def benchmark_stages(router_counts, interface_count, oid_count, timestamp_count, days=1, mongo_uri=None):
+    """
+    Runs run_stages once per router count, each in a fresh process so peak
+    memory is measured per scale point, and prints per-stage timings,
+    throughput and how each stage scales with the number of rows.
+
+    Returns:
+        dict: run_stages results by router count.
+    """
+    results = {}
+    for router_count in router_counts:
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = results[router_count] = executor.submit(
+                measure_scale, router_count, interface_count, oid_count, timestamp_count, days, mongo_uri).result()
+        print(f"\nrouters={router_count} rows={result['rows']} documents={result['documents']} "
+              f"input={result['input_bytes'] / 1e6:.1f} MB")
+        print(f"{'stage':>18} {'seconds':>9} {'rows/s':>12} {'peak RSS (MB)':>14}")
+        for stage in STAGES:
+            seconds = result["stages"][stage]["seconds"]
+            rss = result["stages"][stage]["peak_rss"]
+            throughput = result["rows"] / seconds if seconds > 0 else float("inf")
+            rss = f"{rss / 1e6:>14.1f}" if rss is not None else f"{'n/a':>14}"
+            print(f"{stage:>18} {seconds:>9.3f} {throughput:>12.0f} {rss}")
+
+    smallest, largest = results[min(router_counts)], results[max(router_counts)]
+    if largest["rows"] > smallest["rows"]:
+        # Exponent k of time ~ rows^k between the smallest and largest run: 1 is linear
+        print(f"\nscaling from {smallest['rows']} to {largest['rows']} rows")
+        for stage in STAGES:
+            before, after = smallest["stages"][stage]["seconds"], largest["stages"][stage]["seconds"]
+            exponent = math.log(after / before) / math.log(largest["rows"] / smallest["rows"]) if before > 0 and after > 0 else float("nan")
+            print(f"{stage:>18} {exponent:>9.2f}")
+    return results
+
+def save_baseline(path, parameters, results):
+    baseline = {
+        "parameters": parameters,
+        "results": {str(router_count): {stage: result["stages"][stage]["seconds"] for stage in STAGES}
+                    for router_count, result in results.items()}
+    }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2)
+    print(f"Baseline written to {path}")
+
+def check_baseline(path, parameters, results, tolerance, min_seconds=0.05):
+    """
+    Compares stage timings with a baseline written by save_baseline.
+
+    A stage regresses when it is more than tolerance slower (0.5 = 50%) and
+    by at least min_seconds, so sub-second noise does not fail the check.
+
+    Returns:
+        list: (router_count, stage, baseline seconds, seconds) per regression.
+    """
+    baseline = load_json(path)
+    if baseline["parameters"] != parameters:
+        raise SystemExit(f"Baseline {path} was recorded with {baseline['parameters']}, not {parameters}")
+    regressions = []
+    for router_count, result in results.items():
+        for stage, baseline_seconds in baseline["results"].get(str(router_count), {}).items():
+            seconds = result["stages"][stage]["seconds"]
+            if seconds > baseline_seconds * (1 + tolerance) and seconds - baseline_seconds >= min_seconds:
+                regressions.append((router_count, stage, baseline_seconds, seconds))
+    for router_count, stage, baseline_seconds, seconds in regressions:
+        print(f"REGRESSION routers={router_count} {stage}: {baseline_seconds:.3f}s -> {seconds:.3f}s")
+    if not regressions:
+        print(f"No stage regressed by more than {tolerance:.0%} against {path}")
+    return regressions
+
+# Processed metrics of one generated pair per day
+def make_processed_documents(router_count, interface_count, oid_count, timestamp_count, days, rates=False):
+    documents = []
+    state_store = StateStore(":memory:") if rates else None
+    for day in range(days):
+        measure_day = first_measure_day + timedelta(days=day)
+        config_doc, traffic_doc = make_router_documents(router_count, interface_count, timestamp_count, oid_count,
+                                                        measure_day.strftime("%d/%m/%Y"))
+        day_documents = ETL_Routers.transform_pair(config_doc, traffic_doc)
+        if rates:
+            add_counter_rates(day_documents, state_store)
+        documents.extend(day_documents)
+    return documents
+
+# Dashboard queries over the middle days of the generated data, as (name, legacy filter, Measure_Timestamp filter)
+def dashboard_queries(days, router_count):
+    measure_days = [first_measure_day + timedelta(days=day) for day in range(days)]
+    selected = measure_days[1:-1] or measure_days
+    date_strings = [measure_day.strftime("%d/%m/%Y") for measure_day in selected]
+    # Local midnight of the first selected day to local midnight after the last, as UTC bounds
+    bounds = [f"{selected[0]:%d/%m/%Y} 0:00:00", f"{selected[-1] + timedelta(days=1):%d/%m/%Y} 0:00:00"]
+    utc_start, utc_end = (pd.Timestamp(bound).to_pydatetime() for bound in ETL_Routers.measure_timestamps_utc(bounds))
+    ip_address = f"10.{(router_count // 2) // 250}.{(router_count // 2) % 250}.1"
+    return [
+        ("router_range",
+         {"IP_Address": ip_address, "Interface_ID": 1, "Measure_Date": {"$in": date_strings}},
+         {"IP_Address": ip_address, "Interface_ID": 1, "Measure_Timestamp": {"$gte": utc_start, "$lt": utc_end}}),
+        ("all_routers_range",
+         {"Measure_Date": {"$in": date_strings}},
+         {"Measure_Timestamp": {"$gte": utc_start, "$lt": utc_end}})
+    ]
+
+def query_plan(collection, query):
+    # Keys and documents examined, from a real mongod; mongomock has no explain()
+    try:
+        stats = collection.find(query).explain()["executionStats"]
+    except (AttributeError, KeyError, NotImplementedError):
+        return None
+    return stats["totalKeysExamined"], stats["totalDocsExamined"]
+
+def benchmark_queries(router_count, interface_count, oid_count, timestamp_count, days, mongo_uri=None, repeats=5):
+    """
+    Compares the legacy layout (string dates, five single-field indexes)
+    with the Measure_Timestamp layout (compound QUERY_INDEXES) on inserts
+    and on the date-range queries behind the dashboards.
+
+    The legacy queries list every day with $in because dd/mm/yyyy strings do
+    not sort by date. Index usage is only meaningful against a real mongod
+    (--mongo-uri); mongomock scans every document either way.
+    """
+    documents = make_processed_documents(router_count, interface_count, oid_count, timestamp_count, days)
+    legacy_documents = [{field: value for field, value in document.items() if field != "Measure_Timestamp"}
+                        for document in documents]
+
+    client = get_benchmark_client(mongo_uri)
+    try:
+        timestamp_writer = MetricsWriter(database=benchmark_database, collection="Timestamp_Layout", client=client)
+        legacy_writer = MetricsWriter(database=benchmark_database, collection="Legacy_Layout", client=client)
+        for name in QUERY_INDEXES:
+            legacy_writer.collection.drop_index(name)
+        for name in LEGACY_QUERY_INDEXES:
+            legacy_writer.collection.create_index(name.rsplit("_", 1)[0])
+
+        print(f"routers={router_count} days={days} documents={len(documents)}")
+        print(f"{'':>20} {'legacy (s)':>12} {'timestamp (s)':>14} {'legacy keys/docs':>18} {'timestamp keys/docs':>20}")
+        legacy_seconds, _ = time_call(legacy_writer.write, legacy_documents)
+        timestamp_seconds, _ = time_call(timestamp_writer.write, documents)
+        check_written(legacy_writer.collection, len(documents))
+        check_written(timestamp_writer.collection, len(documents))
+        print(f"{'insert':>20} {legacy_seconds:>12.3f} {timestamp_seconds:>14.3f}")
+
+        for name, legacy_query, timestamp_query in dashboard_queries(days, router_count):
+            timings = []
+            for collection, query, sort in ((legacy_writer.collection, legacy_query, [("Measure_Date", 1), ("Measure_Time", 1)]),
+                                            (timestamp_writer.collection, timestamp_query, [("Measure_Timestamp", 1)])):
+                seconds = [time_call(lambda: list(collection.find(query, {"_id": 0}).sort(sort)))[0] for _ in range(repeats)]
+                plan = query_plan(collection, query)
+                timings.append((sorted(seconds)[repeats // 2], "n/a" if plan is None else f"{plan[0]}/{plan[1]}"))
+            legacy_count = legacy_writer.collection.count_documents(legacy_query)
+            timestamp_count = timestamp_writer.collection.count_documents(timestamp_query)
+            if legacy_count != timestamp_count:
+                raise AssertionError(f"{name}: legacy query matched {legacy_count} documents, timestamp query {timestamp_count}")
+            print(f"{name:>20} {timings[0][0]:>12.4f} {timings[1][0]:>14.4f} {timings[0][1]:>18} {timings[1][1]:>20}")
+    finally:
+        client.drop_database(benchmark_database)
+
+def benchmark_query_cache(router_count, interface_count, oid_count, timestamp_count, days, mongo_uri=None, repeats=5):
+    """
+    Times each named query of Metrics_Queries cold (cache cleared) and warm,
+    then writes one metric to the middle day of one router and shows which
+    cached results the write invalidated.
+    """
+    documents = make_processed_documents(router_count, interface_count, oid_count, timestamp_count, days, rates=True)
+    client = get_benchmark_client(mongo_uri)
+    try:
+        writer = MetricsWriter(database=benchmark_database, client=client)
+        writer.write(documents)
+        check_written(writer.collection, len(documents))
+        queries = Metrics_Queries.MetricsQueries(database=benchmark_database, client=client)
+        middle_day = first_measure_day + timedelta(days=days // 2)
+        last_day = first_measure_day + timedelta(days=days - 1)
+        ip_address = f"10.{(router_count // 2) // 250}.{(router_count // 2) % 250}.1"
+        named_queries = [
+            ("top_interfaces", {"day": middle_day, "limit": 10}),
+            ("router_discards", {"start": first_measure_day, "end": last_day}),
+            ("interface_series", {"ip_address": ip_address, "interface_id": 1, "start": middle_day, "end": middle_day}),
+            ("interface_series", {"ip_address": ip_address, "interface_id": 1, "start": first_measure_day, "end": first_measure_day})
+        ]
+
+        print(f"routers={router_count} days={days} documents={len(documents)}")
+        print(f"{'query':>18} {'from':>10} {'days':>5} {'rows':>7} {'cold (ms)':>10} {'warm (ms)':>10} {'speedup':>9}")
+        for name, params in named_queries:
+            cold, warm = [], []
+            for _ in range(repeats):
+                queries.cache.clear()
+                seconds, rows = time_call(lambda: queries.run(name, **params))
+                cold.append(seconds)
+            for _ in range(repeats):
+                warm.append(time_call(lambda: queries.run(name, **params))[0])
+            cold_seconds, warm_seconds = sorted(cold)[repeats // 2], sorted(warm)[repeats // 2]
+            start, end = params.get("start", params.get("day")), params.get("end", params.get("day"))
+            print(f"{name:>18} {start.isoformat():>10} {(end - start).days + 1:>5} {len(rows):>7} {cold_seconds * 1e3:>10.2f} {warm_seconds * 1e3:>10.3f} "
+                  f"{cold_seconds / warm_seconds if warm_seconds > 0 else float('inf'):>8.0f}x")
+
+        # The ETL writing to one router on one day only invalidates the results that read it
+        written = next(document for document in documents if document["IP_Address"] == ip_address
+                       and document["Measure_Date"] == middle_day.strftime("%d/%m/%Y"))
+        writer.write([dict(written)])
+        print(f"\nafter a write to {ip_address} on {middle_day}:")
+        for name, params in named_queries:
+            pipeline, _, _ = Metrics_Queries.QUERIES[name](**params)
+            cached = queries.cache.get((name, json.dumps(pipeline, default=str))) is not None
+            print(f"{name:>18} {params.get('start', params.get('day')).isoformat():>10} {'still cached' if cached else 'invalidated'}")
+    finally:
+        client.drop_database(benchmark_database)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ETL pipeline stages.")
+    parser.add_argument("--documents", type=int, nargs="+", default=[25, 50, 100, 200, 400])
+    parser.add_argument("--routers", type=int, default=20, help="Routers per document")
+    parser.add_argument("--frames", type=int, nargs=3, metavar=("ROUTERS", "INTERFACES", "TIMESTAMPS"),
+                        help="Compare the object and categorical stat/config frames instead of matching")
+    parser.add_argument("--stages", action="store_true",
+                        help="Time every ingest/ETL stage over generated Stat_/Config_ files instead of matching")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 2, 4], help="Router counts to run --stages at")
+    parser.add_argument("--interfaces", type=int, default=8, help="Interfaces per router")
+    parser.add_argument("--oids", type=int, default=20, help="Interface OIDs, and system (General) OIDs, per router, taken from description_mapping")
+    parser.add_argument("--timestamps", type=int, default=12, help="Measurements per router per file")
+    parser.add_argument("--days", type=int, default=1, help="Stat/Config file pairs per run")
+    parser.add_argument("--queries", action="store_true",
+                        help="Compare date-range dashboard queries on the string-date and Measure_Timestamp layouts "
+                             "(largest --scale, --days of data; use --days 7 or more)")
+    parser.add_argument("--layouts", action="store_true",
+                        help="Compare the nested and columnar ingest layouts: stored size, load and stat frame time "
+                             "(largest --scale routers)")
+    parser.add_argument("--query-cache", action="store_true",
+                        help="Time the named Metrics_Queries cold and warm and show what a write invalidates "
+                             "(largest --scale, --days of data)")
+    parser.add_argument("--mongo-uri", help="Insert into this mongod instead of mongomock, whose upserts slow down with collection size")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the --stages timings to PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="Exit with status 1 if a stage regressed against PATH")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown against --baseline (0.5 = 50%%)")
+    args = parser.parse_args()
+
+    if args.frames:
+        benchmark_frames(*args.frames)
+        return
+    if args.query_cache:
+        benchmark_query_cache(max(args.scale), args.interfaces, args.oids, args.timestamps, args.days, args.mongo_uri)
+        return
+    if args.layouts:
+        benchmark_layouts(max(args.scale), args.interfaces, args.oids, args.timestamps, args.mongo_uri)
+        return
+    if args.queries:
+        benchmark_queries(max(args.scale), args.interfaces, args.oids, args.timestamps, args.days, args.mongo_uri)
+        return
+    if args.stages:
+        parameters = {
+            "interfaces": args.interfaces, "oids": args.oids, "timestamps": args.timestamps, "days": args.days,
+            "backend": "mongod" if args.mongo_uri else "mongomock"
+        }
+        results = benchmark_stages(args.scale, args.interfaces, args.oids, args.timestamps, args.days, args.mongo_uri)
+        if args.save_baseline:
+            save_baseline(args.save_baseline, parameters, results)
+        if args.baseline and check_baseline(args.baseline, parameters, results, args.tolerance):
+            sys.exit(1)
+        return
+    benchmark_matching(args.documents, args.routers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+# Router_Traffic / Router_Configuration documents stored by encode_routers carry LAYOUT_FIELD = COLUMNAR
+LAYOUT_FIELD = "Layout"
+NESTED = "nested"
+COLUMNAR = "columnar"
+LAYOUTS = [NESTED, COLUMNAR]
+
+# Shared dictionary of the columnar layout, in the Router_Ingested database
+OID_COLLECTION = "Router_OIDs"
+
+# Dictionary entries of the IDs a loaded document uses, set by OidDictionary.attach; never stored
+ENTRIES_FIELD = "Oid_Entries"
+
+# Interface IDs are stored as BSON int32, and an OID ID and an interface ID share one int64 code when flattening
+max_interface_id = 2 ** 31 - 1
+
+
+def split_key(key):
+    """
+    Splits a raw Measure_Time key into (OID, Protocol, Interface_ID).
+
+    'IP-MIB-ipIfStatsInOctets.ipv4.7' gives ('IP-MIB-ipIfStatsInOctets', 'ipv4', 7)
+    and 'IF-MIB-ifDescr.7' gives ('IF-MIB-ifDescr', None, 7); for any key,
+    join_key rebuilds exactly the same string.
+
+    Args:
+        key (str): The raw key of a Measure_Time entry.
+
+    Returns:
+        tuple: (OID, Protocol or None, Interface_ID, 0 when there is none).
+    """
+    oid, interface_id = key, 0
+    head, _, tail = key.rpartition('.')
+    # Only IDs written back identically are split off, e.g. not '07'
+    if head and tail.isascii() and tail.isdigit() and str(int(tail)) == tail and 0 < int(tail) <= max_interface_id:
+        oid, interface_id = head, int(tail)
+    head, _, tail = oid.rpartition('.')
+    if head:
+        return head, tail, interface_id
+    return oid, None, interface_id
+
+
+def join_key(oid, protocol, interface_id):
+    # Inverse of split_key
+    key = oid if protocol is None else f"{oid}.{protocol}"
+    return f"{key}.{interface_id}" if interface_id else key
+
+
+class OidDictionary:
+    """
+    The (OID, Protocol) -> integer ID dictionary shared by every columnar document.
+
+    Entries live in Router_OIDs as {_id: ID, OID, Protocol}; IDs are handed
+    out from a counter document with $inc, so concurrent ingests never reuse
+    one, and a unique (OID, Protocol) index keeps a pair from getting two.
+
+    Args:
+        collection (Collection): Router_OIDs.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.ids = {}
+        self.entries = {}
+        collection.create_index([("OID", 1), ("Protocol", 1)], unique=True, name="oid_protocol",
+                                partialFilterExpression={"OID": {"$exists": True}})
+        self.refresh()
+
+    def refresh(self):
+        # Picks up the entries other processes added since the last load
+        for entry in self.collection.find({"OID": {"$exists": True}}):
+            self.ids[(entry["OID"], entry["Protocol"])] = entry["_id"]
+            self.entries[entry["_id"]] = (entry["OID"], entry["Protocol"])
+
+    def ensure_ids(self, pairs):
+        """Adds the (OID, Protocol) pairs not in the dictionary yet."""
+        missing = [pair for pair in dict.fromkeys(pairs) if pair not in self.ids]
+        if not missing:
+            return
+        counter = self.collection.find_one_and_update({"_id": "next_id"}, {"$inc": {"Next": len(missing)}},
+                                                      upsert=True, return_document=ReturnDocument.AFTER)
+        first_id = counter["Next"] - len(missing)
+        entries = [{"_id": first_id + position, "OID": oid, "Protocol": protocol} for position, (oid, protocol) in enumerate(missing)]
+        try:
+            self.collection.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            # Another ingest added some of the same pairs first; its IDs are the ones kept
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+        self.refresh()
+
+    def attach(self, document):
+        """
+        Copies the entries of the IDs a columnar document uses into it, so it
+        can be flattened or rebuilt without the dictionary, e.g. in a worker.
+
+        Returns:
+            dict: The same document.
+        """
+        used = set(chain.from_iterable(measurement["Oids"] for router_data in document.get("routers", {}).values()
+                                       for measurement in router_data.get("Measure_Time", {}).values()))
+        if not used.issubset(self.entries):
+            self.refresh()
+        document[ENTRIES_FIELD] = {oid_id: self.entries[oid_id] for oid_id in used}
+        return document
+
+
+def encode_routers(routers, dictionary):
+    """
+    Converts a 'routers' mapping to the columnar layout.
+
+    Every measurement becomes parallel 'Oids', 'Interfaces' and 'Values'
+    arrays, the OID and protocol of each key being an ID of the shared
+    dictionary, so no key string is stored with the document. The 'Time'
+    entry, which is not a metric, stays a plain field of the measurement.
+    Routers and measurements keep their IP address and Measure_Time keys,
+    so decode_routers gives back an equal mapping.
+
+    Args:
+        routers (dict): The 'routers' mapping of a validated Stat or Config file.
+        dictionary (OidDictionary): Gets any (OID, Protocol) pair it lacks.
+
+    Returns:
+        dict: The columnar 'routers' mapping.
+    """
+    splits = {}
+    for router_data in routers.values():
+        for entries in router_data["Measure_Time"].values():
+            for key in entries:
+                if key not in splits and key != "Time":
+                    splits[key] = split_key(key)
+    dictionary.ensure_ids((oid, protocol) for oid, protocol, _ in splits.values())
+
+    codes = {key: (dictionary.ids[(oid, protocol)], interface_id) for key, (oid, protocol, interface_id) in splits.items()}
+    encoded = {}
+    for ip_address, router_data in routers.items():
+        measurements = {}
+        for measure_time, entries in router_data["Measure_Time"].items():
+            coded = [(codes[key], value) for key, value in entries.items() if key != "Time"]
+            measurement = {"Time": entries["Time"]} if "Time" in entries else {}
+            measurement["Oids"] = [code[0] for code, _ in coded]
+            measurement["Interfaces"] = [code[1] for code, _ in coded]
+            measurement["Values"] = [value for _, value in coded]
+            measurements[measure_time] = measurement
+        encoded[ip_address] = {**router_data, "Measure_Time": measurements}
+    return encoded
+
+
+def decode_routers(routers, entries):
+    """
+    Rebuilds the nested 'routers' mapping of a columnar document.
+
+    Args:
+        routers (dict): The columnar 'routers' mapping.
+        entries (dict): ID -> (OID, Protocol), e.g. OidDictionary.entries.
+
+    Returns:
+        dict: The mapping as stored in the nested layout.
+    """
+    decoded = {}
+    for ip_address, router_data in routers.items():
+        measurements = {}
+        for measure_time, measurement in router_data["Measure_Time"].items():
+            keys = [join_key(*entries[oid_id], interface_id)
+                    for oid_id, interface_id in zip(measurement["Oids"], measurement["Interfaces"])]
+            nested = {"Time": measurement["Time"]} if "Time" in measurement else {}
+            nested.update(zip(keys, measurement["Values"]))
+            measurements[measure_time] = nested
+        decoded[ip_address] = {**router_data, "Measure_Time": measurements}
+    return decoded
+
+
+def read_document(document, dictionary):
+    """
+    Returns a stored Router_Traffic / Router_Configuration document in the
+    nested layout, whichever layout it was stored in.
+
+    Args:
+        document (dict): The stored document.
+        dictionary (OidDictionary): Used when the document has no attached entries.
+
+    Returns:
+        dict: A copy in the nested layout; a nested document is returned as is.
+    """
+    if document is None or document.get(LAYOUT_FIELD) != COLUMNAR:
+        return document
+    if ENTRIES_FIELD not in document:
+        dictionary.attach(document)
+    nested = {field: value for field, value in document.items() if field not in (LAYOUT_FIELD, ENTRIES_FIELD)}
+    nested["routers"] = decode_routers(document["routers"], document[ENTRIES_FIELD])
+    return nested
+
+
+def columnar_measurements(document):
+    """
+    Flattens an attached columnar document like Router_Schema.flatten_document.
+
+    The ID arrays are concatenated and each distinct (OID ID, interface ID)
+    pair is turned into its key string once, so no per-entry string is
+    hashed or parsed; 'Time' is outside the arrays, so nothing is skipped.
+
+    Args:
+        document (dict): A columnar document passed through OidDictionary.attach.
+
+    Returns:
+        tuple: (keys, key_codes, values, ip_addresses, measure_times, sizes),
+        the same columns flatten_document collects from the nested document.
+    """
+    entries = document[ENTRIES_FIELD]
+    oid_arrays, interface_arrays, values = [], [], []
+    ip_addresses, measure_times, sizes = [], [], []
+    for ip_address, router_data in document["routers"].items():
+        for measure_time, measurement in router_data["Measure_Time"].items():
+            oid_arrays.append(measurement["Oids"])
+            interface_arrays.append(measurement["Interfaces"])
+            values.extend(measurement["Values"])
+            ip_addresses.append(ip_address)
+            measure_times.append(measure_time)
+            sizes.append(len(measurement["Oids"]))
+
+    oids = np.fromiter(chain.from_iterable(oid_arrays), dtype=np.int64, count=len(values))
+    interfaces = np.fromiter(chain.from_iterable(interface_arrays), dtype=np.int64, count=len(values))
+    # Keys numbered in order of first appearance, as flatten_document numbers them
+    key_codes, pairs = pd.factorize(oids * (max_interface_id + 1) + interfaces)
+    keys = [join_key(*entries[int(pair) // (max_interface_id + 1)], int(pair) % (max_interface_id + 1)) for pair in pairs]
+    return keys, key_codes.astype(np.intp), values, ip_addresses, measure_times, sizes
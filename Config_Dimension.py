@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+# Columns of the frames added to an InterfaceDimension
+DIMENSION_FIELDS = ["IP_Address", "Interface_ID", "Interface_Name", "Interface_Description", "Snapshot_Time"]
+
+MEASURE_TIME_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+
+def measurement_timestamps(frame):
+    """
+    Parses Measure_Date / Measure_Time once per distinct pair.
+
+    Works on the codes of categorical columns, so no per-row strings are built.
+
+    Args:
+        frame (DataFrame): Rows with 'Measure_Date' (dd/mm/yyyy) and 'Measure_Time' (H:MM:SS).
+
+    Returns:
+        tuple: (codes, timestamps) where row i was measured at timestamps[codes[i]].
+    """
+    date_codes, dates = pd.factorize(frame["Measure_Date"])
+    time_codes, times = pd.factorize(frame["Measure_Time"])
+    codes, pairs = pd.factorize(date_codes.astype(np.int64) * max(len(times), 1) + time_codes)
+    texts = [f"{dates[pair // len(times)]} {times[pair % len(times)]}" for pair in pairs]
+    return codes, pd.to_datetime(pd.Series(texts, dtype=object), format=MEASURE_TIME_FORMAT).to_numpy()
+
+
+def drop_unchanged_snapshots(frame):
+    # A router snapshot listing exactly the interfaces of its previous snapshot adds nothing to the as-of join
+    frame = frame.sort_values(["IP_Address", "Snapshot_Time", "Interface_ID"], kind="stable", ignore_index=True)
+    if frame.empty:
+        return frame
+    row_hashes = pd.util.hash_pandas_object(frame[["Interface_ID", "Interface_Name", "Interface_Description"]], index=False)
+    group_codes = frame.groupby(["IP_Address", "Snapshot_Time"], sort=True).ngroup().to_numpy()
+    signatures = row_hashes.groupby(group_codes).agg(tuple).to_numpy()
+    group_ips = frame["IP_Address"].to_numpy()[np.flatnonzero(np.diff(group_codes, prepend=-1))]
+    unchanged = np.zeros(len(signatures), dtype=bool)
+    unchanged[1:] = (group_ips[1:] == group_ips[:-1]) & (signatures[1:] == signatures[:-1])
+    return frame[~unchanged[group_codes]].reset_index(drop=True)
+
+
+class InterfaceDimension:
+    """
+    The interfaces of every router, versioned by config snapshot time.
+
+    Config documents are added once and kept for every later traffic batch,
+    instead of being paired with and rebuilt for each traffic document.
+    Traffic rows take the interfaces of the most recent snapshot of their
+    router at or before their measure time, or of the router's first
+    snapshot when they predate all of them.
+    """
+
+    def __init__(self):
+        self._snapshots = []
+        self._frame = None
+        self.last_id = None  # _id of the last config document added, to fetch only newer ones
+
+    def add(self, config_df, document_id=None):
+        """
+        Adds the interfaces of one config document.
+
+        Args:
+            config_df (DataFrame): DIMENSION_FIELDS, with 'Snapshot_Time' as
+                'dd/mm/yyyy H:MM:SS' strings.
+            document_id: _id of the config document.
+        """
+        frame = config_df[DIMENSION_FIELDS].copy()
+        for column in ["IP_Address", "Interface_Name", "Snapshot_Time"]:
+            frame[column] = frame[column].astype(object)
+        self._snapshots.append(frame)
+        self._frame = None
+        if document_id is not None:
+            self.last_id = document_id
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            if self._snapshots:
+                frame = pd.concat(self._snapshots, ignore_index=True)
+            else:
+                frame = pd.DataFrame({field: pd.Series(dtype=object) for field in DIMENSION_FIELDS})
+                frame["Interface_ID"] = frame["Interface_ID"].astype(np.int32)
+            codes, uniques = pd.factorize(frame["Snapshot_Time"])
+            frame["Snapshot_Time"] = pd.to_datetime(pd.Series(uniques, dtype=object), format=MEASURE_TIME_FORMAT).to_numpy()[codes]
+            # A config file ingested twice yields the same snapshot twice; the later copy wins
+            frame = frame.drop_duplicates(["IP_Address", "Snapshot_Time", "Interface_ID"], keep="last")
+            self._frame = drop_unchanged_snapshots(frame)
+        return self._frame
+
+    def routers(self):
+        return set(self.frame["IP_Address"].unique())
+
+    def snapshot_times(self, ip_addresses, timestamps):
+        """
+        Picks the snapshot each (router, measure time) reads its interfaces from.
+
+        Args:
+            ip_addresses (ndarray): Router of each lookup.
+            timestamps (ndarray): datetime64 measure time of each lookup.
+
+        Returns:
+            ndarray: datetime64 snapshot time per lookup, NaT for routers
+            without any snapshot.
+        """
+        lookups = pd.DataFrame({"IP_Address": ip_addresses, "Timestamp": timestamps, "_lookup": np.arange(len(timestamps))})
+        lookups["IP_Address"] = lookups["IP_Address"].astype(object)
+        lookups = lookups.sort_values("Timestamp", kind="stable")
+        snapshots = self.frame[["IP_Address", "Snapshot_Time"]].drop_duplicates().sort_values("Snapshot_Time")
+        result = np.full(len(timestamps), np.datetime64("NaT"), dtype="datetime64[ns]")
+        for direction in ("backward", "forward"):
+            matched = pd.merge_asof(lookups, snapshots, left_on="Timestamp", right_on="Snapshot_Time",
+                                    by="IP_Address", direction=direction)
+            found = matched["Snapshot_Time"].notna().to_numpy()
+            result[matched["_lookup"].to_numpy()[found]] = matched["Snapshot_Time"].to_numpy()[found]
+            lookups = lookups[~lookups["_lookup"].isin(matched["_lookup"][found])]
+            if lookups.empty:
+                break
+        return result
+
+    def join(self, traffic_df):
+        """
+        Left-joins stat rows with the interfaces of their router as of their measure time.
+
+        Args:
+            traffic_df (DataFrame): From create_stat_dataframe_from_document.
+
+        Returns:
+            DataFrame: traffic_df's columns in its row order, plus
+            Interface_Name and Interface_Description.
+        """
+        pair_codes, pair_timestamps = measurement_timestamps(traffic_df)
+        ip_codes, ip_addresses = pd.factorize(traffic_df["IP_Address"])
+        # One as-of lookup per measurement rather than per row
+        lookup_codes, lookups = pd.factorize(ip_codes.astype(np.int64) * max(len(pair_timestamps), 1) + pair_codes)
+        step = max(len(pair_timestamps), 1)
+        snapshot_times = self.snapshot_times(np.asarray(ip_addresses, dtype=object)[lookups // step],
+                                             pair_timestamps[lookups % step])
+
+        dimension = self.frame[self.frame["IP_Address"].isin(ip_addresses)]
+        dimension = dimension.drop(columns="IP_Address").assign(IP_Address=dimension["IP_Address"].to_numpy())
+        if isinstance(traffic_df["IP_Address"].dtype, pd.CategoricalDtype):
+            # Same categories on both sides, so the merge compares codes
+            dimension["IP_Address"] = pd.Categorical(dimension["IP_Address"], categories=traffic_df["IP_Address"].cat.categories)
+        dimension["Interface_ID"] = dimension["Interface_ID"].astype(traffic_df["Interface_ID"].dtype)
+
+        rows = traffic_df.assign(Snapshot_Time=snapshot_times[lookup_codes])
+        merged_df = pd.merge(rows, dimension, on=["IP_Address", "Interface_ID", "Snapshot_Time"], how="left")
+        return merged_df.drop(columns="Snapshot_Time")
@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+
+from Metrics_Rollup import local_measure_times
+
+# A counter series: one statistic of one interface of one router
+SERIES_KEY = ["IP_Address", "Interface_ID", "New_Stat_Description", "Protocol_Version"]
+
+# Fields add_counter_rates sets on every document
+RATE_FIELDS = ["Stat_Delta", "Interval_Seconds", "Stat_Rate"]
+
+COUNTER32_MODULUS = 2 ** 32
+
+# High-capacity (HC) statistics are 64-bit counters; the others are 32-bit
+HIGH_CAPACITY_PATTERN = r"HC|High.Capacity"
+
+# counter_state timestamps; ISO strings compare in time order
+STATE_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def series_keys(frame):
+    keys = frame[SERIES_KEY[0]].astype(str)
+    for column in SERIES_KEY[1:]:
+        keys = keys + "|" + frame[column].astype(str)
+    return keys
+
+
+def compute_counter_rates(frame, previous=None):
+    """
+    Turns cumulative counter values into per-interval deltas and rates.
+
+    Rows are ordered by timestamp within each series and differenced against
+    the previous row, or against the persisted previous value for the first
+    row of a batch. A drop in a 32-bit counter whose previous value was in
+    its upper half is a wrap (2^32 is added back). Any other drop, including
+    on 64-bit counters, is taken as a reset such as a router reboot, and the
+    counter is assumed to have restarted from zero.
+
+    Args:
+        frame (DataFrame): SERIES_KEY columns plus 'Timestamp' (datetime64) and 'Stat_Value'.
+        previous (DataFrame): Last known 'Timestamp' / 'Stat_Value' per series,
+            with the same key columns, measured before every row of its
+            series in frame; may be None.
+
+    Returns:
+        tuple: (deltas, seconds, rates) aligned with frame, and a DataFrame
+        with the latest 'Timestamp' / 'Stat_Value' per series to persist.
+        Deltas are an exact UInt64 array, as 64-bit counters do not fit a
+        float64 above 2^53, and seconds and rates float arrays; all three
+        are missing (NA / NaN) where a row has no earlier value.
+    """
+    rows = frame[SERIES_KEY + ["Timestamp", "Stat_Value"]].assign(_row=np.arange(len(frame)))
+    # Converted before the concat, which would turn an int64 and a uint64 column into float64
+    values = counter_values(frame["Stat_Value"])
+    if previous is not None and len(previous):
+        rows = pd.concat([previous[SERIES_KEY + ["Timestamp", "Stat_Value"]].assign(_row=-1), rows], ignore_index=True)
+        values = np.concatenate([counter_values(previous["Stat_Value"]), values])
+
+    codes = rows.groupby(SERIES_KEY, sort=False, dropna=False).ngroup().to_numpy()
+    timestamps = rows["Timestamp"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    order = np.lexsort((timestamps, codes))
+    codes, timestamps = codes[order], timestamps[order]
+    values = values[order]
+    row_numbers = rows["_row"].to_numpy()[order]
+    is_64bit = rows["New_Stat_Description"].astype(str).str.contains(HIGH_CAPACITY_PATTERN, regex=True).to_numpy()[order]
+
+    deltas = np.zeros(len(values), dtype=np.uint64)
+    has_delta = np.zeros(len(values), dtype=bool)
+    seconds = np.full(len(values), np.nan)
+    if len(values) > 1:
+        same_series = codes[1:] == codes[:-1]
+        previous_values, current_values = values[:-1], values[1:]
+        dropped = current_values < previous_values
+        # uint64 arithmetic is modulo 2^64, so a 32-bit wrap comes out exact once 2^32 is added back
+        step = current_values - previous_values
+        wrapped = dropped & ~is_64bit[1:] & (previous_values >= COUNTER32_MODULUS // 2) & (previous_values < COUNTER32_MODULUS)
+        step = np.where(wrapped, step + np.uint64(COUNTER32_MODULUS), step)
+        deltas[1:] = np.where(dropped & ~wrapped, current_values, step)
+        has_delta[1:] = same_series
+        seconds[1:] = np.where(same_series, (timestamps[1:] - timestamps[:-1]) / 1e9, np.nan)
+
+    # Only the rate is a float
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates = np.where(has_delta & (seconds > 0), deltas.astype(np.float64) / seconds, np.nan)
+
+    aligned = row_numbers >= 0
+    positions = row_numbers[aligned]
+    frame_deltas, missing = np.zeros(len(frame), dtype=np.uint64), np.ones(len(frame), dtype=bool)
+    frame_seconds, frame_rates = np.full(len(frame), np.nan), np.full(len(frame), np.nan)
+    frame_deltas[positions], missing[positions] = deltas[aligned], ~has_delta[aligned]
+    frame_seconds[positions], frame_rates[positions] = seconds[aligned], rates[aligned]
+
+    last_positions = np.flatnonzero(np.append(codes[1:] != codes[:-1], True))
+    latest = rows.iloc[order[last_positions]][SERIES_KEY + ["Timestamp"]].reset_index(drop=True)
+    latest["Stat_Value"] = values[last_positions]
+    return pd.arrays.IntegerArray(frame_deltas, missing), frame_seconds, frame_rates, latest
+
+
+def counter_values(values):
+    # Counters as uint64; integer columns are cast directly, others (e.g. Python ints above 2^63) converted one by one
+    array = values.to_numpy()
+    if array.dtype.kind in "iu":
+        return array.astype(np.uint64)
+    return np.array([int(value) for value in array], dtype=np.uint64)
+
+
+def counter_frame(documents):
+    # The SERIES_KEY, 'Timestamp' and 'Stat_Value' columns compute_counter_rates reads
+    frame = pd.DataFrame(documents, columns=SERIES_KEY + ["Measure_Date", "Measure_Time", "Stat_Value"])
+    frame["Timestamp"] = local_measure_times(frame)
+    return frame
+
+
+def set_counter_rates(documents, frame, previous=None):
+    """
+    Sets Stat_Delta, Interval_Seconds and Stat_Rate on documents.
+
+    Args:
+        documents (list): Documents produced by create_documents.
+        frame (DataFrame): counter_frame(documents).
+        previous (DataFrame): Last known 'Timestamp' / 'Stat_Value' per series; may be None.
+
+    Returns:
+        DataFrame: The latest 'Timestamp' / 'Stat_Value' per series.
+    """
+    deltas, seconds, rates, latest = compute_counter_rates(frame, previous)
+    for document, delta, interval, rate in zip(documents, deltas.tolist(), seconds.tolist(), rates.tolist()):
+        document["Stat_Delta"] = None if delta is pd.NA else int(delta)
+        document["Interval_Seconds"] = None if np.isnan(interval) else interval
+        document["Stat_Rate"] = None if np.isnan(rate) else rate
+    return latest
+
+
+def preceding_state(state, earliest):
+    """
+    Picks the stored value a batch's series is differenced from.
+
+    Args:
+        state (tuple): (measured_at, value, base_measured_at, base_value) from StateStore.counter_states.
+        earliest (str): Time of the series' first row in the batch, in STATE_TIME_FORMAT.
+
+    Returns:
+        tuple: (measured_at, value), or None when no stored value is older
+        than the batch, e.g. when an older batch is re-run.
+    """
+    measured_at, value, base_measured_at, base_value = state
+    if measured_at < earliest:
+        return measured_at, value
+    # The batch that stored the value is being replayed, e.g. after a crash before it was marked processed
+    if base_measured_at is not None and base_measured_at < earliest:
+        return base_measured_at, base_value
+    return None
+
+
+def add_counter_rates(documents, state_store):
+    """
+    Adds Stat_Delta, Interval_Seconds and Stat_Rate to a batch of documents.
+
+    The last value of each series is read from and written back to the
+    state store, so incremental runs never re-read history. The value each
+    batch was differenced from is stored with it, so replaying the latest
+    batch gives the same rates instead of differencing it against itself.
+
+    Args:
+        documents (list): Documents produced by create_documents.
+        state_store (StateStore): Holds the last value per series.
+
+    Returns:
+        list: The same documents, updated in place.
+    """
+    if not documents:
+        return documents
+    frame = counter_frame(documents)
+    keys = series_keys(frame)
+
+    stored = state_store.counter_states(keys.unique().tolist())
+    bases = {}
+    if stored:
+        earliest = frame["Timestamp"].groupby(keys, sort=False).min().dt.strftime(STATE_TIME_FORMAT)
+        for key, state in stored.items():
+            base = preceding_state(state, earliest[key])
+            if base is not None:
+                bases[key] = base
+    previous = None
+    if bases:
+        previous = frame.loc[~keys.duplicated() & keys.isin(list(bases)), SERIES_KEY].copy()
+        previous_keys = keys[previous.index]
+        previous["Timestamp"] = pd.to_datetime([bases[key][0] for key in previous_keys])
+        previous["Stat_Value"] = [bases[key][1] for key in previous_keys]
+
+    latest = set_counter_rates(documents, frame, previous)
+    latest_keys = series_keys(latest)
+    state_store.update_counter_states(zip(
+        latest_keys,
+        latest["Timestamp"].dt.strftime(STATE_TIME_FORMAT),
+        latest["Stat_Value"].tolist(),
+        [bases.get(key, (None, None))[0] for key in latest_keys],
+        [bases.get(key, (None, None))[1] for key in latest_keys]
+    ))
+    return documents
@@ -1,89 +1,282 @@
-from collections import defaultdict
+import os
+import re
+import glob
+import argparse
+import logging
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-from pathlib import Path
-from pymongo import MongoClient
+from Metrics_Writer import MetricsWriter, get_client
+from Metrics_Rollup import RollupWriter
+from Counter_Rates import add_counter_rates, RATE_FIELDS
+from State_Store import StateStore
+from Router_Schema import flatten_document
+from Config_Dimension import InterfaceDimension
+from Columnar_Layout import LAYOUT_FIELD, COLUMNAR, OID_COLLECTION, OidDictionary, columnar_measurements
+from Pipeline_Metrics import metrics, peak_rss, configure_logging, add_instrumentation_arguments
+
+logger = logging.getLogger("ETL_Routers")
 
 # Connect to MongoDB and retrieve documents
 def connect_to_mongodb():
-    client = MongoClient("mongodb://localhost:27017/")
+    # Shared client, so a long-lived runner keeps its connections warm between runs
+    client = get_client("mongodb://localhost:27017/")
     db = client["Router_Ingested"]
     return db
 
-def get_documents(db):
+# Set on Router_Configuration / Router_Traffic documents once the ETL has consumed them
+PROCESSED_FIELD = "ETL_Processed"
+
+# Reduces each router entry to its first key, which is all match_documents needs
+ROUTER_KEYS_PROJECTION = {
+    "routers": {"$arrayToObject": {"$map": {
+        "input": {"$objectToArray": {"$ifNull": ["$routers", {}]}},
+        "as": "router",
+        "in": {
+            "k": "$$router.k",
+            "v": {"$arrayToObject": {"$slice": [{"$map": {
+                "input": {"$objectToArray": "$$router.v"},
+                "as": "entry",
+                "in": {"k": "$$entry.k", "v": True}
+            }}, 1]}}
+        }
+    }}}
+}
+
+def ensure_source_indexes(db):
+    for collection_name in ("Router_Configuration", "Router_Traffic"):
+        db[collection_name].create_index([(PROCESSED_FIELD, 1), ("_id", 1)])
+
+def get_documents(db, incremental=False, keys_only=None):
+    """
+    Retrieves the config and traffic documents to match.
+
+    Args:
+        db (Database): The Router_Ingested database.
+        incremental (bool): Only fetch documents not yet marked processed.
+        keys_only (bool): Project the documents down to their router keys;
+            full documents are then loaded per pair with
+            load_matched_documents. Defaults to incremental.
+
+    Returns:
+        tuple: (config_documents, traffic_documents). With keys_only the
+        config documents are a streaming cursor.
+    """
     config_collection = db["Router_Configuration"]
     traffic_collection = db["Router_Traffic"]
-    config_documents = list(config_collection.find())
-    traffic_documents = list(traffic_collection.find())
+    if keys_only is None:
+        keys_only = incremental
+    if not keys_only:
+        config_documents = [resolve_layout(db, document) for document in config_collection.find()]
+        traffic_documents = [resolve_layout(db, document) for document in traffic_collection.find()]
+        return config_documents, traffic_documents
+
+    pipeline = [{"$match": {PROCESSED_FIELD: None}}] if incremental else []
+    pipeline += [
+        {"$sort": {"_id": 1}},
+        {"$project": ROUTER_KEYS_PROJECTION}
+    ]
+    config_documents = config_collection.aggregate(pipeline)
+    traffic_documents = list(traffic_collection.aggregate(pipeline))
     return config_documents, traffic_documents
 
-# Process documents
-def process_documents(config_documents, traffic_documents, processed_documents_file):
-    matched_documents = []  # List to store matched documents
-    processed_document_ids = set()  # Set to store processed document IDs
+def load_matched_documents(db, matched_documents):
+    """
+    Yields the full documents for pairs matched on projected documents.
 
-    processed_documents_path = Path(processed_documents_file)
+    A config document is fetched once for its consecutive pairs.
+    """
+    config_collection = db["Router_Configuration"]
+    traffic_collection = db["Router_Traffic"]
+    config_doc = None
+    for config_keys, traffic_keys in matched_documents:
+        if config_doc is None or config_doc["_id"] != config_keys["_id"]:
+            config_doc = resolve_layout(db, config_collection.find_one({"_id": config_keys["_id"]}))
+        yield config_doc, resolve_layout(db, traffic_collection.find_one({"_id": traffic_keys["_id"]}))
 
-    # Load processed document IDs from the file
-    if processed_documents_path.exists():
-        with open(processed_documents_path, 'r') as f:
-            processed_document_ids = set(line.strip() for line in f)
+_oid_dictionary = None
+
+def resolve_layout(db, document):
+    """
+    Attaches the OID dictionary entries a columnar document uses, so the
+    frames can be built from it here or in a worker process; documents in
+    the nested layout are returned unchanged.
+    """
+    global _oid_dictionary
+    if document is None or document.get(LAYOUT_FIELD) != COLUMNAR:
+        return document
+    if _oid_dictionary is None:
+        _oid_dictionary = OidDictionary(db[OID_COLLECTION])
+    return _oid_dictionary.attach(document)
+
+# Memory one stat row is budgeted in a streamed router group, frames, merge and documents included
+# (about 800 bytes under tracemalloc around transform_pair, rounded up for allocator overhead)
+stream_bytes_per_row = 1024
+
+def router_row_counts(collection, document_id):
+    """
+    Counts the stat rows of every router of a stored document without loading it.
+
+    Returns:
+        dict: Entries under Measure_Time (the 'Time' entries of nested
+        documents included) per IP address, in document order.
+    """
+    pipeline = [
+        {"$match": {"_id": document_id}},
+        {"$project": {"routers": {"$map": {
+            "input": {"$objectToArray": {"$ifNull": ["$routers", {}]}},
+            "as": "router",
+            "in": {"k": "$$router.k", "v": {"$map": {
+                "input": {"$objectToArray": {"$ifNull": ["$$router.v.Measure_Time", {}]}},
+                "as": "measurement",
+                # A columnar measurement has one 'Oids' entry per metric
+                "in": {"$size": {"$ifNull": ["$$measurement.v.Oids", {"$objectToArray": "$$measurement.v"}]}}
+            }}}
+        }}}}
+    ]
+    document = next(collection.aggregate(pipeline), None)
+    # One size per measurement comes back, summed here
+    return {router["k"]: sum(router["v"]) for router in document["routers"]} if document else {}
+
+def plan_router_groups(row_counts, max_rows):
+    """
+    Splits routers, in document order, into consecutive groups of at most
+    max_rows rows; a router larger than max_rows is a group of its own.
+
+    Returns:
+        list: Lists of IP addresses.
+    """
+    groups, group, group_rows = [], [], 0
+    for ip_address, rows in row_counts.items():
+        if group and group_rows + rows > max_rows:
+            groups.append(group)
+            group, group_rows = [], 0
+        group.append(ip_address)
+        group_rows += rows
+    if group:
+        groups.append(group)
+    return groups
+
+def load_router_group(collection, document_id, ip_addresses):
+    # IP addresses contain dots, so the group is filtered server-side instead of projected by path
+    pipeline = [
+        {"$match": {"_id": document_id}},
+        {"$project": {"routers": {"$arrayToObject": {"$filter": {
+            "input": {"$objectToArray": "$routers"},
+            "as": "router",
+            "cond": {"$in": ["$$router.k", list(ip_addresses)]}
+        }}}, LAYOUT_FIELD: 1}}
+    ]
+    document = next(collection.aggregate(pipeline), None)
+    return resolve_layout(collection.database, document) if document is not None else {"_id": document_id, "routers": {}}
+
+def mark_documents_processed(collection, document_ids):
+    if document_ids:
+        collection.update_many({"_id": {"$in": list(document_ids)}}, {"$set": {PROCESSED_FIELD: True}})
+
+def get_router_time(router_data):
+    """
+    Returns the key used to pair a router's config and traffic entries.
+
+    Args:
+        router_data (dict): The per-router entry of a 'routers' mapping.
+
+    Returns:
+        str: The first key of the router entry, or None if it is empty.
+    """
+    return next(iter(router_data), None) if router_data else None
+
+def build_traffic_index(traffic_documents):
+    """
+    Indexes traffic documents by (IP address, measure time).
+
+    Args:
+        traffic_documents (list): Traffic documents in retrieval order.
+
+    Returns:
+        dict: Maps each (ip_address, measure_time) key to the positions of
+        the traffic documents carrying it, in ascending order.
+    """
+    traffic_index = defaultdict(list)
+    for position, traffic_doc in enumerate(traffic_documents):
+        for ip_address, router_data in traffic_doc.get('routers', {}).items():
+            traffic_time = get_router_time(router_data)
+            if traffic_time is not None:
+                traffic_index[(ip_address, traffic_time)].append(position)
+    return traffic_index
+
+def match_documents(config_documents, traffic_documents, processed_document_ids):
+    """
+    Pairs config documents with traffic documents in a single pass.
+
+    Each traffic document is consumed by the first config document (in
+    retrieval order) sharing one of its (IP address, measure time) keys,
+    and pairs are returned in the order the config routers are visited.
+
+    Args:
+        config_documents (list): Config documents in retrieval order.
+        traffic_documents (list): Traffic documents in retrieval order.
+        processed_document_ids (set): IDs of config documents to skip.
+
+    Returns:
+        list: The matched (config_doc, traffic_doc) tuples.
+    """
+    matched_documents = []
+    traffic_index = build_traffic_index(traffic_documents)
+    consumed = [False] * len(traffic_documents)
 
     for config_doc in config_documents:
         config_doc_id = str(config_doc['_id'])  # Convert ObjectId to string
         # Check if the config document ID has already been processed
         if config_doc_id in processed_document_ids:
-            print(f"Config document {config_doc_id} already processed. Skipping.")
+            logger.debug("Config document %s already processed. Skipping.", config_doc_id)
             continue  # Skip processing this document
-        
+
         config_routers = config_doc.get('routers', {})
         for ip_address, router_data in config_routers.items():
-            config_time = list(router_data.keys())[0] if router_data else None
+            config_time = get_router_time(router_data)
             if not config_time:
                 continue
-            for traffic_doc in traffic_documents[:]:  # Iterate over a copy of traffic_documents
-                traffic_routers = traffic_doc.get('routers', {})
-                traffic_router_data = traffic_routers.get(ip_address, {})
-                traffic_time = list(traffic_router_data.keys())[0] if traffic_router_data else None
-                if config_time == traffic_time:
-                    matched_documents.append((config_doc, traffic_doc))
-                    print("Match found between config document and traffic document:")
-                    print("Config Document:", config_doc["_id"])
-                    print("Traffic Document:", traffic_doc["_id"])
-                    traffic_documents.remove(traffic_doc)  # Remove the matched traffic document
-
-    if matched_documents:
-        # Update processed documents file
-        update_processed_documents(matched_documents, processed_documents_path)
-    else:
-        print("No matching documents found.")
+            # Every remaining document under this key is matched at once, so the bucket can be dropped
+            for position in traffic_index.pop((ip_address, config_time), ()):
+                if consumed[position]:
+                    continue
+                consumed[position] = True
+                traffic_doc = traffic_documents[position]
+                matched_documents.append((config_doc, traffic_doc))
+                logger.debug("Match found between config document %s and traffic document %s",
+                             config_doc["_id"], traffic_doc["_id"])
 
     return matched_documents
 
+# Process documents
+def process_documents(config_documents, traffic_documents, processed_documents):
+    """
+    Matches config documents with traffic documents not yet processed.
 
+    Args:
+        config_documents (iterable): Config documents in retrieval order.
+        traffic_documents (list): Traffic documents in retrieval order.
+        processed_documents: Container of processed document IDs, usually
+            StateStore.processed_documents.
 
+    Returns:
+        list: The matched (config_doc, traffic_doc) tuples.
+    """
+    with metrics.span("etl.match"):
+        # Traffic documents already written are not paired again
+        traffic_documents = [traffic_doc for traffic_doc in traffic_documents
+                             if str(traffic_doc['_id']) not in processed_documents]
 
+        matched_documents = match_documents(config_documents, traffic_documents, processed_documents)
+    metrics.increment("etl.pairs_matched", len(matched_documents))
 
+    if not matched_documents:
+        logger.info("No matching documents found.")
 
-def update_processed_documents(matched_documents, file_path):
-    processed_document_ids = set()  # Set to store processed document IDs
-    
-    # Load processed document IDs from the file
-    with open(file_path, 'r') as f:
-        for line in f:
-            processed_document_ids.add(line.strip())
-    
-    with open(file_path, 'a') as f:  # Open the file in append mode
-        for config_doc, traffic_doc in matched_documents:
-            config_doc_id = str(config_doc['_id'])
-            traffic_doc_id = str(traffic_doc['_id'])
-            if config_doc_id not in processed_document_ids:
-                f.write(config_doc_id + '\n')
-            if traffic_doc_id not in processed_document_ids:
-                f.write(traffic_doc_id + '\n')
-            processed_document_ids.add(config_doc_id)
-            processed_document_ids.add(traffic_doc_id)
-    
-    print("Matched document IDs saved to 'processed_documents.txt'.")
+    return matched_documents
 
 
 
@@ -147,41 +340,12 @@ def remove_protocol_version(stat_description):
     return description_without_protocol
 
 
-def create_stat_dataframe_from_document(stat_document):
-
-    print("Creating DataFrame from Stat document")
-
-    df_list = []
-    for ip_address, ip_data in stat_document["routers"].items():
-        for measure_time, stats in ip_data["Measure_Time"].items():
-            for stat_description, stat_value in stats.items():
-                if stat_description == "Time":  # Skip 'Time' entry
-                    continue
-                interface_id = extract_interface_id(stat_description)
-                if interface_id != 0:
-                    stat_description = remove_interface_id(stat_description)
-                protocol_version = extract_protocol_version(stat_description)
-                stat_description = remove_protocol_version(stat_description)
-                measure_date = measure_time.split()[0]
-                measure_Time = measure_time.split()[1]
-
-                df_list.append({
-                    'IP_Address': ip_address,
-                    'Measure_Date': measure_date,
-                    'Measure_Time': measure_Time,
-                    'Protocol_Version': protocol_version,
-                    'Stat_Description': stat_description,
-                    'Interface_ID': interface_id,
-                    'Stat_Value': stat_value
-                })
-
-    stat_df = pd.DataFrame(df_list)
-
-    description_mapping = {
+# Readable names for the IP-MIB statistics, keyed by the description without interface ID and protocol
+description_mapping = {
     "IP-MIB-ipIfStatsInBcastPkts" : "IP Interface Inbound Broadcast Packets",
     "IP-MIB-ipIfStatsInDiscards" :  "IP Interface Inbound Discarded Packets",
     "IP-MIB-ipIfStatsInMcastOctets" : "IP Interface Inbound Multicast Octets",
-    "IP-MIB-ipIfStatsInMcastPkts" : "IP Interface Inbound Multicast Packets",  
+    "IP-MIB-ipIfStatsInMcastPkts" : "IP Interface Inbound Multicast Packets",
     "IP-MIB-ipIfStatsHCOutMcastPkts" : "IP Interface Outbound Multicast Packets(High Capacity)",
     "IP-MIB-ipIfStatsHCOutMcastOctets" : "IP Interface Outbound Multicast Octets(High Capacity)",
     "IP-MIB-ipIfStatsInAddrErrors" :  "IP Interface Inbound Address Errors",
@@ -192,7 +356,7 @@ def create_stat_dataframe_from_document(stat_document):
     "IP-MIB-ipIfStatsHCInMcastOctets" : "IP Interface Inbound Multicast Octets(High_Capacity)",
     "IP-MIB-ipIfStatsHCOutBcastPkts" : "IP Interface Outbound Broadcast Packets(High_Capacity)",
     "IP-MIB-ipIfStatsHCInMcastPkts" : "IP Interface Inbound Multicast Packets(High_Capacity)",
-    "IP-MIB-ipSystemStatsOutNoRoutes" : "IP System Outbound Packets with No Routes",    
+    "IP-MIB-ipSystemStatsOutNoRoutes" : "IP System Outbound Packets with No Routes",
     "IP-MIB-ipIfStatsOutFragFails": "IP Interface Out Fragmentation Failures",
     "IP-MIB-ipIfStatsOutFragOKs": "IP Interface Out Fragmentation Successes",
     "IP-MIB-ipIfStatsOutFragReqds": "IP Interface Out Fragmentation Requests",
@@ -265,173 +429,853 @@ def create_stat_dataframe_from_document(stat_document):
     "IP-MIB-ipIfStatsOutFragCreates": "IP Interface Outbound Fragmentation Creates"
 }
 
-    # Map the values in the Stat_Description column using the mapping dictionary
-    stat_df['New_Stat_Description'] = stat_df['Stat_Description'].map(description_mapping)
 
-    # For entries where mapping doesn't exist, keep the original description
-    stat_df['New_Stat_Description'].fillna(stat_df['Stat_Description'], inplace=True)
+@lru_cache(maxsize=None)
+def parse_stat_key(stat_key):
+    """
+    Splits a raw stat key such as 'IP-MIB-ipIfStatsInOctets.ipv4.7' once.
+
+    The same few hundred keys repeat for every router and timestamp, so
+    results are memoized.
+
+    Args:
+        stat_key (str): The raw key of a Measure_Time entry.
+
+    Returns:
+        tuple: (Stat_Description, Interface_ID, Protocol_Version).
+    """
+    stat_description = stat_key
+    interface_id = extract_interface_id(stat_description)
+    if interface_id != 0:
+        stat_description = remove_interface_id(stat_description)
+    protocol_version = extract_protocol_version(stat_description)
+    stat_description = remove_protocol_version(stat_description)
+    return stat_description, interface_id, protocol_version
+
+@lru_cache(maxsize=None)
+def parse_config_key(interface_key):
+    """
+    Splits a raw config key such as 'IF-MIB-ifDescr.7' once.
 
-    print("Stat Data Frame:")
-    print(stat_df.head())
-    print("Length of stat_df:", len(stat_df))
+    Args:
+        interface_key (str): The raw key of a Measure_Time entry.
+
+    Returns:
+        tuple: (Interface_ID, Interface_Name).
+    """
+    return extract_interface_id(interface_key), interface_key.split('.')[0]
+
+@lru_cache(maxsize=4096)
+def parse_measure_time(measure_time):
+    """
+    Splits a timestamp such as '21/04/2024  0:30:05' into date and time.
+
+    Args:
+        measure_time (str): The Measure_Time key.
+
+    Returns:
+        tuple: (Measure_Date, Measure_Time).
+    """
+    parts = measure_time.split()
+    return parts[0], parts[1]
+
+# Time zone the routers report Measure_Time in; Measure_Timestamp is stored in UTC
+measure_timezone = "Africa/Tunis"
+
+def measure_timestamps_utc(measure_times, timezone=None):
+    """
+    Parses Measure_Time keys into UTC datetimes, once per distinct key.
+
+    Args:
+        measure_times (list): Keys such as '21/04/2024  0:30:05', in the
+            routers' local time.
+        timezone (str): Time zone of the keys; defaults to measure_timezone.
+
+    Returns:
+        ndarray: Naive datetime64 values in UTC (what BSON dates store),
+        aligned with measure_times.
+    """
+    codes, uniques = pd.factorize(pd.Series(measure_times, dtype=object))
+    local_times = pd.to_datetime(pd.Series([" ".join(parse_measure_time(measure_time)) for measure_time in uniques], dtype=object),
+                                 format="%d/%m/%Y %H:%M:%S")
+    # A repeated hour when clocks go back is read as standard time, a skipped one is moved forward
+    utc_times = local_times.dt.tz_localize(timezone or measure_timezone, ambiguous=np.zeros(len(uniques), dtype=bool),
+                                           nonexistent="shift_forward").dt.tz_convert("UTC").dt.tz_localize(None)
+    return utc_times.to_numpy(dtype="datetime64[ns]")[codes]
+
+def flatten_measurements(document, kind=None):
+    """
+    Collects the Measure_Time entries of a document into column arrays.
+
+    Raw keys are stored once and referenced by integer code, and the IP
+    address and timestamp are stored once per measurement rather than once
+    per metric.
+
+    Args:
+        document (dict): A Stat or Config document with a 'routers' mapping.
+        kind (str): Router_Schema.STAT or CONFIG to validate the document
+            in the same walk; None for documents validated at ingestion.
+            Columnar documents (see Columnar_Layout) are read from their ID
+            arrays and never validated.
+
+    Returns:
+        tuple: (keys, key_codes, values, ip_addresses, measure_times, sizes)
+        where row i belongs to the measurement repeated sizes[j] times.
+
+    Raises:
+        SchemaViolation: If kind is given and the document breaks its schema.
+    """
+    if document.get(LAYOUT_FIELD) == COLUMNAR:
+        return columnar_measurements(document)
+    keys, key_codes, values, ip_addresses, measure_times, sizes = flatten_document(document, kind).columns()
+    return keys, np.asarray(key_codes, dtype=np.intp), values, ip_addresses, measure_times, sizes
+
+# Every New_Stat_Description the mapping produces, so frames of different batches share their categories
+stat_description_categories = pd.Index(list(dict.fromkeys(description_mapping.values())), dtype=object)
+
+# Interface name and description given to the Interface_ID = 0 rows after the merge
+general_categories = pd.Index(['General'], dtype=object)
+
+def broadcast_column(values, codes, categorical=True, categories=None):
+    """
+    Expands one value per group (distinct key or measurement) to one value per row.
+
+    As a Categorical each distinct value is stored once and every row holds
+    a small integer code, instead of a pointer to a Python string.
+
+    Args:
+        values (list): One value per group.
+        codes (ndarray): The group of each row.
+        categorical (bool): Return a Categorical rather than an object array.
+        categories (Index): Leading categories shared across frames; values
+            missing from it are appended.
+
+    Returns:
+        Categorical or ndarray: One value per row.
+    """
+    values = np.array(values, dtype=object)
+    if not categorical:
+        return values[codes]
+    value_codes, uniques = pd.factorize(values)
+    uniques = pd.Index(uniques, dtype=object)
+    if categories is not None:
+        uniques = categories.append(uniques.difference(categories, sort=False))
+        value_codes = uniques.get_indexer(values)
+    return pd.Categorical.from_codes(value_codes[codes], categories=uniques)
+
+def measurement_codes(sizes):
+    # Row -> measurement, for values stored once per measurement
+    return np.repeat(np.arange(len(sizes), dtype=np.intp), sizes)
+
+def create_stat_dataframe_from_document(stat_document, categorical=True, measurements=None):
+    """
+    Builds the stat DataFrame of a Router_Traffic document.
+
+    Args:
+        stat_document (dict): The Router_Traffic document.
+        categorical (bool): Store the repeated string columns as categoricals
+            and Interface_ID as int32; False keeps object columns and int64.
+        measurements (tuple): flatten_measurements output for the document,
+            e.g. from Router_Files.parse_router_file, so it is not walked again.
+
+    Returns:
+        DataFrame: One row per metric of every measurement.
+    """
+    logger.debug("Creating DataFrame from Stat document")
+
+    if measurements is None:
+        with metrics.span("etl.flatten"):
+            measurements = flatten_measurements(stat_document)
+    keys, key_codes, values, ip_addresses, measure_times, sizes = measurements
+
+    # Parse each distinct key and timestamp once, then broadcast to the rows
+    parsed_keys = [parse_stat_key(key) for key in keys]
+    stat_descriptions = [parsed[0] for parsed in parsed_keys]
+    interface_ids = np.array([parsed[1] for parsed in parsed_keys], dtype=np.int32 if categorical else np.int64)
+    protocol_versions = [parsed[2] for parsed in parsed_keys]
+    new_stat_descriptions = [description_mapping.get(description, description) for description in stat_descriptions]
+    parsed_times = [parse_measure_time(measure_time) for measure_time in measure_times]
+    row_measurements = measurement_codes(sizes)
+    measure_timestamps = measure_timestamps_utc(measure_times)
+
+    stat_df = pd.DataFrame({
+        'IP_Address': broadcast_column(ip_addresses, row_measurements, categorical),
+        'Measure_Date': broadcast_column([parsed[0] for parsed in parsed_times], row_measurements, categorical),
+        'Measure_Time': broadcast_column([parsed[1] for parsed in parsed_times], row_measurements, categorical),
+        'Measure_Timestamp': measure_timestamps[row_measurements],
+        'Protocol_Version': broadcast_column(protocol_versions, key_codes, categorical),
+        'Stat_Description': broadcast_column(stat_descriptions, key_codes, categorical),
+        'Interface_ID': interface_ids[key_codes],
+        'Stat_Value': pd.Series(values, dtype=None if values else np.int64),
+        # Entries without a mapping keep their original description
+        'New_Stat_Description': broadcast_column(new_stat_descriptions, key_codes, categorical, stat_description_categories)
+    })
+
+    logger.debug("Stat Data Frame (%d rows):\n%s", len(stat_df), stat_df.head())
     return stat_df
 
 
 
-def create_config_dataframe_from_document(config_document):
+def create_config_dataframe_from_document(config_document, categorical=True, measurements=None, with_snapshot_time=False):
+    """
+    Builds the interface DataFrame of a Router_Configuration document.
 
-    print("Creating DataFrame from Config document")
+    Args:
+        config_document (dict): The Router_Configuration document.
+        categorical (bool): Store IP_Address and Interface_Name as categoricals
+            and Interface_ID as int32; False keeps object columns and int64.
+        measurements (tuple): flatten_measurements output for the document,
+            so it is not walked again.
+        with_snapshot_time (bool): Add 'Snapshot_Time', the 'dd/mm/yyyy H:MM:SS'
+            time of each row's measurement, for an InterfaceDimension.
 
-    df_list = []
-    for ip_address, ip_data in config_document["routers"].items():
-        for measure_time, interfaces in ip_data["Measure_Time"].items():
-            for interface, interface_description in interfaces.items():
-                if interface == "Time":  # Skip 'Time' entry
-                    continue
-                interface_id = extract_interface_id(interface)
-                interface_name = interface.split('.')[0]
-                measure_date = measure_time.split()[0]
-
-                df_list.append({
-                    'IP_Address': ip_address,
-                    'Interface_ID': interface_id,
-                    'Interface_Name': interface_name,
-                    'Interface_Description': interface_description
-                })
-
-    config_df = pd.DataFrame(df_list)
-
-    print("Config Data Frame:")
-    print(config_df.head())
-    print("Length of config_df:", len(config_df))
+    Returns:
+        DataFrame: One row per interface entry of every measurement.
+    """
+    logger.debug("Creating DataFrame from Config document")
+
+    if measurements is None:
+        with metrics.span("etl.flatten"):
+            measurements = flatten_measurements(config_document)
+    keys, key_codes, values, ip_addresses, measure_times, sizes = measurements
+
+    parsed_keys = [parse_config_key(key) for key in keys]
+    interface_ids = np.array([parsed[0] for parsed in parsed_keys], dtype=np.int32 if categorical else np.int64)
+    interface_names = [parsed[1] for parsed in parsed_keys]
+
+    config_df = pd.DataFrame({
+        'IP_Address': broadcast_column(ip_addresses, measurement_codes(sizes), categorical),
+        'Interface_ID': interface_ids[key_codes],
+        'Interface_Name': broadcast_column(interface_names, key_codes, categorical, general_categories),
+        'Interface_Description': pd.Series(values, dtype=None if values else object)
+    })
+    if with_snapshot_time:
+        snapshot_times = [" ".join(parse_measure_time(measure_time)) for measure_time in measure_times]
+        config_df['Snapshot_Time'] = broadcast_column(snapshot_times, measurement_codes(sizes), categorical)
+
+    logger.debug("Config Data Frame (%d rows):\n%s", len(config_df), config_df.head())
     return config_df
 
+def align_categories(left, right, columns):
+    """
+    Gives categorical columns the same categories in both frames, so a merge
+    compares their integer codes instead of the strings.
+
+    Args:
+        left (DataFrame): Updated in place.
+        right (DataFrame): Updated in place.
+        columns (list): Columns to align; non-categorical ones are skipped.
+    """
+    for column in columns:
+        if isinstance(left[column].dtype, pd.CategoricalDtype) and isinstance(right[column].dtype, pd.CategoricalDtype):
+            categories = left[column].cat.categories.append(right[column].cat.categories.difference(left[column].cat.categories, sort=False))
+            left[column] = left[column].cat.set_categories(categories)
+            right[column] = right[column].cat.set_categories(categories)
+
+# Key shared by an interface row and the Interface_ID = 0 "General" rows folded into it
+DOCUMENT_KEY = ["Protocol_Version", "Measure_Date", "Measure_Time", "IP_Address"]
+
+DOCUMENT_FIELDS = [
+    "IP_Address",
+    "Measure_Date",
+    "Measure_Time",
+    "Measure_Timestamp",
+    "Interface_ID",
+    "Interface_Name",
+    "Interface_Description",
+    "Protocol_Version",
+    "New_Stat_Description",
+    "Stat_Value"
+]
+
 def create_documents(merged_df):
-    documents = []
-    # Use defaultdict to store interfaces by (Protocol_Version, Measure_Date, Measure_Time, IP_Address)
-    interfaces_dict = defaultdict(list)
-    
-    # Separate rows with Interface_ID = 0
+    """
+    Builds one document per non-zero interface metric of the merged frame.
+
+    The General rows (Interface_ID = 0) sharing a metric's key are folded
+    into it: their Stat_Value is added and the last one's
+    New_Stat_Description replaces the metric's own.
+
+    Args:
+        merged_df (DataFrame): Stat rows merged with the config interfaces.
+
+    Returns:
+        list: Documents ordered by the first appearance of their key.
+    """
+    # Separate rows with Interface_ID = 0, keyed once per (Protocol_Version, Measure_Date, Measure_Time, IP_Address)
     interface_0_rows = merged_df[merged_df['Interface_ID'] == 0]
+    general_values = interface_0_rows.groupby(DOCUMENT_KEY, sort=False, dropna=False, observed=True)['Stat_Value'].sum()
+    general_descriptions = interface_0_rows.drop_duplicates(DOCUMENT_KEY, keep='last').set_index(DOCUMENT_KEY)
+    general_descriptions = general_descriptions['New_Stat_Description'].reindex(general_values.index)
 
-    # Filter out rows where Stat_Value is 0
+    # Filter out rows where Stat_Value is 0 and order the remaining interface rows by their key's first appearance
     merged_df = merged_df[merged_df['Stat_Value'] != 0]
+    key_order = merged_df.groupby(DOCUMENT_KEY, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    is_interface = (merged_df['Interface_ID'] != 0).to_numpy()
+    other_metrics = merged_df[is_interface]
+    other_metrics = other_metrics.iloc[key_order[is_interface].argsort(kind='stable')]
+    other_metrics = other_metrics[DOCUMENT_FIELDS].copy()
 
-    # Group rows by key (excluding Interface_ID = 0 rows)
-    for _, row in merged_df.iterrows():
-        key = (row["Protocol_Version"], row["Measure_Date"], row["Measure_Time"], row["IP_Address"])
-        interfaces_dict[key].append(row)
-    
-    # Iterate over groups and create documents
-    for key, rows in interfaces_dict.items():
-        general_metrics = [row for row in rows if row["Interface_ID"] == 0]
-        other_metrics = [row for row in rows if row["Interface_ID"] != 0]
-        
-        # Create documents for other metrics
-        for other_metric in other_metrics:
-            other_doc = {
-                "IP_Address": other_metric["IP_Address"],
-                "Measure_Date": other_metric["Measure_Date"],
-                "Measure_Time": other_metric["Measure_Time"],
-                "Interface_ID": other_metric["Interface_ID"],
-                "Interface_Name": other_metric["Interface_Name"],
-                "Interface_Description": other_metric["Interface_Description"],
-                "Protocol_Version": other_metric["Protocol_Version"],
-                "New_Stat_Description": other_metric["New_Stat_Description"],
-                "Stat_Value": other_metric["Stat_Value"]
-            }
-            
-            # Find matching Interface_ID = 0 rows
-            matching_rows = interface_0_rows[
-                (interface_0_rows['Protocol_Version'] == other_metric['Protocol_Version']) &
-                (interface_0_rows['Measure_Date'] == other_metric['Measure_Date']) &
-                (interface_0_rows['Measure_Time'] == other_metric['Measure_Time']) &
-                (interface_0_rows['IP_Address'] == other_metric['IP_Address'])
-            ]
-            
-            # Add New_Stat_Description and Stat_Value from matching Interface_ID = 0 rows
-            for _, matching_row in matching_rows.iterrows():
-                other_doc['New_Stat_Description'] = matching_row['New_Stat_Description']
-                other_doc['Stat_Value'] += matching_row['Stat_Value']  # Add Stat_Value
-                
-            documents.append(other_doc)
-    
-    return documents
+    # Add New_Stat_Description and Stat_Value from matching Interface_ID = 0 rows
+    positions = general_values.index.get_indexer(pd.MultiIndex.from_frame(other_metrics[DOCUMENT_KEY]))
+    matched = positions >= 0
+    stat_values = other_metrics['Stat_Value'].to_numpy(copy=True)
+    stat_values[matched] = stat_values[matched] + general_values.to_numpy()[positions[matched]]
+    descriptions = other_metrics['New_Stat_Description'].to_numpy(dtype=object, copy=True)
+    descriptions[matched] = general_descriptions.to_numpy(dtype=object)[positions[matched]]
+    other_metrics['Stat_Value'] = stat_values
+    other_metrics['New_Stat_Description'] = descriptions
+
+    return other_metrics.to_dict('records')
 
 
 #insert the document into mongodb collection
-def insert_documents_into_mongodb(documents):
+def insert_documents_into_mongodb(documents, writer=None):
     """
-    Insert documents into a MongoDB collection.
+    Upsert documents into the Processed_Routers_Metrics collection.
     
     Args:
         documents (list): List of documents to be inserted into MongoDB.
+        writer (MetricsWriter): Writer to use; defaults to one shared per process.
     """
-    # Connect to MongoDB
-    client = MongoClient("mongodb://localhost:27017/")
-    db = client["Processed_DataBase"]  
-    collection = db["Processed_Routers_Metrics"] 
-
-    # Add indexes to the collection
-    collection.create_index("IP_Address")
-    collection.create_index("Measure_Date")
-    collection.create_index("Measure_Time")
-    collection.create_index("Protocol_Version")
-    collection.create_index("Interface_ID") 
-    
-    # Insert documents into the collection
-    collection.insert_many(documents)
-    print("Documents inserted into MongoDB successfully.")
+    if writer is None:
+        writer = get_default_writer()
+
+    with metrics.span("etl.insert"):
+        result = writer.write(documents)
+    metrics.increment("etl.documents_upserted", result["upserted"])
+    metrics.increment("etl.documents_matched", result["matched"])
+    logger.info("Documents written to MongoDB: %d inserted, %d already present.", result["upserted"], result["matched"])
+    if result["errors"]:
+        metrics.increment("etl.write_errors", len(result["errors"]))
+        logger.warning("%d documents failed to write.", len(result["errors"]))
+    return result
+
+
+def export_documents_to_parquet(documents, output_dir, batch_id, partition_by_ip=False):
+    """
+    Append documents to a Parquet dataset partitioned by measure day.
+
+    Files are hive-partitioned (Measure_Day=YYYY-MM-DD[/IP_Address=...]) and
+    named after batch_id, so the BI layer reads only new partitions and a
+    re-run of the same batch overwrites its own files instead of appending
+    duplicates. A batch written in several parts gets one batch_id per part;
+    remove_parquet_batch clears its files before the first part.
+
+    Args:
+        documents (list): Documents produced by create_documents.
+        output_dir (str): Root directory of the dataset.
+        batch_id (str): Stable identifier of the batch, e.g. the traffic document ID.
+        partition_by_ip (bool): Also partition by IP_Address.
+    """
+    if not documents:
+        return
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow)") from e
+
+    # Rates are kept when the batch went through add_counter_rates
+    frame = pd.DataFrame(documents, columns=DOCUMENT_FIELDS + [field for field in RATE_FIELDS if field in documents[0]])
+    if "Stat_Delta" in frame:
+        # Deltas are exact integers, which the frame holds as float64 once a None is among them
+        frame["Stat_Delta"] = pd.array([document["Stat_Delta"] for document in documents], dtype="Int64")
+    # Measure_Date is dd/mm/yyyy; the partition key is ISO so it sorts and contains no path separators
+    frame["Measure_Day"] = pd.to_datetime(frame["Measure_Date"], format="%d/%m/%Y").dt.strftime("%Y-%m-%d")
+    partition_cols = ["Measure_Day", "IP_Address"] if partition_by_ip else ["Measure_Day"]
+
+    pq.write_to_dataset(
+        pa.Table.from_pandas(frame, preserve_index=False),
+        root_path=output_dir,
+        partition_cols=partition_cols,
+        basename_template=f"{batch_id}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        compression="zstd"
+    )
+    logger.info("Documents exported to Parquet under %s.", output_dir)
+
+def remove_parquet_batch(output_dir, batch_id):
+    """
+    Deletes the Parquet files of an earlier run of a batch, written whole
+    ('<batch_id>-<i>.parquet') or in parts ('<batch_id>_<part>-<i>.parquet'),
+    so a re-run split differently, e.g. under another memory budget, does
+    not leave the old parts next to the new ones.
+
+    Returns:
+        int: The number of files deleted.
+    """
+    removed = 0
+    file_name = re.compile(rf"{re.escape(batch_id)}(_\d+)?-\d+\.parquet")
+    for path in glob.glob(os.path.join(glob.escape(output_dir), "**", f"{glob.escape(batch_id)}*.parquet"), recursive=True):
+        if file_name.fullmatch(os.path.basename(path)):
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+_default_writer = None
+
+def get_default_writer():
+    global _default_writer
+    if _default_writer is None:
+        _default_writer = MetricsWriter()
+    return _default_writer
+
+
+def merge_frames(traffic_df, config_df):
+    """
+    Left-joins the stat rows with the interfaces of their router.
+
+    Args:
+        traffic_df (DataFrame): From create_stat_dataframe_from_document.
+        config_df (DataFrame): From create_config_dataframe_from_document.
+
+    Returns:
+        DataFrame: The stat rows with Interface_Name / Interface_Description,
+        set to 'General' for Interface_ID = 0.
+    """
+    # Merge data frames based on common columns
+    align_categories(traffic_df, config_df, ['IP_Address'])
+    merged_df = pd.merge(traffic_df, config_df, on=['IP_Address', 'Interface_ID'], how='left')
+    logger.debug("Columns of merged_df: %s", list(merged_df.columns))
+    return fill_general_interfaces(merged_df)
+
+def fill_general_interfaces(merged_df):
+    # Replace empty columns for Interface_ID = 0
+    merged_df.loc[merged_df['Interface_ID'] == 0, 'Interface_Name'] = 'General'
+    merged_df.loc[merged_df['Interface_ID'] == 0, 'Interface_Description'] = 'General'
+    return merged_df
+
+_interface_dimension = None
+
+def get_interface_dimension(db):
+    """
+    Returns the process-wide InterfaceDimension, first adding the config
+    documents ingested since the last call.
+
+    Every config document is loaded once per process, whether or not it
+    was already matched, since any of them can be the snapshot in effect
+    for a traffic document.
+    """
+    global _interface_dimension
+    if _interface_dimension is None:
+        _interface_dimension = InterfaceDimension()
+    dimension = _interface_dimension
+    query = {} if dimension.last_id is None else {"_id": {"$gt": dimension.last_id}}
+    with metrics.span("etl.load_dimension"):
+        for config_doc in db["Router_Configuration"].find(query, {"routers": 1, LAYOUT_FIELD: 1}).sort("_id", 1):
+            resolve_layout(db, config_doc)
+            config_df = create_config_dataframe_from_document(config_doc, with_snapshot_time=True)
+            dimension.add(config_df, config_doc["_id"])
+            metrics.increment("etl.config_documents_loaded")
+    return dimension
+
+def transform_traffic(traffic_doc, dimension):
+    """
+    Runs the DataFrame stages for one traffic document against the interface dimension.
+
+    Args:
+        traffic_doc (dict): The Router_Traffic document.
+        dimension (InterfaceDimension): Interfaces by router and snapshot time.
+
+    Returns:
+        list: The documents to write to Processed_Routers_Metrics.
+    """
+    with metrics.span("etl.stat_frame"):
+        traffic_df = create_stat_dataframe_from_document(traffic_doc)
+    metrics.increment("etl.stat_rows", len(traffic_df))
+
+    with metrics.span("etl.merge"):
+        merged_df = fill_general_interfaces(dimension.join(traffic_df))
+
+    with metrics.span("etl.create_documents"):
+        documents = create_documents(merged_df)
+    metrics.increment("etl.documents_created", len(documents))
+    return documents
+
+def transform_pair(config_doc, traffic_doc):
+    """
+    Runs the DataFrame stages for one matched pair.
+
+    Args:
+        config_doc (dict): The Router_Configuration document.
+        traffic_doc (dict): The Router_Traffic document.
+
+    Returns:
+        list: The documents to write to Processed_Routers_Metrics.
+    """
+    # Create data frames from config and traffic documents
+    with metrics.span("etl.config_frame"):
+        config_df = create_config_dataframe_from_document(config_doc)
+
+    with metrics.span("etl.stat_frame"):
+        traffic_df = create_stat_dataframe_from_document(traffic_doc)
+    return transform_frames(traffic_df, config_df)
+
+def transform_frames(traffic_df, config_df):
+    # Merge and document stages, shared by whole pairs and streamed router groups
+    metrics.increment("etl.stat_rows", len(traffic_df))
+    with metrics.span("etl.merge"):
+        merged_df = merge_frames(traffic_df, config_df)
+
+    #Create documents for insertion into MongoDB
+    with metrics.span("etl.create_documents"):
+        documents = create_documents(merged_df)
+    metrics.increment("etl.documents_created", len(documents))
+    return documents
 
+def iter_router_group_documents(traffic_collection, document_id, config_df, max_rows):
+    """
+    Transforms a stored traffic document one router group at a time.
+
+    Yields:
+        list: The documents of each group; the group's frames are released
+        before it is yielded and the next group is only loaded once the
+        caller asks for it.
+    """
+    for group in plan_router_groups(router_row_counts(traffic_collection, document_id), max_rows):
+        with metrics.span("etl.load_group"):
+            traffic_doc = load_router_group(traffic_collection, document_id, group)
+        with metrics.span("etl.stat_frame"):
+            traffic_df = create_stat_dataframe_from_document(traffic_doc)
+        del traffic_doc
+        metrics.increment("etl.stream_groups")
+        metrics.high_water("etl.stream_group_rows", len(traffic_df))
+        # Only the group's routers take part in the merge
+        documents = transform_frames(traffic_df, config_df[config_df["IP_Address"].isin(group)].copy())
+        del traffic_df
+        yield documents
+        rss = peak_rss()
+        if rss is not None:
+            metrics.high_water("etl.peak_rss_bytes", rss)
+
+def iter_streamed_pairs(db, matched_documents, memory_budget):
+    """
+    Transforms matched pairs without loading whole traffic documents.
+
+    Each traffic document is split into consecutive groups of routers whose
+    stat rows fit memory_budget at stream_bytes_per_row, and each group is
+    fetched, merged with its routers' slice of the config and turned into
+    documents only after the previous group was written, so memory is
+    bounded by the largest group instead of the whole document.
+
+    Args:
+        db (Database): The Router_Ingested database.
+        matched_documents (list): Pairs of documents projected to their router keys.
+        memory_budget (int): Bytes a router group may use.
+
+    Yields:
+        tuple: (config_keys, traffic_keys, batches) where batches lazily
+        yields the documents of each router group.
+    """
+    max_rows = max(1, memory_budget // stream_bytes_per_row)
+    config_collection = db["Router_Configuration"]
+    traffic_collection = db["Router_Traffic"]
+    config_id = config_df = None
+    for config_keys, traffic_keys in matched_documents:
+        if config_df is None or config_id != config_keys["_id"]:
+            config_id = config_keys["_id"]
+            with metrics.span("etl.config_frame"):
+                config_df = create_config_dataframe_from_document(resolve_layout(db, config_collection.find_one({"_id": config_id})))
+        yield config_keys, traffic_keys, iter_router_group_documents(traffic_collection, traffic_keys["_id"], config_df, max_rows)
+
+# Worker-side transforms; the worker's spans and counters travel back with the documents
+def transform_pair_in_worker(config_doc, traffic_doc):
+    metrics.reset()
+    documents = transform_pair(config_doc, traffic_doc)
+    return documents, metrics.snapshot()
+
+_worker_dimension = None
+
+def init_traffic_worker(dimension):
+    # The dimension is sent once per worker instead of with every traffic document
+    global _worker_dimension
+    _worker_dimension = dimension
+
+def transform_traffic_in_worker(traffic_doc):
+    metrics.reset()
+    documents = transform_traffic(traffic_doc, _worker_dimension)
+    return documents, metrics.snapshot()
+
+def iter_in_pool(tasks, function, workers, max_in_flight=None, initializer=None, initargs=()):
+    """
+    Runs function(*task) for each task in a process pool, yielding
+    (task, documents) in task order with at most max_in_flight tasks
+    submitted but not yet yielded (twice the worker count by default).
+    function returns (documents, metrics snapshot).
+    """
+    def collect(future):
+        documents, worker_metrics = future.result()
+        metrics.merge(worker_metrics)
+        return documents
+
+    max_in_flight = max_in_flight or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        in_flight = deque()
+        for task in tasks:
+            in_flight.append((task, executor.submit(function, *task)))
+            if len(in_flight) >= max_in_flight:
+                task, future = in_flight.popleft()
+                yield task, collect(future)
+        while in_flight:
+            task, future = in_flight.popleft()
+            yield task, collect(future)
+
+def iter_transformed_pairs(pairs, workers=1, max_in_flight=None):
+    """
+    Transforms matched pairs, optionally in a process pool.
+
+    Results are yielded in pair order whatever the worker count, so the
+    writer sees exactly what the serial path produces.
+
+    Args:
+        pairs (iterable): (config_doc, traffic_doc) tuples.
+        workers (int): Number of worker processes; 1 runs in-process.
+        max_in_flight (int): Pairs submitted but not yet yielded; defaults
+            to twice the worker count to bound memory.
+
+    Yields:
+        tuple: (config_doc, traffic_doc, documents).
+    """
+    if workers <= 1:
+        for config_doc, traffic_doc in pairs:
+            yield config_doc, traffic_doc, transform_pair(config_doc, traffic_doc)
+        return
+
+    for (config_doc, traffic_doc), documents in iter_in_pool(pairs, transform_pair_in_worker, workers, max_in_flight):
+        yield config_doc, traffic_doc, documents
+
+def iter_transformed_traffic(traffic_documents, dimension, workers=1, max_in_flight=None):
+    """
+    Transforms traffic documents against the interface dimension, optionally
+    in a process pool, yielding (traffic_doc, documents) in input order.
+    """
+    if workers <= 1:
+        for traffic_doc in traffic_documents:
+            yield traffic_doc, transform_traffic(traffic_doc, dimension)
+        return
+
+    tasks = ((traffic_doc,) for traffic_doc in traffic_documents)
+    for (traffic_doc,), documents in iter_in_pool(tasks, transform_traffic_in_worker, workers, max_in_flight,
+                                                 init_traffic_worker, (dimension,)):
+        yield traffic_doc, documents
+
+def write_documents(documents, batch_id, writer, state_store, rollup_writer=None, parquet_dir=None,
+                    parquet_partition_by_ip=False, rates=True, part=None):
+    """
+    Adds counter rates to a transformed batch and writes it to MongoDB, the
+    Parquet dataset and the rollups.
+
+    Args:
+        documents (list): Documents produced by create_documents.
+        batch_id (str): Stable identifier of the batch, the traffic document ID.
+        part (int): Number of a streamed router group within the batch,
+            which gets its own Parquet files; the batch's files of an
+            earlier run are deleted before part 0 or a whole batch is exported.
+
+    Returns:
+        list: The documents as written.
+    """
+    if rates:
+        # Deltas and rates of the cumulative counters, continuing from the last value stored per series
+        with metrics.span("etl.counter_rates"):
+            documents = add_counter_rates(documents, state_store)
+
+    # Insert documents into MongoDB collection
+    insert_documents_into_mongodb(documents, writer)
+    if parquet_dir:
+        with metrics.span("etl.parquet_export"):
+            if not part:
+                remove_parquet_batch(parquet_dir, batch_id)
+            export_documents_to_parquet(documents, parquet_dir, batch_id if part is None else f"{batch_id}_{part}",
+                                        parquet_partition_by_ip)
+    if rollup_writer is not None:
+        # Hourly / daily rollups are folded in from this batch only
+        with metrics.span("etl.rollups"):
+            rollup_writer.update(documents, batch_id)
+    return documents
+
+def iter_unprocessed_traffic(db, state_store, incremental=False):
+    """
+    Yields full traffic documents not yet processed, oldest first.
+
+    Only IDs are listed up front and each document is fetched when it is
+    needed, so no cursor stays open while documents are transformed.
+    """
+    traffic_collection = db["Router_Traffic"]
+    query = {PROCESSED_FIELD: None} if incremental else {}
+    document_ids = [document["_id"] for document in traffic_collection.find(query, {"_id": 1}).sort("_id", 1)]
+    for document_id in document_ids:
+        if str(document_id) in state_store.processed_documents:
+            continue
+        traffic_doc = resolve_layout(db, traffic_collection.find_one({"_id": document_id}))
+        if traffic_doc is not None:
+            yield traffic_doc
+
+def process_traffic_asof(db, writer, state_store, rollup_writer=None, incremental=False, workers=1, max_in_flight=None,
+                         **write_options):
+    """
+    Processes every pending traffic document against the interface dimension.
+
+    A traffic document is left for a later run while any of its routers has
+    no config snapshot yet, so its interfaces are not written unnamed.
+
+    Returns:
+        int: The number of traffic documents processed.
+    """
+    dimension = get_interface_dimension(db)
+    known_routers = dimension.routers()
+
+    def ready(traffic_documents):
+        for traffic_doc in traffic_documents:
+            missing = set(traffic_doc.get("routers", {})) - known_routers
+            if missing:
+                logger.info("Traffic document %s waits for the config of %s.", traffic_doc["_id"], ", ".join(sorted(missing)))
+                metrics.increment("etl.traffic_waiting_for_config")
+                continue
+            yield traffic_doc
+
+    processed = 0
+    pending = ready(iter_unprocessed_traffic(db, state_store, incremental))
+    for traffic_doc, documents in iter_transformed_traffic(pending, dimension, workers, max_in_flight):
+        write_documents(documents, str(traffic_doc["_id"]), writer, state_store, rollup_writer, **write_options)
+        state_store.mark_processed([traffic_doc["_id"]])
+        if incremental:
+            mark_documents_processed(db["Router_Traffic"], [traffic_doc["_id"]])
+        metrics.increment("etl.traffic_processed")
+        processed += 1
+    logger.info("%d traffic documents processed against the config dimension.", processed)
+    return processed
+
+
+# Processed document IDs of the text-file era, imported into the state store when main is given the file
+PROCESSED_DOCUMENTS_LIST = 'Processed_documents.txt'
 
 # Main function
-def main():
+def main(incremental=False, workers=1, max_in_flight=None, parquet_dir=None, parquet_partition_by_ip=False,
+         rollups=True, rates=True, asof_config=False, memory_budget=None, state_store=None, legacy_processed_file=None):
+    """
+    Matches, transforms and writes the documents not yet processed.
+
+    Args:
+        incremental (bool): Only fetch documents not yet marked processed in MongoDB.
+        workers (int): Worker processes transforming matched pairs; 1 runs in-process.
+        max_in_flight (int): Pairs queued to the workers at once.
+        parquet_dir (str): Parquet dataset the metrics are also appended to; may be None.
+        parquet_partition_by_ip (bool): Partition the dataset by IP_Address as well.
+        rollups (bool): Update the hourly / daily rollups.
+        rates (bool): Compute counter deltas and rates.
+        asof_config (bool): Join traffic to the latest config snapshot of its routers.
+        memory_budget (int): Bytes a streamed router group may take; None transforms documents whole.
+        state_store (StateStore): Store of processed documents and counter
+            state, left open for the caller's next run; None opens the
+            default store for this run only and closes it afterwards.
+        legacy_processed_file (str): Processed_documents.txt of the text-file
+            era, imported into the state store once; None skips the import.
+    """
+    if state_store is None:
+        with StateStore() as state_store:
+            return main(incremental, workers, max_in_flight, parquet_dir, parquet_partition_by_ip, rollups, rates,
+                        asof_config, memory_budget, state_store, legacy_processed_file)
+
     # Connect to MongoDB
     db = connect_to_mongodb()
-    
-    # Define the path for the processed documents file
-    processed_documents_file = r'C:\Users\hp\OneDrive\Bureau\End_Studies_Project\Text_Files\Processed_documents.txt'
+    writer = get_default_writer()
+    rollup_writer = RollupWriter() if rollups else None
+    if incremental:
+        ensure_source_indexes(db)
+
+    if legacy_processed_file:
+        state_store.import_legacy_file(legacy_processed_file)
+
+    if asof_config:
+        # Traffic is joined to the latest config snapshot of each router instead of being paired with a config document
+        process_traffic_asof(db, writer, state_store, rollup_writer, incremental, workers, max_in_flight,
+                             parquet_dir=parquet_dir, parquet_partition_by_ip=parquet_partition_by_ip, rates=rates)
+        return
 
     while True:
         # Retrieve documents
-        config_documents, traffic_documents = get_documents(db)
+        with metrics.span("etl.fetch"):
+            config_documents, traffic_documents = get_documents(db, incremental, keys_only=incremental or bool(memory_budget))
         
         # Process documents
-        matched_documents = process_documents(config_documents, traffic_documents, processed_documents_file)
-
-        # Update processed documents file
-        update_processed_documents(matched_documents, processed_documents_file)
+        matched_documents = process_documents(config_documents, traffic_documents, state_store.processed_documents)
 
         # Continue processing only if there are matched documents
         if not matched_documents:
-            print("No more matched documents to process.")
+            logger.info("No more matched documents to process.")
             break
         
-        # Iterate over matched documents and perform further processing
-        for config_doc, traffic_doc in matched_documents:
-            # Create data frames from config and traffic documents
-            config_df = create_config_dataframe_from_document(config_doc)
-            print("Columns of config_df:", config_df.columns)
+        if memory_budget:
+            # One router group at a time, each written before the next is loaded
+            transformed = iter_streamed_pairs(db, matched_documents, memory_budget)
+        else:
+            pairs = load_matched_documents(db, matched_documents) if incremental else matched_documents
+            # Transform matched documents, in worker processes when workers > 1, and write the results in pair order
+            transformed = ((config_doc, traffic_doc, [documents])
+                           for config_doc, traffic_doc, documents in iter_transformed_pairs(pairs, workers, max_in_flight))
+        for position, (config_doc, traffic_doc, batches) in enumerate(transformed):
+            for part, documents in enumerate(batches):
+                write_documents(documents, str(traffic_doc["_id"]), writer, state_store, rollup_writer,
+                                parquet_dir, parquet_partition_by_ip, rates, part if memory_budget else None)
+                # Released before the next router group is built
+                del documents
+            metrics.increment("etl.pairs_processed")
+
+            # Record the pair only once it is fully written; a config document is done after its last pair
+            config_done = (position + 1 == len(matched_documents)
+                           or matched_documents[position + 1][0]["_id"] != config_doc["_id"])
+            completed_ids = [traffic_doc["_id"], config_doc["_id"]] if config_done else [traffic_doc["_id"]]
+            state_store.mark_processed(completed_ids)
+
+            if incremental:
+                mark_documents_processed(db["Router_Traffic"], [traffic_doc["_id"]])
+                if config_done:
+                    mark_documents_processed(db["Router_Configuration"], [config_doc["_id"]])
+
+    if memory_budget:
+        high_water_marks = metrics.snapshot()["high_water_marks"]
+        rss = high_water_marks.get("etl.peak_rss_bytes")
+        logger.info("Memory budget %.1f MB: largest router group %d rows, peak RSS %s.", memory_budget / 2 ** 20,
+                    high_water_marks.get("etl.stream_group_rows", 0), f"{rss / 2 ** 20:.1f} MB" if rss else "n/a")
 
-            traffic_df = create_stat_dataframe_from_document(traffic_doc)
-            print("Columns of traffic_df:", traffic_df.columns)
-
-            # Merge data frames based on common columns
-            merged_df = pd.merge(traffic_df, config_df, on=['IP_Address', 'Interface_ID'], how='left')
-            print("Columns of merged_df:", merged_df.columns) 
-            # Replace empty columns for Interface_ID = 0
-            merged_df.loc[merged_df['Interface_ID'] == 0, 'Interface_Name'] = 'General'
-            merged_df.loc[merged_df['Interface_ID'] == 0, 'Interface_Description'] = 'General'
- 
-            #Create documents for insertion into MongoDB
-            documents = create_documents(merged_df)
-
-            # Insert documents into MongoDB collection
-            insert_documents_into_mongodb(documents)
 
 if __name__ == "__main__":
-    main()
-
-
-
-
+    parser = argparse.ArgumentParser(description="Match, transform and load router documents.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only fetch documents not yet marked processed in MongoDB")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes transforming matched pairs (1 runs serially)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Pairs queued to the workers at once (default: twice the worker count)")
+    parser.add_argument("--parquet-dir", default=None,
+                        help="Also append the processed metrics to a Parquet dataset partitioned by day")
+    parser.add_argument("--parquet-partition-by-ip", action="store_true",
+                        help="Partition the Parquet dataset by IP_Address as well")
+    parser.add_argument("--no-rollups", action="store_true",
+                        help="Skip updating the hourly / daily rollup collections")
+    parser.add_argument("--no-rates", action="store_true",
+                        help="Skip computing counter deltas and rates")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                        help="Stream each traffic document in router groups sized to this many MB "
+                             "instead of transforming it whole (runs serially)")
+    parser.add_argument("--asof-config", action="store_true",
+                        help="Join each traffic document to the latest config snapshot of its routers "
+                             "instead of pairing it with a config document")
+    parser.add_argument("--state-db", default=None, help="SQLite state store (default: Text_Files/Pipeline_State.db)")
+    parser.add_argument("--legacy-processed-file", default=None,
+                        help="Processed_documents.txt of processed document IDs to import into the state store")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level, args.log_file)
+    with metrics.span("etl.run"), (StateStore(args.state_db) if args.state_db else StateStore()) as state_store:
+        main(incremental=args.incremental, workers=args.workers, max_in_flight=args.max_in_flight,
+             parquet_dir=args.parquet_dir, parquet_partition_by_ip=args.parquet_partition_by_ip,
+             rollups=not args.no_rollups, rates=not args.no_rates, asof_config=args.asof_config,
+             memory_budget=int(args.memory_budget * 1024 * 1024) if args.memory_budget else None,
+             state_store=state_store, legacy_processed_file=args.legacy_processed_file)
+    metrics.log_summary(logger)
+    if args.metrics_file:
+        metrics.export(args.metrics_file, args.metrics_format)
@@ -1,141 +1,487 @@
 import os
 import json
-from pymongo import MongoClient
+import hashlib
+import time
+import argparse
+import logging
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from State_Store import StateStore, INGESTED, UNKNOWN, FAILED
+from Router_Schema import STAT, SchemaViolation, document_kind
+from Router_Files import read_chunk_size, classify_json_file, stream_file_parts
+from Columnar_Layout import LAYOUT_FIELD, NESTED, COLUMNAR, LAYOUTS, OID_COLLECTION, OidDictionary, encode_routers
+from Metrics_Writer import get_client
+from Pipeline_Metrics import metrics, configure_logging, add_instrumentation_arguments
 
-# MongoDB Connection Setup
-client = MongoClient('mongodb://localhost:27017')
-db = client.Router_Ingested
-unknown_files_collection = db.Unknown_Files
-router_traffic_collection = db.Router_Traffic
-router_configuration_collection = db.Router_Configuration
+logger = logging.getLogger("Ingest_RouterData")
 
-# Create indexes
-router_traffic_collection.create_index([("routers", 1), ("Measure_Time", 1)])
-router_configuration_collection.create_index([("routers", 1), ("Measure_Time", 1)])
+# MongoDB connection, made on first use so pool workers importing this module connect to nothing
+mongo_uri = 'mongodb://localhost:27017/'
+COLLECTION_NAMES = ["Router_Traffic", "Router_Configuration", "Unknown_Files"]
 
-# Directories path 
-json_dir = r'C:\Users\hp\OneDrive\Bureau\End_Studies_Project\Directory_Json\QoS_CPE'
-text_files_dir = r'C:\Users\hp\OneDrive\Bureau\End_Studies_Project\Text_Files'
+_db = None
 
-# Ensure the directory for text files exists
-os.makedirs(text_files_dir, exist_ok=True)
+def get_db():
+    global _db
+    if _db is None:
+        _db = get_client(mongo_uri).Router_Ingested
+    return _db
 
-# File Paths
-ingested_files_path = os.path.join(text_files_dir, 'Ingested_Files.txt')
-unknown_files_path = os.path.join(text_files_dir, 'Unknown_Files.txt')
+def get_collection(collection_name):
+    return get_db()[collection_name]
 
-# Function to validate "Stat" JSON files
-def validate_stat_json(json_data):
-    try:
-        routers = json_data.get("routers")
-        if routers is None:
-            return False
-        
-        for router_ip, router_data in routers.items():
-            measure_time = router_data.get("Measure_Time")
-            if measure_time is None:
-                return False
-            
-            for measure_timestamp, measure_values in measure_time.items():
-                if not isinstance(measure_values, dict) or not measure_values:
-                    return False
-        
+# Create indexes (from main, so worker processes importing this module stay cheap)
+_indexes_ready = False
+
+def ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    get_collection("Router_Traffic").create_index([("routers", 1), ("Measure_Time", 1)])
+    get_collection("Router_Configuration").create_index([("routers", 1), ("Measure_Time", 1)])
+    # Each version of a file is stored under its own Ingest_Id until replace_earlier_versions removes the others
+    for collection_name in COLLECTION_NAMES:
+        collection = get_collection(collection_name)
+        if "file_part" in collection.index_information():
+            collection.drop_index("file_part")  # (File_Name, Part) kept two versions of a file from coexisting
+        collection.create_index([("File_Name", 1), ("Ingest_Id", 1), ("Part", 1)], unique=True, name="file_version_part",
+                                partialFilterExpression={"File_Name": {"$exists": True}})
+    _indexes_ready = True
+
+# Input directory next to the scripts, used unless main is given another (--json-dir)
+json_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Directory_Json', 'QoS_CPE')
+
+# Ingested / unknown file names are kept in the pipeline state store, opened on first use like the connection
+_state_store = None
+
+def get_state_store():
+    global _state_store
+    if _state_store is None:
+        _state_store = StateStore()
+    return _state_store
+
+# Fingerprints of the files selected by scan_directory, recorded in the manifest once the file is handled
+pending_fingerprints = {}
+
+# Legacy file lists, imported into the state store from the directory given to main (--legacy-dir)
+INGESTED_FILES_LIST = 'Ingested_Files.txt'
+UNKNOWN_FILES_LIST = 'Unknown_Files.txt'
+
+# Streaming ingestion settings; parts are split at Router_Files.max_part_bytes
+streaming_threshold_bytes = 8 * 1024 * 1024  # Files above this size are streamed in "auto" mode
+insert_batch_size = 50  # Parts sent per insert_many
+
+# Layout of the stored Stat / Config documents: NESTED keeps the file's shape, COLUMNAR stores ID arrays (see Columnar_Layout)
+storage_layout = NESTED
+
+_oid_dictionary = None
+
+def get_oid_dictionary():
+    global _oid_dictionary
+    if _oid_dictionary is None:
+        _oid_dictionary = OidDictionary(get_db()[OID_COLLECTION])
+    return _oid_dictionary
+
+def apply_layout(collection_name, json_data):
+    # Unknown_Files keep the file as it was received
+    if storage_layout == COLUMNAR and collection_name in ("Router_Traffic", "Router_Configuration"):
+        with metrics.span("ingest.encode"):
+            json_data["routers"] = encode_routers(json_data["routers"], get_oid_dictionary())
+        json_data[LAYOUT_FIELD] = COLUMNAR
+    return json_data
+
+def record_file(file_name, status):
+    metrics.increment(f"ingest.files_{status}")
+    state_store = get_state_store()
+    state_store.record_file(file_name, status)
+    fingerprint = pending_fingerprints.pop(file_name, None)
+    if fingerprint is not None:
+        state_store.record_manifest(*fingerprint, status)
+
+def file_hash(file_path, chunk_size=read_chunk_size):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def scan_directory(directory, ingested_files, unknown_files, min_file_age=0):
+    """
+    Yields (file_path, changed) for the JSON files that need ingesting.
+
+    Files whose size and mtime match the manifest are skipped after a single
+    stat(); otherwise the content hash decides whether the file changed.
+
+    Args:
+        directory (str): The input directory.
+        ingested_files, unknown_files: Name-based records, used to adopt
+            files ingested before the manifest existed without ingesting
+            them again; they are hashed so a later touch is told from a change.
+        min_file_age (float): Seconds since the last modification before a
+            file is considered complete; younger files wait for the next scan.
+
+    Yields:
+        tuple: (file_path, changed) where changed means an earlier version
+        of the file may be stored; it is replaced once the new one is.
+    """
+    for entry in os.scandir(directory):
+        if not entry.name.endswith('.json') or not entry.is_file():
+            continue
+        stat = entry.stat()
+        if min_file_age and time.time() - stat.st_mtime < min_file_age:
+            continue
+        needed, changed = check_manifest(entry.path, stat, ingested_files, unknown_files)
+        if needed:
+            yield entry.path, changed
+
+def check_manifest(file_path, stat, ingested_files, unknown_files):
+    """
+    Decides from the manifest whether a file needs ingesting, without parsing it.
+
+    A file that does is fingerprinted in pending_fingerprints, recorded in
+    the manifest once it is handled; a skipped file's manifest entry is
+    refreshed so the next check costs a single stat().
+
+    Returns:
+        tuple: (needed, changed); see scan_directory.
+    """
+    state_store = get_state_store()
+    file_name = os.path.basename(file_path)
+    record = state_store.manifest_entry(file_path)
+    if record is not None and record[0] == stat.st_size and record[1] == stat.st_mtime_ns:
+        return False, False
+    if record is None and is_recorded(file_name, ingested_files, unknown_files):
+        # Hashed on first sight, as its legacy document carries no File_Name a new version could replace
+        status = INGESTED if file_name in ingested_files else UNKNOWN
+        state_store.record_manifest(file_path, stat.st_size, stat.st_mtime_ns, file_hash(file_path), status)
+        return False, False
+    content_hash = file_hash(file_path)
+    if record is not None and record[2] is None:
+        # Adopted before adopted files were hashed: the content it was ingested with is unknown
+        logger.warning("File '%s' was ingested before the manifest; its current content is taken as the ingested one.",
+                       file_name)
+        state_store.record_manifest(file_path, stat.st_size, stat.st_mtime_ns, content_hash, record[3])
+        return False, False
+    if record is not None and record[2] == content_hash:
+        # Touched but identical
+        state_store.record_manifest(file_path, stat.st_size, stat.st_mtime_ns, content_hash, record[3])
+        return False, False
+    pending_fingerprints[file_name] = (file_path, stat.st_size, stat.st_mtime_ns, content_hash)
+    return True, record is not None
+
+def is_selected(file_path):
+    # Files handed to the ingest functions directly, rather than by scan_directory, get the same check before parsing
+    if os.path.basename(file_path) in pending_fingerprints:
         return True
-    except Exception as e:
-        print(f"Error during schema validation: {e}")
-        return False
+    state_store = get_state_store()
+    return check_manifest(file_path, os.stat(file_path), state_store.files(INGESTED), state_store.files(UNKNOWN))[0]
 
+def replace_earlier_versions(ingest_ids, collection_names=COLLECTION_NAMES):
+    """
+    Deletes what earlier versions of files stored, once their new version is stored.
 
-# Function to validate "Config" JSON files
-def validate_config_json(json_data):
-    required_keys = ["routers"]
-    for key in required_keys:
-        if key not in json_data:
-            return False
-    
-    routers = json_data["routers"]
-    for router_ip, router_data in routers.items():
-        if "Measure_Time" not in router_data:
-            return False
-        
-        measure_time = router_data["Measure_Time"]
-        for timestamp, metrics in measure_time.items():
-            if not isinstance(metrics, dict):
-                return False
-            for metric_name, metric_value in metrics.items():
-                # Assuming all metric values are strings
-                if not isinstance(metric_value, str):
-                    return False
-    
-    return True
+    Args:
+        ingest_ids (dict): File_Name -> Ingest_Id of the version just stored.
+        collection_names (list): Where earlier versions are deleted from. A
+            version routed to Unknown_Files only replaces the Unknown_Files
+            one, so a corrupt re-drop keeps the data of a good earlier version.
+    """
+    if not ingest_ids:
+        return
+    query = {"$or": [{"File_Name": file_name, "Ingest_Id": {"$ne": ingest_id}} for file_name, ingest_id in ingest_ids.items()]}
+    for collection_name in collection_names:
+        get_collection(collection_name).delete_many(query)
 
+def replaced_collections(collection_name):
+    return ["Unknown_Files"] if collection_name == "Unknown_Files" else COLLECTION_NAMES
 
+def is_recorded(file_name, ingested_files, unknown_files):
+    if file_name.startswith("Stat") or file_name.startswith("Config"):
+        return file_name in ingested_files
+    return file_name in unknown_files
+
+def tag_document(json_data, file_name, ingest_id):
+    json_data["File_Name"] = file_name
+    json_data["Ingest_Id"] = ingest_id
+    json_data["Part"] = 0
+    return json_data
 
 # Function to ingest JSON files
-def ingest_json_file(file_path, ingested_files, unknown_files):
+def ingest_json_file(file_path):
     file_name = os.path.basename(file_path)
-    print(f"Processing file: {file_name}")  # For debugging
+    if not is_selected(file_path):
+        logger.debug("File '%s' already recorded.", file_name)
+        return
+    logger.debug("Processing file: %s", file_name)
     with open(file_path, 'r') as f:
         try:
-            json_data = json.load(f)
+            with metrics.span("ingest.parse"):
+                json_data = json.load(f)
         except json.JSONDecodeError as e:
-            print(f"Error decoding JSON in file '{file_name}': {e}")
-            return
-    
-    if file_name.startswith("Stat") or file_name.startswith("Config"):
-        if file_name in ingested_files:
-            print(f"File '{file_name}' already ingested.")
+            logger.warning("Error decoding JSON in file '%s': %s", file_name, e)
+            record_file(file_name, FAILED)
             return
-        
-        if file_name.startswith("Stat"):
-            if validate_stat_json(json_data):
-                router_traffic_collection.insert_one(json_data)
-                with open(ingested_files_path, 'a') as f:
-                    f.write(file_name + '\n')
-            else:
-                unknown_files_collection.insert_one(json_data)
-                with open(unknown_files_path, 'a') as f:
-                    f.write(file_name + '\n')
-        elif file_name.startswith("Config"):
-            if validate_config_json(json_data):
-                router_configuration_collection.insert_one(json_data)
-                with open(ingested_files_path, 'a') as f:
-                    f.write(file_name + '\n')
-            else:
-                unknown_files_collection.insert_one(json_data)
-                with open(unknown_files_path, 'a') as f:
-                    f.write(file_name + '\n')
-    else:
-        if file_name in unknown_files:
-            print(f"File '{file_name}' already in unknown files.")
+    metrics.increment("ingest.bytes_parsed", os.path.getsize(file_path))
+
+    with metrics.span("ingest.validate"):
+        collection_name, status = classify_json_file(file_name, json_data)
+    ingest_id = ObjectId()
+    with metrics.span("ingest.insert"):
+        get_collection(collection_name).insert_one(tag_document(apply_layout(collection_name, json_data), file_name, ingest_id))
+    metrics.increment("ingest.documents_inserted")
+    replace_earlier_versions({file_name: ingest_id}, replaced_collections(collection_name))
+    record_file(file_name, status)
+
+def insert_file_parts(collection, parts, file_name, ingest_id, batch_size=insert_batch_size):
+    """
+    Inserts streamed parts in batches, tagging each with its source file and
+    storing Router_Traffic / Router_Configuration parts in storage_layout.
+
+    Returns:
+        int: The number of documents inserted.
+    """
+    batch = []
+    inserted = 0
+    for part_number, routers in enumerate(parts):
+        batch.append(apply_layout(collection.name, {"routers": routers, "File_Name": file_name, "Ingest_Id": ingest_id, "Part": part_number}))
+        if len(batch) >= batch_size:
+            collection.insert_many(batch)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+        inserted += len(batch)
+    return inserted
+
+
+def insert_unknown_file(file_path, file_name):
+    ingest_id = ObjectId()
+    collection = get_collection("Unknown_Files")
+    try:
+        if os.path.getsize(file_path) <= streaming_threshold_bytes:
+            with open(file_path, 'r') as f:
+                collection.insert_one(tag_document(json.load(f), file_name, ingest_id))
+        else:
+            insert_file_parts(collection, stream_file_parts(file_path), file_name, ingest_id)
+    except (json.JSONDecodeError, SchemaViolation) as e:
+        collection.delete_many({"Ingest_Id": ingest_id})
+        logger.warning("File '%s' could not be stored in Unknown_Files: %s", file_name, e)
+        record_file(file_name, FAILED)
+        return
+    replace_earlier_versions({file_name: ingest_id}, replaced_collections("Unknown_Files"))
+    record_file(file_name, UNKNOWN)
+
+
+# Function to ingest JSON files one router at a time
+def ingest_json_file_streaming(file_path):
+    file_name = os.path.basename(file_path)
+    if not (file_name.startswith("Stat") or file_name.startswith("Config")):
+        return ingest_json_file(file_path)
+
+    if not is_selected(file_path):
+        logger.debug("File '%s' already ingested.", file_name)
+        return
+    logger.debug("Streaming file: %s", file_name)
+
+    kind = document_kind(file_name)
+    collection = get_collection("Router_Traffic" if kind == STAT else "Router_Configuration")
+
+    # Earlier versions, and parts left by an interrupted attempt, are deleted once this version is stored
+    ingest_id = ObjectId()
+    try:
+        # Parsing, validation and inserts are interleaved, so they share one span
+        with metrics.span("ingest.stream"):
+            inserted = insert_file_parts(collection, stream_file_parts(file_path, kind), file_name, ingest_id)
+    except json.JSONDecodeError as e:
+        collection.delete_many({"Ingest_Id": ingest_id})
+        logger.warning("Error decoding JSON in file '%s': %s", file_name, e)
+        record_file(file_name, FAILED)
+        return
+    except SchemaViolation as e:
+        # Roll back the parts already written before routing the file to Unknown_Files
+        collection.delete_many({"Ingest_Id": ingest_id})
+        logger.warning("File '%s' failed validation at %s", file_name, e)
+        insert_unknown_file(file_path, file_name)
+        return
+
+    metrics.increment("ingest.bytes_parsed", os.path.getsize(file_path))
+    metrics.increment("ingest.documents_inserted", inserted)
+    replace_earlier_versions({file_name: ingest_id})
+    logger.info("File '%s' ingested as %d documents.", file_name, inserted)
+    record_file(file_name, INGESTED)
+
+# Worker-side parse and validation; only plain data crosses the process boundary
+def parse_json_file(file_path):
+    """
+    Returns (file_name, collection_name, status, json_data, worker_metrics),
+    with collection_name None, status the error message and json_data None
+    if the file is not valid JSON.
+    """
+    metrics.reset()
+    file_name = os.path.basename(file_path)
+    with open(file_path, 'r') as f:
+        try:
+            with metrics.span("ingest.parse"):
+                json_data = json.load(f)
+        except json.JSONDecodeError as e:
+            return file_name, None, str(e), None, metrics.snapshot()
+    metrics.increment("ingest.bytes_parsed", os.path.getsize(file_path))
+    with metrics.span("ingest.validate"):
+        collection_name, status = classify_json_file(file_name, json_data)
+    return file_name, collection_name, status, json_data, metrics.snapshot()
+
+
+class FileBatchWriter:
+    """
+    Inserts whole-file documents in unordered batches per collection.
+
+    A file is recorded in the state store, and its earlier versions are
+    deleted, only once its document is stored.
+    """
+
+    def __init__(self, batch_size=insert_batch_size):
+        self.batch_size = batch_size
+        self.pending = defaultdict(list)
+
+    def add(self, collection_name, file_name, status, json_data):
+        batch = self.pending[collection_name]
+        batch.append((file_name, status, tag_document(apply_layout(collection_name, json_data), file_name, ObjectId())))
+        if len(batch) >= self.batch_size:
+            self.flush(collection_name)
+
+    def flush(self, collection_name=None):
+        names = [collection_name] if collection_name else list(self.pending)
+        for name in names:
+            batch = self.pending.pop(name, [])
+            if not batch:
+                continue
+            failed = set()
+            try:
+                with metrics.span("ingest.insert"):
+                    get_collection(name).insert_many([document for _, _, document in batch], ordered=False)
+            except BulkWriteError as e:
+                failed = {error["index"] for error in e.details.get("writeErrors", [])}
+                for error in e.details.get("writeErrors", []):
+                    logger.warning("File '%s' failed to insert: %s", batch[error['index']][0], error.get('errmsg'))
+            replace_earlier_versions({file_name: document["Ingest_Id"] for index, (file_name, _, document) in enumerate(batch)
+                                      if index not in failed}, replaced_collections(name))
+            with get_state_store().transaction():
+                for index, (file_name, status, _) in enumerate(batch):
+                    if index not in failed:
+                        record_file(file_name, status)
+            metrics.increment("ingest.documents_inserted", len(batch) - len(failed))
+            logger.info("%d files written to %s.", len(batch) - len(failed), name)
+
+
+def ingest_files_concurrently(file_paths, workers, max_in_flight=None):
+    """
+    Parses and validates files in a process pool while the main process
+    writes the results in batches.
+
+    Args:
+        file_paths (list): Files to ingest, already filtered for streaming;
+            those the manifest has as unchanged are skipped before parsing.
+        workers (int): Number of parsing processes.
+        max_in_flight (int): Files parsed but not yet handed to the writer;
+            defaults to twice the worker count.
+    """
+    writer = FileBatchWriter()
+    seen = set()
+    max_in_flight = max_in_flight or 2 * workers
+
+    def handle(result):
+        file_name, collection_name, status, json_data, worker_metrics = result
+        metrics.merge(worker_metrics)
+        if collection_name is None:
+            logger.warning("Error decoding JSON in file '%s': %s", file_name, status)
+            record_file(file_name, FAILED)
             return
-        
-        unknown_files_collection.insert_one(json_data)
-        with open(unknown_files_path, 'a') as f:
-            f.write(file_name + '\n')
+        writer.add(collection_name, file_name, status, json_data)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for file_path in file_paths:
+            file_name = os.path.basename(file_path)
+            if file_name in seen or not is_selected(file_path):
+                continue
+            seen.add(file_name)
+            in_flight.append(executor.submit(parse_json_file, file_path))
+            if len(in_flight) >= max_in_flight:
+                handle(in_flight.popleft().result())
+        while in_flight:
+            handle(in_flight.popleft().result())
+    writer.flush()
 
 # Main Function
-def main():
-    # Check if the files exist, if not, create them
-    if not os.path.exists(ingested_files_path):
-        with open(ingested_files_path, 'w'): pass
-    if not os.path.exists(unknown_files_path):
-        with open(unknown_files_path, 'w'): pass
-    
-    # Load ingested and unknown files' names into sets for efficient lookup
-    ingested_files = set()
-    with open(ingested_files_path, 'r') as f:
-        ingested_files = {line.strip() for line in f}
-    
-    unknown_files = set()
-    with open(unknown_files_path, 'r') as f:
-        unknown_files = {line.strip() for line in f}
+def main(streaming="auto", workers=1, min_file_age=0, layout=None, input_dir=None, legacy_dir=None):
+    """
+    Ingests the new and changed files of input_dir.
+
+    Args:
+        layout (str): NESTED or COLUMNAR for the documents stored by this
+            run; defaults to storage_layout. Both can coexist in a collection.
+        input_dir (str): Directory of the Stat / Config files; defaults to json_dir.
+        legacy_dir (str): Directory holding the Ingested_Files.txt /
+            Unknown_Files.txt lists of the text-file era, imported once;
+            None skips the import.
+
+    Returns:
+        int: The number of files handled.
+    """
+    global storage_layout
+    ensure_indexes()
+    storage_layout = layout or storage_layout
+
+    # Import the legacy text lists once; lookups then go to the state store
+    state_store = get_state_store()
+    if legacy_dir:
+        state_store.import_legacy_file(os.path.join(legacy_dir, INGESTED_FILES_LIST), INGESTED)
+        state_store.import_legacy_file(os.path.join(legacy_dir, UNKNOWN_FILES_LIST), UNKNOWN)
+    ingested_files = state_store.files(INGESTED)
+    unknown_files = state_store.files(UNKNOWN)
     
-    # Iterate over files in the directory and ingest JSON files
-    for file_name in os.listdir(json_dir):
-        file_path = os.path.join(json_dir, file_name)
-        if os.path.isfile(file_path) and file_name.endswith('.json'):
-            ingest_json_file(file_path, ingested_files, unknown_files)
+    # Only new or changed files are opened; scan_directory already ran the manifest check the ingest functions repeat
+    pooled_files = []
+    handled = 0
+    for file_path, changed in scan_directory(input_dir or json_dir, ingested_files, unknown_files, min_file_age):
+        file_name = os.path.basename(file_path)
+        handled += 1
+        metrics.increment("ingest.files_handled")
+        if changed:
+            logger.info("File '%s' changed since it was ingested; replacing it once the new version is stored.", file_name)
+        if streaming == "always" or (streaming == "auto" and os.path.getsize(file_path) > streaming_threshold_bytes):
+            with metrics.span("ingest.file"):
+                ingest_json_file_streaming(file_path)
+        elif workers > 1:
+            pooled_files.append(file_path)
+        else:
+            with metrics.span("ingest.file"):
+                ingest_json_file(file_path)
+
+    if pooled_files:
+        ingest_files_concurrently(pooled_files, workers)
+
+    return handled
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Ingest router JSON files into MongoDB.")
+    parser.add_argument("--streaming", choices=["auto", "always", "never"], default="auto",
+                        help="Stream files router by router (auto: only files above the size threshold)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes parsing and validating files (1 ingests serially)")
+    parser.add_argument("--layout", choices=LAYOUTS, default=NESTED,
+                        help="Store Stat/Config documents as files are shaped, or as OID ID arrays with a shared dictionary")
+    parser.add_argument("--json-dir", default=None, help=f"Directory of the Stat/Config files (default: {json_dir})")
+    parser.add_argument("--legacy-dir", default=None,
+                        help="Directory of the Ingested_Files.txt / Unknown_Files.txt lists to import into the state store")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level, args.log_file)
+    with metrics.span("ingest.run"):
+        main(streaming=args.streaming, workers=args.workers, layout=args.layout, input_dir=args.json_dir,
+             legacy_dir=args.legacy_dir)
+    metrics.log_summary(logger)
+    if args.metrics_file:
+        metrics.export(args.metrics_file, args.metrics_format)
@@ -0,0 +1,311 @@
+import json
+import time
+import argparse
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from datetime import date, timedelta
+
+import pandas as pd
+
+from ETL_Routers import description_mapping, measure_timestamps_utc
+from Metrics_Writer import CHANGES_COLLECTION, add_change_listener, get_client
+from Pipeline_Metrics import metrics, configure_logging, add_instrumentation_arguments
+
+logger = logging.getLogger("Metrics_Queries")
+
+# Statistics the named queries add up, taken from the readable descriptions. Each direction is counted
+# by both a 32-bit and a High_Capacity octet counter, so only the latter is summed
+_descriptions = list(dict.fromkeys(description_mapping.values()))
+INTERFACE_OCTETS = [description for description in _descriptions
+                    if description.startswith("IP Interface") and description.endswith("Octets(High_Capacity)")]
+DISCARDS = [description for description in _descriptions if "Discarded" in description]
+
+# Queries that add up Stat_Delta, which only exists when the ETL computed counter rates
+RATE_QUERIES = {"top_interfaces", "router_discards"}
+
+
+def as_day(value):
+    # Query parameters take dates or 'YYYY-MM-DD' strings
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+@lru_cache(maxsize=1024)
+def utc_bounds(start, end):
+    # Local midnight of start to local midnight after end, as Measure_Timestamp bounds; memoized, as
+    # building a query's key costs a cache hit more than the lookup itself
+    bounds = [f"{start:%d/%m/%Y} 0:00:00", f"{end + timedelta(days=1):%d/%m/%Y} 0:00:00"]
+    return tuple(pd.Timestamp(bound).to_pydatetime() for bound in measure_timestamps_utc(bounds))
+
+def day_range(start, end):
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+# Named queries: each returns (pipeline, days it reads, routers it reads or None for all)
+def top_interfaces(day, limit=10, routers=None):
+    """
+    The interfaces that moved the most octets, in and out, on one local day.
+
+    The octets are the summed Stat_Delta of the High_Capacity counters, so
+    the metrics must have been written with counter rates (not --no-rates).
+    The day is a Measure_Timestamp range, served by the 'time' index.
+    """
+    day = as_day(day)
+    start, end = utc_bounds(day, day)
+    match = {"Measure_Timestamp": {"$gte": start, "$lt": end}, "New_Stat_Description": {"$in": INTERFACE_OCTETS}}
+    if routers:
+        routers = sorted(set(routers))
+        match["IP_Address"] = {"$in": routers}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"IP_Address": "$IP_Address", "Interface_ID": "$Interface_ID"},
+            "Interface_Name": {"$last": "$Interface_Name"},
+            "Interface_Description": {"$last": "$Interface_Description"},
+            "Octets": {"$sum": "$Stat_Delta"}
+        }},
+        {"$sort": {"Octets": -1, "_id.IP_Address": 1, "_id.Interface_ID": 1}},
+        {"$limit": int(limit)},
+        {"$project": {"_id": 0, "IP_Address": "$_id.IP_Address", "Interface_ID": "$_id.Interface_ID",
+                      "Interface_Name": 1, "Interface_Description": 1, "Octets": 1}}
+    ]
+    return pipeline, [day], routers or None
+
+def router_discards(start, end, routers=None):
+    """
+    Discarded packets per router, day and statistic over a range of local days.
+
+    Like top_interfaces, the counts are summed Stat_Delta values. A single
+    router is served by the 'series_time' index, a range of all routers by
+    the 'time' index.
+    """
+    start, end = as_day(start), as_day(end)
+    utc_start, utc_end = utc_bounds(start, end)
+    match = {"Measure_Timestamp": {"$gte": utc_start, "$lt": utc_end}, "New_Stat_Description": {"$in": DISCARDS}}
+    if routers:
+        routers = sorted(set(routers))
+        match["IP_Address"] = {"$in": routers}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"IP_Address": "$IP_Address", "Measure_Date": "$Measure_Date", "New_Stat_Description": "$New_Stat_Description"},
+            "Discards": {"$sum": "$Stat_Delta"},
+            "First_Timestamp": {"$min": "$Measure_Timestamp"}
+        }},
+        {"$sort": {"_id.IP_Address": 1, "First_Timestamp": 1, "_id.New_Stat_Description": 1}},
+        {"$project": {"_id": 0, "IP_Address": "$_id.IP_Address", "Measure_Date": "$_id.Measure_Date",
+                      "New_Stat_Description": "$_id.New_Stat_Description", "Discards": 1}}
+    ]
+    return pipeline, day_range(start, end), routers or None
+
+def interface_series(ip_address, interface_id, start, end, descriptions=None):
+    """
+    One interface's values and rates over a range of local days, in time
+    order, read straight off the 'series_time' index.
+    """
+    start, end = as_day(start), as_day(end)
+    utc_start, utc_end = utc_bounds(start, end)
+    match = {"IP_Address": ip_address, "Interface_ID": int(interface_id), "Measure_Timestamp": {"$gte": utc_start, "$lt": utc_end}}
+    if descriptions:
+        match["New_Stat_Description"] = {"$in": sorted(set(descriptions))}
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"Measure_Timestamp": 1, "New_Stat_Description": 1}},
+        {"$project": {"_id": 0, "Measure_Timestamp": 1, "New_Stat_Description": 1, "Protocol_Version": 1,
+                      "Stat_Value": 1, "Stat_Rate": 1}}
+    ]
+    return pipeline, day_range(start, end), [ip_address]
+
+QUERIES = {
+    "top_interfaces": top_interfaces,
+    "router_discards": router_discards,
+    "interface_series": interface_series
+}
+
+
+class QueryCache:
+    """
+    LRU cache of query results that expire after ttl seconds.
+
+    Each result remembers the days and routers it read and the change
+    version current when its query started, so invalidate drops exactly
+    the results a write to a (day, router) partition made stale.
+
+    Args:
+        max_entries (int): Results kept; the least recently used go first.
+        ttl (float): Seconds a result is served for.
+    """
+
+    def __init__(self, max_entries=256, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, version, days, routers, result)
+        self.generation = 0  # Bumped by every invalidation, so a result computed across one is not kept
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached result, to be treated as read-only, or None."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[4]
+
+    def put(self, key, result, version, days, routers, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, version, {day.isoformat() for day in days},
+                                 None if routers is None else frozenset(routers), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def oldest_version(self):
+        with self._lock:
+            return min((entry[1] for entry in self.entries.values()), default=None)
+
+    def invalidate(self, partitions, versions=None):
+        """
+        Drops the results that read any of the (ISO day, IP address) partitions.
+
+        Args:
+            partitions (iterable): The partitions written.
+            versions (list): Change version of each partition; a result whose
+                query started at or after it already saw the write. None
+                drops every result reading the partitions.
+
+        Returns:
+            int: The number of results dropped.
+        """
+        changes = list(zip(partitions, versions)) if versions is not None else [(partition, None) for partition in partitions]
+        with self._lock:
+            self.generation += 1
+            stale = [key for key, (_, version, days, routers, _) in self.entries.items()
+                     if any(day in days and (routers is None or ip_address in routers)
+                            and (change_version is None or change_version > version)
+                            for (day, ip_address), change_version in changes)]
+            for key in stale:
+                del self.entries[key]
+        metrics.increment("queries.invalidated", len(stale))
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+class MetricsQueries:
+    """
+    Runs the named QUERIES on Processed_Routers_Metrics through a QueryCache.
+
+    Writes made by this process invalidate the cache as they happen; writes
+    by other processes (the ETL, a backfill) are read from Metrics_Changes
+    at most every refresh_interval seconds.
+
+    Args:
+        uri (str): MongoDB connection string.
+        database (str): Name of the processed database.
+        collection (str): Name of the metrics collection.
+        client (MongoClient): Optional client to use instead of the shared one.
+        cache (QueryCache): Defaults to a new QueryCache().
+        refresh_interval (float): Seconds between reads of Metrics_Changes;
+            0 checks before every query.
+    """
+
+    def __init__(self, uri="mongodb://localhost:27017/", database="Processed_DataBase",
+                 collection="Processed_Routers_Metrics", client=None, cache=None, refresh_interval=5):
+        self.client = client if client is not None else get_client(uri)
+        self.collection = self.client[database][collection]
+        self.changes = self.client[database][CHANGES_COLLECTION]
+        self.cache = cache if cache is not None else QueryCache()
+        self.refresh_interval = refresh_interval
+        self.next_refresh = 0
+        add_change_listener(self.cache)
+
+    def current_version(self):
+        counter = self.changes.find_one({"_id": "version"})
+        return counter["Version"] if counter else 0
+
+    def refresh(self):
+        """Invalidates the results made stale by writes of other processes."""
+        oldest = self.cache.oldest_version()
+        if oldest is not None:
+            changes = list(self.changes.find({"Version": {"$gt": oldest}, "Measure_Day": {"$exists": True}}))
+            if changes:
+                self.cache.invalidate([(change["Measure_Day"], change["IP_Address"]) for change in changes],
+                                      [change["Version"] for change in changes])
+        self.next_refresh = time.monotonic() + self.refresh_interval
+
+    def check_rates(self, name, match):
+        # One matching document is enough to tell metrics written without rates, which would
+        # otherwise rank every interface at zero
+        document = self.collection.find_one(match, {"_id": 0, "Stat_Delta": 1})
+        if document is not None and "Stat_Delta" not in document:
+            raise RuntimeError(f"{name} adds up Stat_Delta, but the matching metrics were written without counter "
+                               "rates; re-run the ETL or Backfill_Metrics without --no-rates")
+
+    def run(self, name, **params):
+        """
+        Runs a named query, from the cache when it holds a current result.
+
+        Args:
+            name (str): A key of QUERIES.
+            **params: The query's parameters.
+
+        Returns:
+            list: The result documents, shared with the cache.
+
+        Raises:
+            RuntimeError: A query of RATE_QUERIES matched metrics without Stat_Delta.
+        """
+        if time.monotonic() >= self.next_refresh:
+            self.refresh()
+        pipeline, days, routers = QUERIES[name](**params)
+        key = (name, json.dumps(pipeline, default=str))
+        result = self.cache.get(key)
+        if result is not None:
+            metrics.increment("queries.cache_hits")
+            return result
+
+        metrics.increment("queries.cache_misses")
+        generation, version = self.cache.generation, self.current_version()
+        if name in RATE_QUERIES:
+            self.check_rates(name, pipeline[0]["$match"])
+        with metrics.span(f"queries.{name}"):
+            result = list(self.collection.aggregate(pipeline, allowDiskUse=True))
+        self.cache.put(key, result, version, days, routers, generation)
+        return result
+
+
+def parse_parameter(text):
+    # name=value, the value read as JSON when it is valid JSON (numbers, lists) and as a string otherwise
+    name, _, value = text.partition("=")
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a named query over the processed metrics.")
+    parser.add_argument("query", choices=list(QUERIES))
+    parser.add_argument("params", nargs="*", metavar="NAME=VALUE",
+                        help="Query parameters, e.g. day=2024-04-21 limit=5 'routers=[\"10.0.0.1\"]'")
+    parser.add_argument("--uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--database", default="Processed_DataBase")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level, args.log_file)
+
+    queries = MetricsQueries(args.uri, args.database)
+    print(json.dumps(queries.run(args.query, **dict(parse_parameter(param) for param in args.params)), default=str, indent=2))
+    if args.metrics_file:
+        metrics.export(args.metrics_file, args.metrics_format)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import pandas as pd
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from Metrics_Writer import get_client
+
+# Series a rollup row summarises
+ROLLUP_KEY = ["IP_Address", "Interface_ID", "New_Stat_Description", "Protocol_Version"]
+
+# Collection and bucket size for each grain
+ROLLUP_GRAINS = {
+    "Metrics_Rollup_Hourly": "h",
+    "Metrics_Rollup_Daily": "D"
+}
+
+
+def local_measure_times(frame):
+    """
+    Parses Measure_Date / Measure_Time into datetimes, once per distinct timestamp.
+
+    Args:
+        frame (DataFrame): Rows with 'Measure_Date' (dd/mm/yyyy) and 'Measure_Time' (H:MM:SS).
+
+    Returns:
+        Series: Naive datetime64 values in the routers' local time, aligned
+        with frame; ETL_Routers.measure_timestamps_utc gives UTC instead.
+    """
+    raw = frame["Measure_Date"].astype(str) + " " + frame["Measure_Time"].astype(str)
+    codes, uniques = pd.factorize(raw)
+    parsed = pd.to_datetime(pd.Series(uniques), format="%d/%m/%Y %H:%M:%S")
+    return pd.Series(parsed.to_numpy()[codes], index=frame.index)
+
+
+def compute_rollups(documents, freq):
+    """
+    Aggregates a batch of documents into count/sum/min/max/last per series and period.
+
+    Args:
+        documents (list): Documents produced by create_documents.
+        freq (str): Pandas frequency of the period, 'h' or 'D'.
+
+    Returns:
+        DataFrame: One row per ROLLUP_KEY and Period_Start.
+    """
+    frame = pd.DataFrame(documents, columns=ROLLUP_KEY + ["Measure_Date", "Measure_Time", "Stat_Value"])
+    frame["Timestamp"] = local_measure_times(frame)
+    frame["Period_Start"] = frame["Timestamp"].dt.floor(freq)
+    frame = frame.sort_values("Timestamp", kind="stable")
+    return frame.groupby(ROLLUP_KEY + ["Period_Start"], sort=False, dropna=False).agg(
+        Count=("Stat_Value", "size"),
+        Sum=("Stat_Value", "sum"),
+        Min=("Stat_Value", "min"),
+        Max=("Stat_Value", "max"),
+        Last=("Stat_Value", "last"),
+        Last_Time=("Timestamp", "max")
+    ).reset_index()
+
+
+class RollupWriter:
+    """
+    Maintains hourly and daily rollups of Processed_Routers_Metrics.
+
+    Each batch is folded into the existing rows with $inc/$min/$max, so the
+    rollups are never rebuilt from the raw metrics. The batch ID is recorded
+    on every row it touched, and a replayed batch is ignored, so re-running
+    the ETL does not double count.
+
+    Args:
+        uri (str): MongoDB connection string.
+        database (str): Name of the processed database.
+        client (MongoClient): Optional client to use instead of the shared one.
+    """
+
+    _indexed = set()
+
+    def __init__(self, uri="mongodb://localhost:27017/", database="Processed_DataBase", client=None):
+        self.client = client if client is not None else get_client(uri)
+        self.db = self.client[database]
+        self.ensure_indexes()
+
+    def ensure_indexes(self):
+        for collection_name in ROLLUP_GRAINS:
+            collection = self.db[collection_name]
+            index_owner = (id(self.client), collection.full_name)
+            if index_owner in RollupWriter._indexed:
+                continue
+            collection.create_index([(field, 1) for field in ROLLUP_KEY + ["Period_Start"]], unique=True, name="rollup_key")
+            collection.create_index([("Period_Start", 1), ("IP_Address", 1)])
+            RollupWriter._indexed.add(index_owner)
+
+    def update(self, documents, batch_id):
+        """
+        Folds a batch of documents into every rollup grain.
+
+        Args:
+            documents (list): Documents produced by create_documents.
+            batch_id (str): Stable identifier of the batch, e.g. the traffic document ID.
+
+        Returns:
+            int: The number of rollup rows touched.
+        """
+        if not documents:
+            return 0
+        touched = 0
+        for collection_name, freq in ROLLUP_GRAINS.items():
+            collection = self.db[collection_name]
+            folds = []
+            lasts = []
+            for row in compute_rollups(documents, freq).to_dict('records'):
+                key = {field: row[field] for field in ROLLUP_KEY}
+                key["Period_Start"] = row["Period_Start"].to_pydatetime()
+                last_time = row["Last_Time"].to_pydatetime()
+                # Matches nothing once the batch is recorded, and the upsert then hits the unique key and is skipped
+                folds.append(UpdateOne(
+                    {**key, "Batches": {"$ne": batch_id}},
+                    {
+                        "$inc": {"Count": row["Count"], "Sum": row["Sum"]},
+                        "$min": {"Min": row["Min"]},
+                        "$max": {"Max": row["Max"]},
+                        "$addToSet": {"Batches": batch_id}
+                    },
+                    upsert=True
+                ))
+                lasts.append(UpdateOne(
+                    {**key, "$or": [{"Last_Time": {"$lte": last_time}}, {"Last_Time": {"$exists": False}}]},
+                    {"$set": {"Last": row["Last"], "Last_Time": last_time}}
+                ))
+            try:
+                collection.bulk_write(folds, ordered=False)
+            except BulkWriteError as e:
+                unexpected = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+                if unexpected:
+                    raise
+            collection.bulk_write(lasts, ordered=False)
+            touched += len(folds)
+        return touched
+
+    def replace(self, documents, batch_id, ip_address, start, end):
+        """
+        Rebuilds the rollup rows of one router between start and end.
+
+        Used by backfills: documents are every processed metric of the router
+        in that span, so rows are written whole instead of folded in, and rows
+        of the span that are no longer produced are deleted afterwards.
+
+        Args:
+            documents (list): The router's documents between start and end.
+            batch_id (str): Recorded as the only batch of every row.
+            ip_address (str): The router.
+            start, end (datetime): Span of whole periods of every grain, in
+                the documents' local time.
+
+        Returns:
+            int: The number of rollup rows written.
+        """
+        written = 0
+        for collection_name, freq in ROLLUP_GRAINS.items():
+            collection = self.db[collection_name]
+            replacements = []
+            kept = set()  # Rollup keys of the rows written, so the others of the span are deleted
+            if documents:
+                for row in compute_rollups(documents, freq).to_dict('records'):
+                    key = {field: row[field] for field in ROLLUP_KEY}
+                    key["Period_Start"] = row["Period_Start"].to_pydatetime()
+                    kept.add(tuple(key[field] for field in ROLLUP_KEY + ["Period_Start"]))
+                    replacements.append(ReplaceOne(key, {
+                        **key,
+                        "Count": row["Count"], "Sum": row["Sum"], "Min": row["Min"], "Max": row["Max"],
+                        "Last": row["Last"], "Last_Time": row["Last_Time"].to_pydatetime(), "Batches": [batch_id]
+                    }, upsert=True))
+            if replacements:
+                collection.bulk_write(replacements, ordered=False)
+            stale_ids = [row["_id"] for row in collection.find(
+                {"IP_Address": ip_address, "Period_Start": {"$gte": start, "$lt": end}},
+                {field: 1 for field in ROLLUP_KEY + ["Period_Start"]}
+            ) if tuple(row.get(field) for field in ROLLUP_KEY + ["Period_Start"]) not in kept]
+            if stale_ids:
+                collection.delete_many({"_id": {"$in": stale_ids}})
+            written += len(replacements)
+        return written
@@ -0,0 +1,161 @@
+import logging
+import weakref
+from datetime import datetime
+
+from pymongo import MongoClient, ReplaceOne, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from Pipeline_Metrics import mongo_latency_listener
+
+logger = logging.getLogger("Metrics_Writer")
+
+# Fields identifying one processed metric; re-running the ETL replaces instead of duplicating
+NATURAL_KEY = [
+    "IP_Address",
+    "Measure_Date",
+    "Measure_Time",
+    "Interface_ID",
+    "Protocol_Version",
+    "New_Stat_Description"
+]
+
+# Indexes of the dashboard queries: one router's interfaces over a time range, and every router over a time range
+QUERY_INDEXES = {
+    "series_time": [("IP_Address", 1), ("Interface_ID", 1), ("Measure_Timestamp", 1)],
+    "time": [("Measure_Timestamp", 1)]
+}
+
+# Single-field indexes created before Measure_Timestamp existed; Migrate_Timestamps.py drops them
+LEGACY_QUERY_INDEXES = ["IP_Address_1", "Measure_Date_1", "Measure_Time_1", "Protocol_Version_1", "Interface_ID_1"]
+
+# (Measure_Day, IP_Address) partitions written, with the version of their last write, for query caches in other processes
+CHANGES_COLLECTION = "Metrics_Changes"
+
+# Query caches of this process, invalidated as soon as a writer records a change
+_change_listeners = weakref.WeakSet()
+
+def add_change_listener(listener):
+    # listener.invalidate(partitions) is called with the (ISO day, IP address) pairs of every write
+    _change_listeners.add(listener)
+
+# One client per URI, shared by every writer in the process (MongoClient pools its own connections)
+_clients = {}
+
+def get_client(uri="mongodb://localhost:27017/"):
+    client = _clients.get(uri)
+    if client is None:
+        client = _clients[uri] = MongoClient(uri, event_listeners=[mongo_latency_listener])
+    return client
+
+
+class MetricsWriter:
+    """
+    Upserts processed metric documents into Processed_Routers_Metrics.
+
+    Documents are sent as unordered bulk writes of batch_size upserts keyed
+    on NATURAL_KEY, so a failed document does not abort its batch and
+    re-running the ETL over the same data leaves the collection unchanged.
+
+    Args:
+        uri (str): MongoDB connection string.
+        database (str): Name of the processed database.
+        collection (str): Name of the metrics collection.
+        batch_size (int): Number of upserts per bulk write.
+        client (MongoClient): Optional client to use instead of the shared one,
+            e.g. a mongomock.MongoClient in tests.
+        track_changes (bool): Record the days and routers of every write in
+            Metrics_Changes, so query caches drop what it made stale.
+    """
+
+    _indexed = set()  # Collections whose indexes were already ensured in this process
+
+    def __init__(self, uri="mongodb://localhost:27017/", database="Processed_DataBase",
+                 collection="Processed_Routers_Metrics", batch_size=1000, client=None, track_changes=True):
+        self.client = client if client is not None else get_client(uri)
+        self.collection = self.client[database][collection]
+        self.changes = self.client[database][CHANGES_COLLECTION] if track_changes else None
+        self.batch_size = batch_size
+        self.ensure_indexes()
+
+    def ensure_indexes(self):
+        index_owner = (id(self.client), self.collection.full_name)
+        if index_owner in MetricsWriter._indexed:
+            return
+        for name, keys in QUERY_INDEXES.items():
+            self.collection.create_index(keys, name=name)
+        natural_key = [(field, 1) for field in NATURAL_KEY]
+        try:
+            self.collection.create_index(natural_key, unique=True, name="natural_key")
+        except OperationFailure as e:
+            # Duplicates inserted before upserts existed block the unique index; upserts still need the lookup index
+            logger.warning("Unique natural key index not created (%s); falling back to a non-unique index.", e)
+            self.collection.create_index(natural_key, name="natural_key_non_unique")
+        if self.changes is not None:
+            self.changes.create_index("Version")
+        MetricsWriter._indexed.add(index_owner)
+
+    def _flush(self, requests, request_partitions, result, written):
+        # Sends one bulk write and adds the partitions of its successful writes to written
+        try:
+            outcome = self.collection.bulk_write(requests, ordered=False)
+            details = outcome.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            result["errors"].extend(details.get("writeErrors", []))
+        result["upserted"] += details.get("nUpserted", 0)
+        result["modified"] += details.get("nModified", 0)
+        result["matched"] += details.get("nMatched", 0)
+        failed = {error["index"] for error in details.get("writeErrors", [])}
+        written.update(dict.fromkeys(partition for position, partition in enumerate(request_partitions)
+                                     if position not in failed))
+
+    def write(self, documents):
+        """
+        Upserts documents in batches of batch_size.
+
+        Only the partitions with at least one document written are recorded
+        as changed; a partition whose every write failed is left unchanged
+        in the collection, so cached queries reading it stay valid.
+
+        Args:
+            documents (iterable): Documents produced by create_documents.
+
+        Returns:
+            dict: Counts of upserted, matched and modified documents and
+            the list of write errors reported by the server.
+        """
+        result = {"upserted": 0, "matched": 0, "modified": 0, "errors": []}
+        requests, request_partitions = [], []
+        written = {}  # Partitions with a successful write, in order
+        for document in documents:
+            key = {field: document.get(field) for field in NATURAL_KEY}
+            requests.append(ReplaceOne(key, document, upsert=True))
+            request_partitions.append((key["Measure_Date"], key["IP_Address"]))
+            if len(requests) >= self.batch_size:
+                self._flush(requests, request_partitions, result, written)
+                requests, request_partitions = [], []
+        if requests:
+            self._flush(requests, request_partitions, result, written)
+        self.record_changes((datetime.strptime(measure_date, "%d/%m/%Y").date().isoformat(), ip_address)
+                            for measure_date, ip_address in written if measure_date)
+        return result
+
+    def record_changes(self, partitions):
+        """
+        Bumps the version of the (ISO day, IP address) partitions written.
+
+        The versions come from one counter, so a cache that has seen
+        version n only needs the partitions changed after it.
+        """
+        partitions = set(partitions)
+        if not partitions:
+            return
+        for listener in list(_change_listeners):
+            listener.invalidate(partitions)
+        if self.changes is None:
+            return
+        version = self.changes.find_one_and_update({"_id": "version"}, {"$inc": {"Version": 1}}, upsert=True,
+                                                   return_document=ReturnDocument.AFTER)["Version"]
+        self.changes.bulk_write([UpdateOne({"_id": f"{day}|{ip_address}"},
+                                           {"$set": {"Measure_Day": day, "IP_Address": ip_address, "Version": version}},
+                                           upsert=True) for day, ip_address in partitions], ordered=False)
@@ -0,0 +1,118 @@
+import argparse
+import logging
+
+import pandas as pd
+from pymongo import UpdateMany
+
+from ETL_Routers import measure_timestamps_utc
+from Metrics_Writer import MetricsWriter, LEGACY_QUERY_INDEXES, get_client
+from Pipeline_Metrics import metrics, configure_logging, add_instrumentation_arguments
+
+logger = logging.getLogger("Migrate_Timestamps")
+
+# Processed metrics written before the ETL emitted Measure_Timestamp
+MISSING_TIMESTAMP = {"Measure_Timestamp": {"$exists": False}}
+
+
+def backfill_timestamps(collection, batch_size=500):
+    """
+    Sets Measure_Timestamp on the processed metrics stored without it.
+
+    The distinct (Measure_Date, Measure_Time) pairs are read with one
+    aggregation and parsed once each; every pair is then one update_many,
+    served by the legacy Measure_Date index, instead of one write per
+    document. Documents that already have the field are left alone, so an
+    interrupted migration can simply be run again.
+
+    Args:
+        collection (Collection): Processed_Routers_Metrics.
+        batch_size (int): update_many requests per bulk write.
+
+    Returns:
+        int: The number of documents updated.
+    """
+    with metrics.span("migrate.distinct_times"):
+        pairs = [group["_id"] for group in collection.aggregate([
+            {"$match": MISSING_TIMESTAMP},
+            {"$group": {"_id": {"date": "$Measure_Date", "time": "$Measure_Time"}}}
+        ], allowDiskUse=True)]
+    pairs = [pair for pair in pairs if pair.get("date") and pair.get("time")]
+    logger.info("%d distinct measure times to convert.", len(pairs))
+    if not pairs:
+        return 0
+
+    timestamps = measure_timestamps_utc([f"{pair['date']} {pair['time']}" for pair in pairs])
+    updated = 0
+    requests = []
+    for position, (pair, timestamp) in enumerate(zip(pairs, timestamps)):
+        requests.append(UpdateMany(
+            {"Measure_Date": pair["date"], "Measure_Time": pair["time"], **MISSING_TIMESTAMP},
+            {"$set": {"Measure_Timestamp": pd.Timestamp(timestamp).to_pydatetime()}}
+        ))
+        if len(requests) >= batch_size or position + 1 == len(pairs):
+            with metrics.span("migrate.update"):
+                updated += collection.bulk_write(requests, ordered=False).modified_count
+            requests = []
+            logger.info("%d / %d measure times converted, %d documents updated.", position + 1, len(pairs), updated)
+    metrics.increment("migrate.documents_updated", updated)
+    return updated
+
+
+def drop_legacy_indexes(collection):
+    existing = collection.index_information()
+    dropped = [name for name in LEGACY_QUERY_INDEXES if name in existing]
+    for name in dropped:
+        collection.drop_index(name)
+    return dropped
+
+
+def migrate(client, database="Processed_DataBase", collection_name="Processed_Routers_Metrics", keep_legacy_indexes=False):
+    """
+    Moves an existing Processed_Routers_Metrics collection to the
+    Measure_Timestamp layout.
+
+    Timestamps are backfilled first, while the legacy single-field indexes
+    can still find each measure time, then the compound QUERY_INDEXES are
+    built over the complete field, and finally the legacy indexes are
+    dropped so inserts stop maintaining them.
+
+    Args:
+        client (MongoClient): Client of the processed database.
+        keep_legacy_indexes (bool): Keep the single-field indexes, e.g. while
+            older Power BI queries still filter on Measure_Date.
+    """
+    collection = client[database][collection_name]
+    updated = backfill_timestamps(collection)
+    logger.info("Measure_Timestamp set on %d documents.", updated)
+
+    with metrics.span("migrate.create_indexes"):
+        MetricsWriter(database=database, collection=collection_name, client=client)
+
+    remaining = collection.count_documents(MISSING_TIMESTAMP)
+    if remaining:
+        # Without a parseable Measure_Date / Measure_Time there is nothing to convert
+        logger.warning("%d documents still have no Measure_Timestamp.", remaining)
+    if not keep_legacy_indexes:
+        dropped = drop_legacy_indexes(collection)
+        logger.info("Dropped legacy indexes: %s", ", ".join(dropped) or "none")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add Measure_Timestamp and the compound time indexes to existing processed metrics.")
+    parser.add_argument("--uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--database", default="Processed_DataBase")
+    parser.add_argument("--collection", default="Processed_Routers_Metrics")
+    parser.add_argument("--keep-legacy-indexes", action="store_true",
+                        help="Keep the single-field IP_Address / Measure_Date / ... indexes")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level, args.log_file)
+
+    with metrics.span("migrate.run"):
+        migrate(get_client(args.uri), args.database, args.collection, args.keep_legacy_indexes)
+    metrics.log_summary(logger)
+    if args.metrics_file:
+        metrics.export(args.metrics_file, args.metrics_format)
+
+if __name__ == "__main__":
+    main()
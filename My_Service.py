@@ -1,22 +1,23 @@
-import os
-import subprocess
-import time
+import threading
 import win32serviceutil
 import win32service
 import win32event
 import servicemanager
-import schedule
+from Pipeline_Runner import PipelineRunner, default_log_path, default_metrics_path
+from Pipeline_Metrics import configure_logging
 
 class ETLService(win32serviceutil.ServiceFramework):
     _svc_name_ = "MyService"
     _svc_display_name_ = "My Service"
-    
+
     def __init__(self, args):
         win32serviceutil.ServiceFramework.__init__(self, args)
         self.hWaitStop = win32event.CreateEvent(None, 0, 0, None)
+        self.stop_event = threading.Event()
 
     def SvcStop(self):
         self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING)
+        self.stop_event.set()
         win32event.SetEvent(self.hWaitStop)
 
     def SvcDoRun(self):
@@ -27,22 +28,9 @@ class ETLService(win32serviceutil.ServiceFramework):
         self.main()
 
     def main(self):
-        schedule.every(15).minutes.do(self.run_ingest_data)
-        schedule.every(20).minutes.do(self.run_etl)
-        
-        self.run_etl()  # Run ETL immediately
-        
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
-
-    def run_ingest_data(self):
-        print("Running IngestData.py...")
-        subprocess.run(["python", os.path.join("C:\\Users\\hp\\OneDrive\\Bureau\\End_Studies_Project", "Ingest_RouterData.py")])
-
-    def run_etl(self):
-        print("Running ETL.py...")
-        subprocess.run(["python", os.path.join("C:\\Users\\hp\\OneDrive\\Bureau\\End_Studies_Project", "ETL_Routers.py")])
+        # Ingestion and ETL run in this process as soon as new files land, instead of a python subprocess per schedule tick
+        configure_logging("INFO", default_log_path)
+        PipelineRunner(metrics_path=default_metrics_path).run_forever(self.stop_event)
 
 if __name__ == '__main__':
     win32serviceutil.HandleCommandLine(ETLService)
@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+from ETL_Routers import (
+    match_documents, create_config_dataframe_from_document, create_stat_dataframe_from_document,
+    transform_frames, export_documents_to_parquet, remove_parquet_batch
+)
+from Router_Files import parse_router_file, stream_file_parts
+from Metrics_Writer import NATURAL_KEY
+from Counter_Rates import add_counter_rates
+from Router_Schema import STAT, CONFIG, SchemaViolation, MeasurementColumns, document_kind
+from State_Store import StateStore
+from Pipeline_Metrics import metrics, configure_logging, add_instrumentation_arguments
+
+logger = logging.getLogger("Offline_ETL")
+
+# Stat rows flattened before a chunk is transformed and written
+chunk_rows = 500000
+
+
+# Function to read the routers of a Stat or Config file, for match_documents
+def router_keys_document(file_name, ip_addresses):
+    # The same shape ETL_Routers.ROUTER_KEYS_PROJECTION gives stored documents
+    return {"_id": file_name, "routers": {ip_address: {"Measure_Time": True} for ip_address in ip_addresses}}
+
+def scan_json_files(directory):
+    """
+    Validates the Stat_ and Config_ files of directory and pairs them.
+
+    Config files are flattened whole and kept, as their interface frames are
+    reused for every traffic file paired with them; Stat files are only
+    streamed router by router here, to collect their routers.
+
+    Args:
+        directory (str): Directory holding the JSON files, e.g. Directory_Json/QoS_CPE.
+
+    Returns:
+        tuple: (pairs, config_frames) where pairs are (config file, stat file)
+        paths in match_documents order and config_frames maps each paired
+        config file to its interface DataFrame.
+    """
+    config_documents, traffic_documents = [], []
+    config_measurements = {}
+    # Name order stands in for the ingestion order the Mongo path matches in
+    for file_name in sorted(os.listdir(directory)):
+        file_path = os.path.join(directory, file_name)
+        kind = document_kind(file_name)
+        if kind is None or not file_name.endswith(".json"):
+            continue
+        try:
+            if kind == CONFIG:
+                json_data, measurements = parse_router_file(file_path)
+                config_measurements[file_path] = measurements
+                config_documents.append(router_keys_document(file_path, json_data["routers"]))
+            else:
+                with metrics.span("offline.scan"):
+                    ip_addresses = dict.fromkeys(ip_address for part in stream_file_parts(file_path, STAT) for ip_address in part)
+                traffic_documents.append(router_keys_document(file_path, ip_addresses))
+        except (json.JSONDecodeError, SchemaViolation) as e:
+            # The Mongo path routes these files to Unknown_Files, so they produce no metrics either
+            logger.warning("File '%s' skipped: %s", file_name, e)
+            metrics.increment("offline.files_skipped")
+
+    with metrics.span("etl.match"):
+        matched = match_documents(config_documents, traffic_documents, set())
+    pairs = [(config_doc["_id"], traffic_doc["_id"]) for config_doc, traffic_doc in matched]
+    with metrics.span("etl.config_frame"):
+        config_frames = {config_path: create_config_dataframe_from_document(None, measurements=config_measurements[config_path])
+                         for config_path in dict.fromkeys(config_path for config_path, _ in pairs)}
+    logger.info("%d config and %d stat files read, %d pairs matched.", len(config_documents), len(traffic_documents), len(pairs))
+    return pairs, config_frames
+
+def iter_json_chunks(stat_path, max_rows=None):
+    """
+    Yields the measurements of a Stat file in chunks of about max_rows rows.
+
+    The file is streamed one router (or, for very large routers, one run of
+    timestamps) at a time, so no more than a chunk is held in memory and no
+    measurement is split between chunks.
+
+    Yields:
+        tuple: flatten_measurements output for the chunk.
+    """
+    max_rows = max_rows or chunk_rows
+    measurements = MeasurementColumns()
+    for routers in stream_file_parts(stat_path):
+        for ip_address, router_data in routers.items():
+            measurements.add_router(ip_address, router_data)
+        if len(measurements.values) >= max_rows:
+            yield measurement_columns(measurements)
+            measurements = MeasurementColumns()
+    if measurements.values:
+        yield measurement_columns(measurements)
+
+def measurement_columns(measurements):
+    keys, key_codes, values, ip_addresses, measure_times, sizes = measurements.columns()
+    return keys, np.asarray(key_codes, dtype=np.intp), values, ip_addresses, measure_times, sizes
+
+def csv_measure_keys(frame):
+    # (IP address, Measure_Time key) per row, for both the stat_data.csv and stat_data_New.csv layouts
+    if "Measure_DateTime" in frame.columns:
+        measure_times = frame["Measure_DateTime"]
+    else:
+        measure_times = frame["Measure_Date"] + "  " + frame["Measure_Time"]
+    return np.column_stack([frame["IP_Address"].to_numpy(dtype=object), measure_times.to_numpy(dtype=object)])
+
+def measurement_starts(measure_keys):
+    # First row of every run of rows sharing a measurement key
+    if not len(measure_keys):
+        return np.array([], dtype=np.intp)
+    return np.flatnonzero(np.append(True, (measure_keys[1:] != measure_keys[:-1]).any(axis=1)))
+
+def csv_stat_measurements(frame):
+    """
+    Turns rows of a stat_data.csv-style file back into measurement columns.
+
+    The raw key is rebuilt as Stat_Description (joined with Protocol_Version
+    in the stat_data_New.csv layout), plus '.<Interface_ID>' for interface
+    rows, and consecutive rows sharing IP address and timestamp form one
+    measurement, so the rows run through the same parsing as a stored Stat
+    document.
+
+    Args:
+        frame (DataFrame): IP_Address, Measure_Date and Measure_Time (or
+            Measure_DateTime and Protocol_Version), Stat_Description,
+            Interface_ID and Stat_Value columns.
+
+    Returns:
+        tuple: flatten_measurements output for the rows.
+    """
+    descriptions = frame["Stat_Description"]
+    if "Protocol_Version" in frame.columns:
+        descriptions = descriptions + "." + frame["Protocol_Version"]
+    interface_ids = frame["Interface_ID"].to_numpy()
+    raw_keys = np.where(interface_ids != 0, descriptions + "." + frame["Interface_ID"].astype(str), descriptions)
+    key_codes, keys = pd.factorize(pd.Series(raw_keys, dtype=object))
+    measure_keys = csv_measure_keys(frame)
+    starts = measurement_starts(measure_keys)
+    sizes = np.diff(np.append(starts, len(frame))).tolist()
+    return (list(keys), key_codes.astype(np.intp), frame["Stat_Value"].tolist(),
+            measure_keys[starts, 0].tolist(), measure_keys[starts, 1].tolist(), sizes)
+
+def csv_config_measurements(frame):
+    """
+    Turns rows of a config_data.csv-style file back into measurement columns,
+    with 'Interface_Name.Interface_ID' keys and one measurement per router
+    and date.
+    """
+    raw_keys = frame["Interface_Name"] + "." + frame["Interface_ID"].astype(str)
+    key_codes, keys = pd.factorize(raw_keys)
+    measure_keys = frame[["IP_Address", "Measure_Date"]].to_numpy(dtype=object)
+    starts = measurement_starts(measure_keys)
+    sizes = np.diff(np.append(starts, len(frame))).tolist()
+    measure_times = [f"{date}  0:00:00" for date in measure_keys[starts, 1]]
+    return list(keys), key_codes.astype(np.intp), frame["Interface_Description"].tolist(), measure_keys[starts, 0].tolist(), measure_times, sizes
+
+def iter_csv_chunks(stat_csv, max_rows=None):
+    """
+    Yields the measurements of a stat CSV in chunks of about max_rows rows.
+
+    The rows of the last measurement of a chunk are held back and prepended
+    to the next one, so a measurement is never split.
+    """
+    carry = None
+    text_columns = ["IP_Address", "Measure_Date", "Measure_Time", "Measure_DateTime", "Protocol_Version", "Stat_Description"]
+    for frame in pd.read_csv(stat_csv, dtype={column: str for column in text_columns}, chunksize=max_rows or chunk_rows):
+        if carry is not None:
+            frame = pd.concat([carry, frame], ignore_index=True)
+        starts = measurement_starts(csv_measure_keys(frame))
+        # The last measurement may continue in the next chunk
+        carry = frame.iloc[starts[-1]:]
+        if starts[-1]:
+            yield csv_stat_measurements(frame.iloc[:starts[-1]].reset_index(drop=True))
+    if carry is not None and len(carry):
+        yield csv_stat_measurements(carry.reset_index(drop=True))
+
+def transform_chunk(measurements, config_df):
+    # Same stages as ETL_Routers.transform_pair, on a chunk of the stat document
+    with metrics.span("etl.stat_frame"):
+        traffic_df = create_stat_dataframe_from_document(None, measurements=measurements)
+    return transform_frames(traffic_df, config_df)
+
+def write_chunks(chunks, config_df, batch_id, output_dir, state_store=None, partition_by_ip=False):
+    """
+    Transforms the chunks of one stat input and appends them to the Parquet dataset.
+
+    Args:
+        chunks (iterable): Measurement columns of the stat input.
+        config_df (DataFrame): Interfaces of the paired config.
+        batch_id (str): Name of the stat input; chunk files are named
+            '<batch_id>_<chunk>-0.parquet', and those of an earlier run are
+            deleted first so a re-run with fewer chunks leaves none behind.
+        state_store (StateStore): Last value per counter series; None skips the rates.
+
+    Returns:
+        int: The number of documents written.
+    """
+    written = 0
+    remove_parquet_batch(output_dir, batch_id)
+    for chunk_number, measurements in enumerate(chunks):
+        documents = transform_chunk(measurements, config_df)
+        if state_store is not None:
+            with metrics.span("etl.counter_rates"):
+                documents = add_counter_rates(documents, state_store)
+        with metrics.span("etl.parquet_export"):
+            export_documents_to_parquet(documents, output_dir, f"{batch_id}_{chunk_number}", partition_by_ip)
+        written += len(documents)
+    metrics.increment("offline.documents_written", written)
+    logger.info("%s: %d documents written.", batch_id, written)
+    return written
+
+def run_json(directory, output_dir, state_store=None, partition_by_ip=False, max_rows=None):
+    pairs, config_frames = scan_json_files(directory)
+    for config_path, stat_path in pairs:
+        batch_id = os.path.splitext(os.path.basename(stat_path))[0]
+        write_chunks(iter_json_chunks(stat_path, max_rows), config_frames[config_path], batch_id, output_dir,
+                     state_store, partition_by_ip)
+    return len(pairs)
+
+def run_csv(stat_csv, config_csv, output_dir, state_store=None, partition_by_ip=False, max_rows=None):
+    config_rows = pd.read_csv(config_csv, dtype={"IP_Address": str, "Measure_Date": str, "Interface_Name": str,
+                                                 "Interface_Description": str})
+    config_df = create_config_dataframe_from_document(None, measurements=csv_config_measurements(config_rows))
+    batch_id = os.path.splitext(os.path.basename(stat_csv))[0]
+    write_chunks(iter_csv_chunks(stat_csv, max_rows), config_df, batch_id, output_dir, state_store, partition_by_ip)
+    return 1
+
+def load_dataset(path):
+    """Reads a Parquet dataset written by export_documents_to_parquet, sorted by the natural key."""
+    import pyarrow.parquet as pq
+    frame = pq.read_table(path).to_pandas()
+    for column in frame.columns:
+        if isinstance(frame[column].dtype, pd.CategoricalDtype):  # Hive partition columns
+            frame[column] = frame[column].astype(str)
+    frame = frame.drop(columns=[column for column in ("Measure_Day",) if column in frame.columns])
+    frame = frame[sorted(frame.columns)]
+    return frame.sort_values(NATURAL_KEY, kind="stable").reset_index(drop=True)
+
+def compare_datasets(path, reference_path):
+    """
+    Compares two Parquet datasets row by row, ignoring file layout and row order.
+
+    Returns:
+        list: Descriptions of the differences; empty when the datasets match.
+    """
+    frame, reference = load_dataset(path), load_dataset(reference_path)
+    if list(frame.columns) != list(reference.columns):
+        return [f"columns {list(frame.columns)} != {list(reference.columns)}"]
+    if len(frame) != len(reference):
+        return [f"{len(frame)} rows != {len(reference)} rows"]
+    differences = []
+    for column in frame.columns:
+        left, right = frame[column], reference[column]
+        # Nullable columns (Stat_Delta) compare to NA where either side is missing, which any() would skip
+        differs = ~((left == right).fillna(False).astype(bool) | (left.isna() & right.isna()))
+        if differs.any():
+            differences.append(f"{column}: {int(differs.sum())} rows differ, e.g. {left[differs].iloc[0]!r} != {right[differs].iloc[0]!r}")
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the ETL from Stat_/Config_ JSON files or CSV intermediates straight "
+                                                 "to a Parquet dataset, without MongoDB.")
+    parser.add_argument("output_dir", help="Root of the Parquet dataset")
+    parser.add_argument("--json-dir", help="Directory of Stat_/Config_ JSON files, e.g. Directory_Json/QoS_CPE")
+    parser.add_argument("--stat-csv", help="stat_data.csv-style input (with --config-csv)")
+    parser.add_argument("--config-csv", help="config_data.csv-style input (with --stat-csv)")
+    parser.add_argument("--chunk-rows", type=int, default=chunk_rows, help="Stat rows transformed and written at a time")
+    parser.add_argument("--partition-by-ip", action="store_true", help="Also partition the dataset by IP_Address")
+    parser.add_argument("--no-rates", action="store_true", help="Do not compute counter deltas / rates")
+    parser.add_argument("--state-db", help="SQLite state store to continue counter rates from (default: in memory)")
+    parser.add_argument("--compare", metavar="DATASET",
+                        help="Compare the output with this dataset (e.g. from ETL_Routers.py --parquet-dir) and exit 1 on differences")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level, args.log_file)
+    if not args.json_dir and not (args.stat_csv and args.config_csv):
+        parser.error("pass --json-dir, or --stat-csv and --config-csv")
+
+    state_store = None if args.no_rates else StateStore(args.state_db or ":memory:")
+    with metrics.span("offline.run"):
+        if args.json_dir:
+            run_json(args.json_dir, args.output_dir, state_store, args.partition_by_ip, args.chunk_rows)
+        else:
+            run_csv(args.stat_csv, args.config_csv, args.output_dir, state_store, args.partition_by_ip, args.chunk_rows)
+    metrics.log_summary(logger)
+    if args.metrics_file:
+        metrics.export(args.metrics_file, args.metrics_format)
+
+    if args.compare:
+        differences = compare_datasets(args.output_dir, args.compare)
+        for difference in differences:
+            logger.error("Differs from %s: %s", args.compare, difference)
+        if differences:
+            sys.exit(1)
+        logger.info("Output matches %s.", args.compare)
+
+if __name__ == "__main__":
+    main()
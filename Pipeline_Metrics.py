@@ -0,0 +1,205 @@
+import os
+import re
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from pymongo import monitoring
+
+# Prefix of every exported Prometheus metric
+METRIC_PREFIX = "fbb_pipeline"
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+logger = logging.getLogger("Pipeline_Metrics")
+
+
+class PipelineMetrics:
+    """
+    Timed spans and counters for the pipeline stages.
+
+    A span records how often a stage ran, its total and its longest
+    duration; a counter accumulates rows, documents, bytes and the like;
+    a high-water mark keeps the largest value seen, e.g. peak memory.
+    Values are cumulative for the life of the process, as Prometheus
+    counters expect. Worker processes send a snapshot() back with their
+    result and the parent folds it in with merge().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.spans = {}
+            self.counters = {}
+            self.high_water_marks = {}
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            span = self.spans.setdefault(name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            span["count"] += 1
+            span["seconds"] += seconds
+            span["max_seconds"] = max(span["max_seconds"], seconds)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def high_water(self, name, value):
+        with self._lock:
+            self.high_water_marks[name] = max(self.high_water_marks.get(name, value), value)
+
+    def snapshot(self):
+        with self._lock:
+            return {"spans": {name: dict(span) for name, span in self.spans.items()}, "counters": dict(self.counters),
+                    "high_water_marks": dict(self.high_water_marks)}
+
+    def merge(self, snapshot):
+        with self._lock:
+            for name, other in snapshot["spans"].items():
+                span = self.spans.setdefault(name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+                span["count"] += other["count"]
+                span["seconds"] += other["seconds"]
+                span["max_seconds"] = max(span["max_seconds"], other["max_seconds"])
+            for name, amount in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+            for name, value in snapshot.get("high_water_marks", {}).items():
+                self.high_water_marks[name] = max(self.high_water_marks.get(name, value), value)
+
+    def to_json(self):
+        return json.dumps({"timestamp": time.time(), **self.snapshot()}, indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """
+        Renders the metrics in the Prometheus text exposition format.
+
+        Spans become fbb_pipeline_span_{seconds_total,count_total,seconds_max}
+        labelled by span name; a counter such as 'etl.rows' becomes
+        fbb_pipeline_etl_rows_total and a high-water mark such as
+        'etl.peak_rss_bytes' the gauge fbb_pipeline_etl_peak_rss_bytes.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        span_series = [
+            ("span_seconds_total", "seconds", "counter", "Seconds spent in the span."),
+            ("span_count_total", "count", "counter", "Times the span ran."),
+            ("span_seconds_max", "max_seconds", "gauge", "Longest single run of the span.")
+        ]
+        for suffix, field, kind, description in span_series:
+            metric = f"{METRIC_PREFIX}_{suffix}"
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, span in sorted(snapshot["spans"].items()):
+                lines.append(f'{metric}{{span="{name}"}} {span[field]!r}')
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = f"{METRIC_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value!r}")
+        for name, value in sorted(snapshot["high_water_marks"].items()):
+            metric = f"{METRIC_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value!r}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path, metrics_format=None):
+        """
+        Writes the metrics to path, replacing it atomically so a scraper
+        (e.g. the node_exporter text-file collector) never reads half a file.
+
+        Args:
+            path (str): Output file.
+            metrics_format (str): 'json' or 'prometheus'; by default '.prom'
+                files are written as Prometheus text and anything else as JSON.
+        """
+        if metrics_format is None:
+            metrics_format = "prometheus" if path.endswith(".prom") else "json"
+        content = self.to_prometheus() if metrics_format == "prometheus" else self.to_json()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            f.write(content)
+        os.replace(temporary_path, path)
+
+    def log_summary(self, target_logger=logger, level=logging.INFO):
+        snapshot = self.snapshot()
+        for name, span in sorted(snapshot["spans"].items()):
+            target_logger.log(level, "%s: %d runs, %.3fs total, %.3fs max",
+                              name, span["count"], span["seconds"], span["max_seconds"])
+        for name, value in sorted(snapshot["counters"].items()):
+            target_logger.log(level, "%s: %s", name, value)
+        for name, value in sorted(snapshot["high_water_marks"].items()):
+            target_logger.log(level, "%s: %s (high-water mark)", name, value)
+
+
+# Shared by every module of the process
+metrics = PipelineMetrics()
+
+
+def peak_rss():
+    # Process high-water mark in bytes; ru_maxrss is in KiB on Linux and bytes on macOS
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+class MongoLatencyListener(monitoring.CommandListener):
+    """Records the round-trip time of every MongoDB command as a 'mongo.<command>' span."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        metrics.observe(f"mongo.{event.command_name}", event.duration_micros / 1e6)
+
+    def failed(self, event):
+        metrics.observe(f"mongo.{event.command_name}", event.duration_micros / 1e6)
+        metrics.increment("mongo.command_failures")
+
+
+# Passed to MongoClient(event_listeners=...) by the modules that create clients
+mongo_latency_listener = MongoLatencyListener()
+
+
+def configure_logging(level="INFO", path=None):
+    """
+    Sends the pipeline logs to stdout, or to path when given (the Windows
+    service has no console).
+
+    Args:
+        level (str or int): Logging level, e.g. 'DEBUG' to see every
+            matched pair and DataFrame preview.
+        path (str): Optional log file.
+    """
+    if isinstance(level, str):
+        level = level.upper()
+    handler = logging.FileHandler(path) if path else logging.StreamHandler(sys.stdout)
+    logging.basicConfig(level=level, format=LOG_FORMAT, handlers=[handler], force=True)
+
+
+def add_instrumentation_arguments(parser):
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="DEBUG also logs every matched pair and DataFrame preview")
+    parser.add_argument("--log-file", default=None, help="Write logs to this file instead of stdout")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Export stage timings and counters to this file after the run")
+    parser.add_argument("--metrics-format", choices=["json", "prometheus"], default=None,
+                        help="Format of --metrics-file (default: prometheus for .prom files, JSON otherwise)")
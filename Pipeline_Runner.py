@@ -0,0 +1,176 @@
+import os
+import signal
+import argparse
+import logging
+import threading
+from contextlib import contextmanager
+
+import Ingest_RouterData
+import ETL_Routers
+from Pipeline_Metrics import metrics, configure_logging, add_instrumentation_arguments
+
+logger = logging.getLogger("Pipeline_Runner")
+
+text_files_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Text_Files')
+lock_path = os.path.join(text_files_dir, 'Pipeline.lock')
+# Used by the Windows service, which has no console; .prom suits the node_exporter text-file collector
+default_log_path = os.path.join(text_files_dir, 'Pipeline.log')
+default_metrics_path = os.path.join(text_files_dir, 'Pipeline_Metrics.prom')
+
+
+@contextmanager
+def pipeline_lock(path=lock_path):
+    """
+    Holds an exclusive, non-blocking lock on path for the duration of a run.
+
+    Yields:
+        bool: False if another process (a second runner or a manual run
+        going through this lock) already holds it.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle = open(path, 'a+')
+    try:
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            if os.name == 'nt':
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+    finally:
+        handle.close()
+
+
+class PipelineRunner:
+    """
+    Runs ingestion and then the ETL in-process whenever new files appear.
+
+    The input directory is polled through the ingestion manifest, which
+    costs one stat() per file, so new files are picked up within
+    poll_interval seconds. Imports and MongoDB connections are made once and
+    reused for every run, as is the state store, which ingestion and the
+    ETL share.
+
+    Args:
+        poll_interval (float): Seconds between directory scans.
+        min_file_age (float): Seconds a file must be left untouched before
+            it is ingested, so files still being copied are not read.
+        ingest_workers (int): Parsing processes for Ingest_RouterData.main.
+        ingest_layout (str): Layout of the stored documents; see Ingest_RouterData.main.
+        etl_workers (int): Transform processes for ETL_Routers.main.
+        metrics_path (str): File the stage metrics are exported to after
+            every cycle; None disables the export.
+        metrics_format (str): 'json' or 'prometheus'; see PipelineMetrics.export.
+        input_dir (str): Directory of the Stat / Config files; see Ingest_RouterData.main.
+        legacy_dir (str): Directory of the text-file era lists (Ingested_Files.txt,
+            Unknown_Files.txt, Processed_documents.txt), imported once.
+    """
+
+    def __init__(self, poll_interval=5, min_file_age=2, ingest_workers=1, etl_workers=1,
+                 metrics_path=None, metrics_format=None, ingest_layout=None, input_dir=None, legacy_dir=text_files_dir):
+        self.poll_interval = poll_interval
+        self.min_file_age = min_file_age
+        self.ingest_workers = ingest_workers
+        self.ingest_layout = ingest_layout
+        self.etl_workers = etl_workers
+        self.metrics_path = metrics_path
+        self.metrics_format = metrics_format
+        self.input_dir = input_dir
+        self.legacy_dir = legacy_dir
+        self.pending_etl = True  # Catch up on anything ingested while the runner was down
+
+    def run_once(self):
+        """
+        Ingests new files and, if anything was ingested or is pending, runs the ETL.
+
+        Returns:
+            bool: False if another run held the lock.
+        """
+        with pipeline_lock() as acquired:
+            if not acquired:
+                logger.info("Another pipeline run is in progress; skipping this cycle.")
+                metrics.increment("runner.cycles_skipped")
+                return False
+            with metrics.span("runner.ingest"):
+                ingested = Ingest_RouterData.main(workers=self.ingest_workers, min_file_age=self.min_file_age,
+                                                  layout=self.ingest_layout, input_dir=self.input_dir,
+                                                  legacy_dir=self.legacy_dir)
+            if ingested:
+                self.pending_etl = True
+            if self.pending_etl:
+                legacy_file = os.path.join(self.legacy_dir, ETL_Routers.PROCESSED_DOCUMENTS_LIST) if self.legacy_dir else None
+                with metrics.span("runner.etl"):
+                    ETL_Routers.main(incremental=True, workers=self.etl_workers, state_store=Ingest_RouterData.get_state_store(),
+                                     legacy_processed_file=legacy_file)
+                self.pending_etl = False
+            return True
+
+    def run_forever(self, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                with metrics.span("runner.cycle"):
+                    self.run_once()
+            except Exception:
+                # Keep the daemon alive; the failed work is retried on the next cycle
+                logger.exception("Pipeline run failed")
+                metrics.increment("runner.cycles_failed")
+                self.pending_etl = True
+            self.export_metrics()
+            stop_event.wait(self.poll_interval)
+
+    def export_metrics(self):
+        if not self.metrics_path:
+            return
+        try:
+            metrics.export(self.metrics_path, self.metrics_format)
+        except OSError as e:
+            logger.warning("Metrics not exported to %s: %s", self.metrics_path, e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run ingestion and ETL as a long-lived daemon.")
+    parser.add_argument("--once", action="store_true", help="Run a single cycle and exit")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between directory scans")
+    parser.add_argument("--min-file-age", type=float, default=2,
+                        help="Seconds a file must be unmodified before it is ingested")
+    parser.add_argument("--ingest-workers", type=int, default=1)
+    parser.add_argument("--etl-workers", type=int, default=1)
+    parser.add_argument("--ingest-layout", choices=Ingest_RouterData.LAYOUTS, default=None,
+                        help="Store Stat/Config documents nested (default) or as OID ID arrays")
+    parser.add_argument("--json-dir", default=None, help="Directory of the Stat/Config files")
+    parser.add_argument("--legacy-dir", default=text_files_dir,
+                        help="Directory of the Ingested_Files.txt / Unknown_Files.txt / Processed_documents.txt lists to import")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level, args.log_file)
+
+    runner = PipelineRunner(args.interval, args.min_file_age, args.ingest_workers, args.etl_workers,
+                            args.metrics_file, args.metrics_format, args.ingest_layout, args.json_dir, args.legacy_dir)
+    if args.once:
+        with metrics.span("runner.cycle"):
+            runner.run_once()
+        metrics.log_summary(logger)
+        runner.export_metrics()
+        return
+
+    stop_event = threading.Event()
+    for signal_name in ("SIGTERM", "SIGINT"):
+        if hasattr(signal, signal_name):
+            signal.signal(getattr(signal, signal_name), lambda signum, frame: stop_event.set())
+    runner.run_forever(stop_event)
+
+if __name__ == "__main__":
+    main()
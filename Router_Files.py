@@ -0,0 +1,256 @@
+import os
+import re
+import json
+import logging
+
+from State_Store import INGESTED, UNKNOWN
+from Router_Schema import STAT, CONFIG, SchemaViolation, MeasurementColumns, document_kind, flatten_document, check_document
+from Pipeline_Metrics import metrics
+
+logger = logging.getLogger("Router_Files")
+
+# Reading Stat / Config files needs no database, so Offline_ETL reads them without importing Ingest_RouterData
+max_part_bytes = 8 * 1024 * 1024  # Keeps each stored part well below the 16 MB BSON limit
+read_chunk_size = 1024 * 1024
+max_value_chars = 64 * 1024 * 1024  # Largest router entry streamed; a value still undecoded past this is rejected
+
+
+def find_violation(json_data, kind):
+    """Returns the first SchemaViolation of a parsed Stat or Config file, or None if it is valid."""
+    try:
+        check_document(json_data, kind)
+    except SchemaViolation as e:
+        return e
+    return None
+
+# Function to validate "Stat" JSON files
+def validate_stat_json(json_data):
+    return find_violation(json_data, STAT) is None
+
+
+# Function to validate "Config" JSON files
+def validate_config_json(json_data):
+    return find_violation(json_data, CONFIG) is None
+
+
+def parse_router_file(file_path, collect=True):
+    """
+    Parses a Stat or Config file, validating it while its measurements are
+    flattened, so the ETL can build its DataFrames without walking it again.
+
+    Args:
+        file_path (str): Path of a Stat_ or Config_ file.
+        collect (bool): Also return the flattened columns.
+
+    Returns:
+        tuple: (json_data, measurements) where measurements is the
+        MeasurementColumns.columns() tuple accepted by
+        ETL_Routers.create_*_dataframe_from_document, or None.
+
+    Raises:
+        json.JSONDecodeError: If the file is not valid JSON.
+        SchemaViolation: At the first part of the file breaking its schema.
+    """
+    file_name = os.path.basename(file_path)
+    kind = document_kind(file_name)
+    if kind is None:
+        raise SchemaViolation(f"'{file_name}' is neither a Stat nor a Config file")
+    with open(file_path, 'r') as f:
+        with metrics.span("ingest.parse"):
+            json_data = json.load(f)
+    metrics.increment("ingest.bytes_parsed", os.path.getsize(file_path))
+    with metrics.span("ingest.validate"):
+        measurements = flatten_document(json_data, kind, collect)
+    return json_data, measurements.columns() if collect else None
+
+
+# Function to pick the destination of a parsed file
+def classify_json_file(file_name, json_data):
+    """
+    Returns (collection_name, status) for a parsed file.
+
+    Stat and Config files that fail validation, and files with any other
+    name, go to Unknown_Files.
+    """
+    kind = document_kind(file_name)
+    if kind is None:
+        return "Unknown_Files", UNKNOWN
+    violation = find_violation(json_data, kind)
+    if violation is not None:
+        logger.warning("File '%s' failed validation at %s", file_name, violation)
+        return "Unknown_Files", UNKNOWN
+    return ("Router_Traffic" if kind == STAT else "Router_Configuration"), INGESTED
+
+
+class InvalidDocumentError(SchemaViolation):
+    """Raised when a streamed file does not have a 'routers' object."""
+
+
+# Incremental reader for {"routers": {ip: {...}, ...}} files that holds one router at a time
+class RouterStream:
+    _whitespace = re.compile(r'[ \t\n\r]*')
+    # Characters before the end of the buffer within which a decode error may be a cut \uXXXX escape or literal
+    _tail = 16
+
+    def __init__(self, file_obj, chunk_size=read_chunk_size, max_value_chars=max_value_chars):
+        self.file_obj = file_obj
+        self.chunk_size = chunk_size
+        self.max_value_chars = max_value_chars
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # Read at least as much as is already pending so a large value is re-decoded a logarithmic number of times
+        chunk = self.file_obj.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def _peek(self):
+        while True:
+            self.pos = self._whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise json.JSONDecodeError("Unexpected end of data", self.buffer, self.pos)
+            self._fill()
+
+    def _expect(self, characters):
+        character = self._peek()
+        if character not in characters:
+            raise json.JSONDecodeError(f"Expecting one of {characters!r}", self.buffer, self.pos)
+        self.pos += 1
+        return character
+
+    def _value(self):
+        """Decodes the next JSON value and returns it with its size in characters."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # Only a value cut by the end of the buffer (or an open string) can be completed by reading more
+                if self.eof or (e.pos < len(self.buffer) - self._tail and not e.msg.startswith("Unterminated string")):
+                    raise
+                self._fill_value()
+                continue
+            # A number touching the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof:
+                self._fill_value()
+                continue
+            size = end - self.pos
+            self.pos = end
+            return value, size
+
+    def _fill_value(self):
+        # A truncated or unterminated value would otherwise be buffered to the end of the file
+        if len(self.buffer) - self.pos > self.max_value_chars:
+            raise json.JSONDecodeError(f"Value longer than {self.max_value_chars} characters", self.buffer, self.pos)
+        self._fill()
+
+    def _members(self):
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key, _ = self._value()
+            if not isinstance(key, str):
+                raise json.JSONDecodeError("Expecting property name", self.buffer, self.pos)
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def _expect_end(self):
+        # json.load rejects anything but whitespace after the top-level value
+        while True:
+            self.pos = self._whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                raise json.JSONDecodeError("Extra data", self.buffer, self.pos)
+            if self.eof:
+                return
+            self._fill()
+
+    def iter_routers(self):
+        """
+        Yields (ip_address, router_data, size) for each entry of 'routers'.
+
+        Raises:
+            json.JSONDecodeError: If the file is not valid JSON, has data after
+                the top-level object or a second 'routers' key, which json.load
+                would keep instead of the first one already yielded, or holds a
+                value longer than max_value_chars.
+            InvalidDocumentError: If 'routers' is missing or not an object.
+        """
+        self._expect('{')
+        found_routers = False
+        for key in self._members():
+            if key != "routers":
+                self._value()  # Top-level keys other than 'routers' are not carried over
+                continue
+            if found_routers:
+                raise json.JSONDecodeError("Duplicate 'routers' key", self.buffer, self.pos)
+            if self._peek() != '{':
+                raise InvalidDocumentError("'routers' is not an object")
+            self.pos += 1
+            found_routers = True
+            for ip_address in self._members():
+                router_data, size = self._value()
+                yield ip_address, router_data, size
+        self._expect_end()
+        if not found_routers:
+            raise InvalidDocumentError("Missing 'routers' key")
+
+
+def split_router(ip_address, router_data, size, max_bytes=max_part_bytes):
+    """
+    Splits one router entry into 'routers' mappings of at most max_bytes.
+
+    Args:
+        ip_address (str): The router IP address.
+        router_data (dict): The router entry holding 'Measure_Time'.
+        size (int): Size of the entry in the source file, in characters.
+        max_bytes (int): Upper bound for the serialized size of each part.
+
+    Returns:
+        list: The 'routers' mappings, split by timestamp when needed.
+    """
+    measure_time = router_data.get("Measure_Time") if isinstance(router_data, dict) else None
+    if size <= max_bytes or not isinstance(measure_time, dict) or len(measure_time) < 2:
+        return [{ip_address: router_data}]
+
+    parts = []
+    current, current_size = {}, 0
+    for timestamp, values in measure_time.items():
+        entry_size = len(json.dumps(values)) + len(timestamp)
+        if current and current_size + entry_size > max_bytes:
+            parts.append({ip_address: {**router_data, "Measure_Time": current}})
+            current, current_size = {}, 0
+        current[timestamp] = values
+        current_size += entry_size
+    parts.append({ip_address: {**router_data, "Measure_Time": current}})
+    return parts
+
+
+def stream_file_parts(file_path, kind=None, max_bytes=max_part_bytes):
+    """
+    Yields bounded-size 'routers' mappings for a Stat or Config file.
+
+    Args:
+        file_path (str): Path of the JSON file.
+        kind (str): STAT or CONFIG to validate each router as it is read.
+        max_bytes (int): Upper bound for the serialized size of each part.
+
+    Raises:
+        SchemaViolation: On the first router failing validation, before
+            the rest of the file is read.
+    """
+    checker = MeasurementColumns(kind, collect=False) if kind is not None else None
+    with open(file_path, 'r') as f:
+        for ip_address, router_data, size in RouterStream(f).iter_routers():
+            if checker is not None:
+                checker.add_router(ip_address, router_data)
+            yield from split_router(ip_address, router_data, size, max_bytes)
@@ -0,0 +1,138 @@
+STAT = "Stat"
+CONFIG = "Config"
+
+
+def document_kind(file_name):
+    # Stat_ files become Router_Traffic documents and Config_ files Router_Configuration documents
+    if file_name.startswith("Stat"):
+        return STAT
+    if file_name.startswith("Config"):
+        return CONFIG
+    return None
+
+
+class SchemaViolation(ValueError):
+    """
+    Raised at the first part of a Stat or Config document breaking its schema.
+
+    Args:
+        message (str): What is wrong.
+        path (tuple): Keys leading to the offending value, e.g.
+            ('routers', '10.0.0.1', 'Measure_Time', '21/04/2024  0:30:05').
+    """
+
+    def __init__(self, message, path=()):
+        self.path = tuple(path)
+        location = "".join(f"[{key!r}]" for key in self.path)
+        super().__init__(f"{location}: {message}" if location else message)
+
+
+class MeasurementColumns:
+    """
+    Checks routers against the Stat or Config schema while collecting their
+    Measure_Time entries into columns, so a document is walked only once.
+
+    Raw keys are stored once and referenced by integer code, and the IP
+    address and timestamp are stored once per measurement rather than once
+    per metric. Routers can be added one at a time, as a stream yields them.
+
+    Stat measurements must be non-empty objects; Config measurements must
+    be objects whose values are all strings.
+
+    Args:
+        kind (str): STAT or CONFIG to validate, None to trust the input.
+        collect (bool): Build the columns; False only validates.
+    """
+
+    def __init__(self, kind=None, collect=True):
+        self.kind = kind
+        self.collect = collect
+        self.key_positions = {}
+        self.key_codes = []
+        self.values = []
+        self.ip_addresses = []
+        self.measure_times = []
+        self.sizes = []
+
+    def add_router(self, ip_address, router_data):
+        kind = self.kind
+        if kind is not None:
+            if not isinstance(router_data, dict):
+                raise SchemaViolation("router is not an object", ("routers", ip_address))
+            if router_data.get("Measure_Time") is None:
+                raise SchemaViolation("missing 'Measure_Time'", ("routers", ip_address))
+            if not isinstance(router_data["Measure_Time"], dict):
+                raise SchemaViolation("not an object", ("routers", ip_address, "Measure_Time"))
+        strings_only = kind == CONFIG
+        key_positions, key_codes, values = self.key_positions, self.key_codes, self.values
+
+        for measure_time, entries in router_data["Measure_Time"].items():
+            if kind is not None:
+                if not isinstance(entries, dict):
+                    raise SchemaViolation("measurement is not an object", ("routers", ip_address, "Measure_Time", measure_time))
+                if kind == STAT and not entries:
+                    raise SchemaViolation("measurement is empty", ("routers", ip_address, "Measure_Time", measure_time))
+            if not self.collect:
+                if strings_only:
+                    for key, value in entries.items():
+                        if not isinstance(value, str):
+                            raise SchemaViolation(f"{type(value).__name__} value, expected a string",
+                                                  ("routers", ip_address, "Measure_Time", measure_time, key))
+                continue
+
+            size = len(values)
+            for key, value in entries.items():
+                if strings_only and not isinstance(value, str):
+                    raise SchemaViolation(f"{type(value).__name__} value, expected a string",
+                                          ("routers", ip_address, "Measure_Time", measure_time, key))
+                if key == "Time":  # Skip 'Time' entry
+                    continue
+                code = key_positions.get(key)
+                if code is None:
+                    code = key_positions[key] = len(key_positions)
+                key_codes.append(code)
+                values.append(value)
+            self.ip_addresses.append(ip_address)
+            self.measure_times.append(measure_time)
+            self.sizes.append(len(values) - size)
+
+    def columns(self):
+        """
+        Returns:
+            tuple: (keys, key_codes, values, ip_addresses, measure_times, sizes)
+            where row i belongs to the measurement repeated sizes[j] times.
+        """
+        return list(self.key_positions), self.key_codes, self.values, self.ip_addresses, self.measure_times, self.sizes
+
+
+def flatten_document(document, kind=None, collect=True):
+    """
+    Validates and flattens a whole {'routers': {...}} document in one walk.
+
+    Args:
+        document (dict): A parsed Stat or Config file, or a stored document.
+        kind (str): STAT or CONFIG to validate, None to trust the input.
+        collect (bool): Build the columns; False only validates.
+
+    Returns:
+        MeasurementColumns: The collected routers.
+
+    Raises:
+        SchemaViolation: At the first part of the document breaking the schema.
+    """
+    if kind is not None:
+        if not isinstance(document, dict):
+            raise SchemaViolation("document is not an object")
+        if document.get("routers") is None:
+            raise SchemaViolation("missing 'routers'")
+        if not isinstance(document["routers"], dict):
+            raise SchemaViolation("not an object", ("routers",))
+    measurements = MeasurementColumns(kind, collect)
+    for ip_address, router_data in document["routers"].items():
+        measurements.add_router(ip_address, router_data)
+    return measurements
+
+
+def check_document(document, kind):
+    """Raises SchemaViolation at the first part of document breaking the kind's schema."""
+    flatten_document(document, kind, collect=False)
@@ -0,0 +1,205 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+# Pipeline state lives next to the scripts instead of a machine-specific path
+default_state_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Text_Files', 'Pipeline_State.db')
+
+# File statuses recorded by Ingest_RouterData
+INGESTED = "ingested"
+UNKNOWN = "unknown"
+FAILED = "failed"  # Not valid JSON; retried only once the file changes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_documents (
+    document_id TEXT PRIMARY KEY,
+    processed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS files (
+    file_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    recorded_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (file_name, status)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS manifest (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT,
+    status TEXT NOT NULL,
+    recorded_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS counter_state (
+    series_key TEXT PRIMARY KEY,
+    measured_at TEXT NOT NULL,
+    value TEXT NOT NULL,
+    base_measured_at TEXT,
+    base_value TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS backfill_partitions (
+    run_id TEXT NOT NULL,
+    measure_day TEXT NOT NULL,
+    ip_address TEXT NOT NULL,
+    documents INTEGER NOT NULL,
+    completed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (run_id, measure_day, ip_address)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+"""
+
+
+class _Membership:
+    """Set-like view answering `in` with one indexed lookup."""
+
+    def __init__(self, store, query, *params):
+        self.store = store
+        self.query = query
+        self.params = params
+
+    def __contains__(self, key):
+        return self.store.connection.execute(self.query, (*self.params, str(key))).fetchone() is not None
+
+
+class StateStore:
+    """
+    Crash-safe record of processed documents and ingested files.
+
+    Backed by SQLite in WAL mode: lookups are single primary-key probes, so
+    opening the store costs the same whatever the history length, and each
+    batch of marks is committed atomically.
+
+    Args:
+        path (str): Location of the SQLite database file.
+    """
+
+    def __init__(self, path=default_state_path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        # Stores created before counter_state kept the value each batch was differenced from
+        if "base_value" not in {row[1] for row in self.connection.execute("PRAGMA table_info(counter_state)")}:
+            self.connection.execute("ALTER TABLE counter_state ADD COLUMN base_measured_at TEXT")
+            self.connection.execute("ALTER TABLE counter_state ADD COLUMN base_value TEXT")
+        self.processed_documents = _Membership(self, "SELECT 1 FROM processed_documents WHERE document_id = ?")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def transaction(self):
+        """Groups the marks made inside the block into one atomic commit."""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def _write(self, statement, rows):
+        if self.connection.in_transaction:
+            self.connection.executemany(statement, rows)
+        else:
+            with self.transaction():
+                self.connection.executemany(statement, rows)
+
+    def mark_processed(self, document_ids):
+        self._write("INSERT OR IGNORE INTO processed_documents (document_id) VALUES (?)",
+                    [(str(document_id),) for document_id in document_ids])
+
+    def unmark_processed(self, document_ids):
+        self._write("DELETE FROM processed_documents WHERE document_id = ?",
+                    [(str(document_id),) for document_id in document_ids])
+
+    def files(self, status):
+        return _Membership(self, "SELECT 1 FROM files WHERE status = ? AND file_name = ?", status)
+
+    def record_file(self, file_name, status):
+        self._write("INSERT OR IGNORE INTO files (file_name, status) VALUES (?, ?)", [(file_name, status)])
+
+    def manifest_entry(self, path):
+        """Returns (size, mtime_ns, content_hash, status) recorded for path, or None."""
+        return self.connection.execute(
+            "SELECT size, mtime_ns, content_hash, status FROM manifest WHERE path = ?", (path,)).fetchone()
+
+    def record_manifest(self, path, size, mtime_ns, content_hash, status):
+        self._write("INSERT OR REPLACE INTO manifest (path, size, mtime_ns, content_hash, status) VALUES (?, ?, ?, ?, ?)",
+                    [(path, size, mtime_ns, content_hash, status)])
+
+    def counter_states(self, series_keys, chunk_size=500):
+        """
+        Returns {series_key: (measured_at, value, base_measured_at, base_value)}
+        for the keys that have a stored value; the base is the value the batch
+        that stored it was differenced from, None if it had none.
+        """
+        states = {}
+        for start in range(0, len(series_keys), chunk_size):
+            chunk = series_keys[start:start + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            for series_key, measured_at, value, base_measured_at, base_value in self.connection.execute(
+                    f"SELECT series_key, measured_at, value, base_measured_at, base_value FROM counter_state "
+                    f"WHERE series_key IN ({placeholders})", chunk):
+                states[series_key] = (measured_at, int(value), base_measured_at, None if base_value is None else int(base_value))
+        return states
+
+    def update_counter_states(self, rows):
+        """
+        Stores (series_key, measured_at, value, base_measured_at, base_value)
+        rows, keeping whichever value is newer.
+        """
+        # Values are stored as text because 64-bit counters can exceed SQLite's signed integer range
+        self._write("INSERT INTO counter_state (series_key, measured_at, value, base_measured_at, base_value) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(series_key) DO UPDATE SET measured_at = excluded.measured_at, value = excluded.value, "
+                    "base_measured_at = excluded.base_measured_at, base_value = excluded.base_value "
+                    "WHERE excluded.measured_at > counter_state.measured_at",
+                    [(series_key, measured_at, str(int(value)), base_measured_at,
+                      None if base_value is None else str(int(base_value)))
+                     for series_key, measured_at, value, base_measured_at, base_value in rows])
+
+    def completed_partitions(self, run_id):
+        """Returns the (measure_day, ip_address) partitions a backfill run already replaced."""
+        return set(self.connection.execute(
+            "SELECT measure_day, ip_address FROM backfill_partitions WHERE run_id = ?", (run_id,)).fetchall())
+
+    def record_partition(self, run_id, measure_day, ip_address, documents):
+        self._write("INSERT OR REPLACE INTO backfill_partitions (run_id, measure_day, ip_address, documents) VALUES (?, ?, ?, ?)",
+                    [(run_id, measure_day, ip_address, documents)])
+
+    def clear_partitions(self, run_id):
+        self._write("DELETE FROM backfill_partitions WHERE run_id = ?", [(run_id,)])
+
+    def import_legacy_file(self, file_path, status=None):
+        """
+        Imports a one-ID-per-line text file the first time it is seen.
+
+        Args:
+            file_path (str): processed_documents.txt, Ingested_Files.txt or Unknown_Files.txt.
+            status (str): File status for the lists kept by Ingest_RouterData;
+                None imports processed document IDs.
+        """
+        marker = f"imported:{os.path.abspath(file_path)}"
+        if not os.path.exists(file_path) or self.connection.execute(
+                "SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+            return
+        with open(file_path, 'r') as f:
+            lines = [line.strip() for line in f if line.strip()]
+        with self.transaction():
+            if status is None:
+                self.mark_processed(lines)
+            else:
+                self.connection.executemany("INSERT OR IGNORE INTO files (file_name, status) VALUES (?, ?)",
+                                            [(line, status) for line in lines])
+            self.connection.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (marker, str(len(lines))))
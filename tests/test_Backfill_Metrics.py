@@ -0,0 +1,54 @@
+from datetime import date, timedelta
+
+import mongomock
+import pytest
+
+import Backfill_Metrics
+from Backfill_Metrics import backfill
+from Benchmark_Pipeline import make_router_documents
+from Metrics_Rollup import RollupWriter
+from Metrics_Writer import MetricsWriter
+from State_Store import StateStore
+
+DAYS = [date(2024, 4, 21) + timedelta(days=offset) for offset in range(3)]
+
+
+def ingested_client():
+    client = mongomock.MongoClient()
+    for day in DAYS:
+        config_doc, traffic_doc = make_router_documents(3, 2, 4, 4, day.strftime("%d/%m/%Y"))
+        client.Router_Ingested.Router_Configuration.insert_one(config_doc)
+        client.Router_Ingested.Router_Traffic.insert_one(traffic_doc)
+    return client
+
+
+def out_of_order_pool(tasks, function, workers, max_in_flight=None, initializer=None, initargs=()):
+    # Runs the tasks last first, as a busy pool may, and yields them in task order like iter_in_pool
+    tasks = list(tasks)
+    results = [function(*task)[0] for task in reversed(tasks)][::-1]
+    yield from zip(tasks, results)
+
+
+def run_backfill(monkeypatch, tmp_path, workers):
+    client = ingested_client()
+    writer, rollup_writer = MetricsWriter(client=client), RollupWriter(client=client)
+    monkeypatch.setattr(Backfill_Metrics, "iter_in_pool", out_of_order_pool)
+    monkeypatch.setattr(Backfill_Metrics, "_worker_targets", (client.Router_Ingested, writer, rollup_writer))
+    state_store = StateStore(str(tmp_path / f"state_{workers}.db"))
+    rebuilt = backfill(client.Router_Ingested, writer, rollup_writer, state_store, DAYS[0], DAYS[-1], "run", workers=workers)
+    assert rebuilt == len(state_store.completed_partitions("run")) == 3 * len(DAYS)
+    metrics = sorted((sorted(document.items()) for document in writer.collection.find({}, {"_id": 0})), key=repr)
+    rollups = sorted((sorted((key, value) for key, value in document.items() if key != "Batches")
+                      for document in client.Processed_DataBase.Metrics_Rollup_Daily.find({}, {"_id": 0})), key=repr)
+    return metrics, rollups
+
+
+@pytest.mark.parametrize("workers", [2, 4])
+def test_workers_rebuild_the_same_metrics_as_a_serial_run(monkeypatch, tmp_path, workers):
+    serial = run_backfill(monkeypatch, tmp_path, 1)
+    # The first deltas of every day but the first continue from the day before
+    boundary = [dict(document) for document in serial[0]
+                if dict(document)["Measure_Date"] == DAYS[1].strftime("%d/%m/%Y") and dict(document)["Measure_Time"] == "0:00:05"]
+    assert boundary and all(document["Stat_Delta"] is not None for document in boundary)
+
+    assert run_backfill(monkeypatch, tmp_path, workers) == serial
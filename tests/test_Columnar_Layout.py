@@ -0,0 +1,62 @@
+import copy
+
+import mongomock
+import numpy as np
+
+from Benchmark_Pipeline import make_router_documents
+from Columnar_Layout import (COLUMNAR, LAYOUT_FIELD, OidDictionary, columnar_measurements, encode_routers, join_key,
+                             read_document, split_key)
+from ETL_Routers import flatten_measurements
+
+# Keys the split must give back unchanged: trailing spaces, padded or zero interface IDs, no protocol, extra dots
+UNUSUAL_KEYS = ["IP-MIB-ipSystemStatsInOctets.ipv4 ", "IP-MIB-ipIfStatsInOctets.ipv4.07", "IP-MIB-ipIfStatsInOctets.ipv4.0",
+                "IF-MIB-ifDescr.7", "NoDots", "a..b.3", "IP-MIB-ipIfStatsInOctets.ipv4.99999999999", "trailing.dot."]
+
+
+def test_split_key_round_trips():
+    assert split_key("IP-MIB-ipIfStatsInOctets.ipv4.7") == ("IP-MIB-ipIfStatsInOctets", "ipv4", 7)
+    assert split_key("IF-MIB-ifDescr.7") == ("IF-MIB-ifDescr", None, 7)
+    for key in UNUSUAL_KEYS:
+        assert join_key(*split_key(key)) == key
+
+
+def make_nested_document():
+    config_doc, traffic_doc = make_router_documents(2, 2, 3, 4)
+    for measurements in traffic_doc["routers"].values():
+        for entries in measurements["Measure_Time"].values():
+            entries.update({key: position for position, key in enumerate(UNUSUAL_KEYS)})
+    return traffic_doc
+
+
+def test_a_stored_columnar_document_reads_back_as_the_nested_one():
+    client = mongomock.MongoClient()
+    nested = make_nested_document()
+    document = {LAYOUT_FIELD: COLUMNAR, "routers": encode_routers(nested["routers"], OidDictionary(client.db.Router_OIDs))}
+    measurement = next(iter(document["routers"]["10.0.0.1"]["Measure_Time"].values()))
+    assert "Time" in measurement and all(isinstance(oid_id, int) for oid_id in measurement["Oids"])
+    client.db.Router_Traffic.insert_one(document)
+
+    # Read by another process, with a dictionary of its own
+    stored = client.db.Router_Traffic.find_one({}, {"_id": 0})
+    assert read_document(stored, OidDictionary(client.db.Router_OIDs)) == nested
+    assert read_document(nested, None) is nested
+
+
+def test_dictionaries_sharing_a_collection_share_ids():
+    collection = mongomock.MongoClient().db.Router_OIDs
+    first, second = OidDictionary(collection), OidDictionary(collection)
+    first.ensure_ids([("IP-MIB-ipIfStatsInOctets", "ipv4")])
+    second.ensure_ids([("IP-MIB-ipIfStatsInOctets", "ipv4"), ("IF-MIB-ifDescr", None)])
+    first.refresh()
+    assert first.ids == second.ids and len(set(first.ids.values())) == 2
+
+
+def test_columnar_measurements_match_the_nested_walk():
+    dictionary = OidDictionary(mongomock.MongoClient().db.Router_OIDs)
+    nested = make_nested_document()
+    columnar = dictionary.attach({LAYOUT_FIELD: COLUMNAR, "routers": encode_routers(copy.deepcopy(nested["routers"]), dictionary)})
+    expected = flatten_measurements(nested)
+    measurements = columnar_measurements(columnar)
+    assert measurements[0] == expected[0]
+    assert np.array_equal(measurements[1], expected[1])
+    assert list(measurements[2:]) == list(expected[2:])
@@ -0,0 +1,67 @@
+import pandas as pd
+
+from Config_Dimension import InterfaceDimension
+from ETL_Routers import create_config_dataframe_from_document, create_stat_dataframe_from_document
+
+
+def config_document(ip_address, measure_time, descriptions):
+    return {"routers": {ip_address: {"Measure_Time": {measure_time: {
+        "Time": measure_time, **{f"IF-MIB-ifDescr.{interface}": description for interface, description in descriptions.items()}}}}}}
+
+
+def traffic_document(routers):
+    return {"routers": {ip_address: {"Measure_Time": {measure_time: {"Time": measure_time, "IP-MIB-ipIfStatsInOctets.ipv4.1": 1,
+                                                                     "IP-MIB-ipSystemStatsInOctets.ipv4": 2}
+                                                      for measure_time in measure_times}}
+                        for ip_address, measure_times in routers.items()}}
+
+
+def make_dimension(*config_documents):
+    dimension = InterfaceDimension()
+    for document_id, config_doc in enumerate(config_documents):
+        dimension.add(create_config_dataframe_from_document(config_doc, with_snapshot_time=True), document_id)
+    return dimension
+
+
+def joined_descriptions(dimension, traffic_doc):
+    traffic_df = create_stat_dataframe_from_document(traffic_doc)
+    merged_df = dimension.join(traffic_df)
+    assert merged_df[list(traffic_df.columns)].equals(traffic_df)  # Rows stay in order
+    interfaces = merged_df[merged_df["Interface_ID"] == 1]
+    return dict(zip(zip(interfaces["IP_Address"].astype(object), interfaces["Measure_Time"].astype(object)),
+                    interfaces["Interface_Description"]))
+
+
+def test_traffic_takes_the_latest_snapshot_at_or_before_it():
+    dimension = make_dimension(config_document("10.0.0.1", "21/04/2024  8:00:00", {1: "Gi0/1 morning"}),
+                               config_document("10.0.0.1", "21/04/2024  12:00:00", {1: "Gi0/1 noon"}),
+                               config_document("10.0.0.2", "21/04/2024  0:00:00", {1: "Gi0/1 other router"}))
+    traffic_doc = traffic_document({"10.0.0.1": ["21/04/2024  7:00:05", "21/04/2024  8:00:00", "21/04/2024  11:59:59",
+                                                 "21/04/2024  12:00:05"],
+                                    "10.0.0.2": ["21/04/2024  9:00:05"]})
+    assert joined_descriptions(dimension, traffic_doc) == {
+        # Before every snapshot of its router, a row takes the earliest one
+        ("10.0.0.1", "7:00:05"): "Gi0/1 morning",
+        ("10.0.0.1", "8:00:00"): "Gi0/1 morning",
+        ("10.0.0.1", "11:59:59"): "Gi0/1 morning",
+        ("10.0.0.1", "12:00:05"): "Gi0/1 noon",
+        ("10.0.0.2", "9:00:05"): "Gi0/1 other router",
+    }
+
+
+def test_routers_without_a_snapshot_are_left_unnamed():
+    dimension = make_dimension(config_document("10.0.0.1", "21/04/2024  0:00:00", {1: "Gi0/1"}))
+    assert dimension.routers() == {"10.0.0.1"}
+    descriptions = joined_descriptions(dimension, traffic_document({"10.0.0.3": ["21/04/2024  1:00:05"]}))
+    assert list(descriptions) == [("10.0.0.3", "1:00:05")] and all(pd.isna(description) for description in descriptions.values())
+
+
+def test_snapshots_repeating_the_previous_one_are_dropped():
+    dimension = make_dimension(config_document("10.0.0.1", "21/04/2024  0:00:00", {1: "Gi0/1", 2: "Gi0/2"}),
+                               config_document("10.0.0.1", "22/04/2024  0:00:00", {1: "Gi0/1", 2: "Gi0/2"}),
+                               config_document("10.0.0.1", "23/04/2024  0:00:00", {1: "Gi0/1 renamed", 2: "Gi0/2"}),
+                               config_document("10.0.0.1", "23/04/2024  0:00:00", {1: "Gi0/1 re-ingested", 2: "Gi0/2"}))
+    frame = dimension.frame
+    assert frame["Snapshot_Time"].dt.day.unique().tolist() == [21, 23]
+    assert frame.loc[frame["Interface_ID"] == 1, "Interface_Description"].tolist() == ["Gi0/1", "Gi0/1 re-ingested"]
+    assert dimension.last_id == 3
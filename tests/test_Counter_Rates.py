@@ -0,0 +1,57 @@
+import copy
+
+from Counter_Rates import RATE_FIELDS, add_counter_rates
+from State_Store import StateStore
+
+
+def make_batch(minutes, values, ip_address="10.0.0.1"):
+    return [{"IP_Address": ip_address, "Interface_ID": 1, "New_Stat_Description": "IP Interface Inbound Octets(High_Capacity)",
+             "Protocol_Version": "ipv4", "Measure_Date": "21/04/2024", "Measure_Time": f"0:{minute:02d}:00", "Stat_Value": value}
+            for minute, value in zip(minutes, values)]
+
+
+def rates(documents):
+    return [tuple(document[field] for field in RATE_FIELDS) for document in documents]
+
+
+def test_replaying_a_batch_keeps_its_rates(tmp_path):
+    state_store = StateStore(str(tmp_path / "state.db"))
+    add_counter_rates(make_batch([0, 1], [100, 200]), state_store)
+    batch = make_batch([2, 3, 4], [400, 700, 1000])
+    first = rates(add_counter_rates(copy.deepcopy(batch), state_store))
+    assert first == [(200, 60, 200 / 60), (300, 60, 5.0), (300, 60, 5.0)]
+
+    # A crash between writing the batch and marking it processed runs it again
+    assert rates(add_counter_rates(copy.deepcopy(batch), state_store)) == first
+    assert rates(add_counter_rates(copy.deepcopy(batch), state_store)) == first
+
+    # The next batch still continues from the end of the replayed one
+    assert rates(add_counter_rates(make_batch([5], [1100]), state_store)) == [(100, 60, 100 / 60)]
+
+
+def test_rerunning_an_older_batch_never_uses_a_later_value(tmp_path):
+    state_store = StateStore(str(tmp_path / "state.db"))
+    older = make_batch([0, 1, 2], [100, 200, 400])
+    first = rates(add_counter_rates(copy.deepcopy(older), state_store))
+    add_counter_rates(make_batch([3, 4], [500, 600]), state_store)
+    add_counter_rates(make_batch([5, 6], [700, 800]), state_store)
+
+    again = rates(add_counter_rates(copy.deepcopy(older), state_store))
+    assert again[0] == (None, None, None)
+    assert again[1:] == first[1:]
+
+
+def test_high_capacity_deltas_are_exact_above_2_53(tmp_path):
+    state_store = StateStore(str(tmp_path / "state.db"))
+    base = 2 ** 60
+    assert rates(add_counter_rates(make_batch([0, 1], [base + 1, base + 2]), state_store))[1] == (1, 60, 1 / 60)
+    # The next batch continues from the stored value, also kept exact
+    delta = add_counter_rates(make_batch([2], [base + 5]), state_store)[0]["Stat_Delta"]
+    assert delta == 3 and isinstance(delta, int)
+
+
+def test_32_bit_counters_wrap():
+    documents = make_batch([0, 1], [2 ** 32 - 10, 5])
+    for document in documents:
+        document["New_Stat_Description"] = "IP Interface Inbound Octets"
+    assert rates(add_counter_rates(documents, StateStore(":memory:")))[1] == (15, 60, 0.25)
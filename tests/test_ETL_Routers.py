@@ -0,0 +1,191 @@
+import random
+from collections import defaultdict
+from datetime import datetime
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from Benchmark_Pipeline import legacy_match_documents, make_documents, make_router_documents
+from ETL_Routers import (create_config_dataframe_from_document, create_documents, create_stat_dataframe_from_document,
+                         description_mapping, export_documents_to_parquet, extract_interface_id, extract_protocol_version,
+                         match_documents, merge_frames, remove_interface_id, remove_parquet_batch, remove_protocol_version)
+
+
+def pair_ids(pairs):
+    return [(config_doc["_id"], traffic_doc["_id"]) for config_doc, traffic_doc in pairs]
+
+
+def make_overlapping_documents(seed, document_count=30):
+    # Routers shared across documents, with empty entries and keys other than Measure_Time, so documents compete for matches
+    generator = random.Random(seed)
+    def routers():
+        return {f"10.0.0.{generator.randrange(6)}": ({} if generator.random() < 0.1 else
+                                                     {generator.choice(["Measure_Time", "Other"]): {}})
+                for _ in range(generator.randrange(4))}
+    return ([{"_id": f"config-{index}", "routers": routers()} for index in range(document_count)],
+            [{"_id": f"traffic-{index}", "routers": routers()} for index in range(document_count)])
+
+
+def test_the_traffic_index_matches_like_the_nested_loop():
+    for seed in range(20):
+        config_documents, traffic_documents = make_overlapping_documents(seed)
+        processed = {f"config-{index}" for index in range(0, 30, 7)}
+        expected = legacy_match_documents(config_documents, traffic_documents, processed)
+        assert expected
+        assert pair_ids(match_documents(config_documents, traffic_documents, processed)) == pair_ids(expected)
+
+
+def test_each_traffic_document_is_matched_once():
+    config_documents, traffic_documents = make_documents(10, routers_per_document=3)
+    pairs = match_documents(config_documents + config_documents, traffic_documents, set())
+    assert pair_ids(pairs) == pair_ids(legacy_match_documents(config_documents + config_documents, traffic_documents, set()))
+    assert len({traffic_id for _, traffic_id in pair_ids(pairs)}) == len(pairs) == 10
+
+
+def make_router_pair():
+    config_doc, traffic_doc = make_router_documents(3, 2, 3, 4)
+    # General rows keyed like the interface rows are folded into them, zero or not; zero-valued interface rows are dropped
+    for measurements in traffic_doc["routers"].values():
+        for index, entries in enumerate(measurements["Measure_Time"].values()):
+            entries["IP-MIB-ipSystemStatsInDiscards.ipv4"] = index
+            entries["IP-MIB-ipSystemStatsOutDiscards.ipv4"] = 5
+            entries["IP-MIB-ipIfStatsInDiscards.ipv4.2"] = 0
+            entries["Unmapped-Key.ipv6.1"] = 7
+    return config_doc, traffic_doc
+
+
+# Reference copy of the iterrows create_documents that the keyed join replaced
+def legacy_create_documents(merged_df):
+    documents = []
+    interfaces_dict = defaultdict(list)
+    interface_0_rows = merged_df[merged_df['Interface_ID'] == 0]
+    merged_df = merged_df[merged_df['Stat_Value'] != 0]
+    for _, row in merged_df.iterrows():
+        key = (row["Protocol_Version"], row["Measure_Date"], row["Measure_Time"], row["IP_Address"])
+        interfaces_dict[key].append(row)
+    for key, rows in interfaces_dict.items():
+        for other_metric in [row for row in rows if row["Interface_ID"] != 0]:
+            other_doc = {field: other_metric[field] for field in [
+                "IP_Address", "Measure_Date", "Measure_Time", "Measure_Timestamp", "Interface_ID", "Interface_Name",
+                "Interface_Description", "Protocol_Version", "New_Stat_Description", "Stat_Value"]}
+            matching_rows = interface_0_rows[
+                (interface_0_rows['Protocol_Version'] == other_metric['Protocol_Version']) &
+                (interface_0_rows['Measure_Date'] == other_metric['Measure_Date']) &
+                (interface_0_rows['Measure_Time'] == other_metric['Measure_Time']) &
+                (interface_0_rows['IP_Address'] == other_metric['IP_Address'])
+            ]
+            for _, matching_row in matching_rows.iterrows():
+                other_doc['New_Stat_Description'] = matching_row['New_Stat_Description']
+                other_doc['Stat_Value'] += matching_row['Stat_Value']
+            documents.append(other_doc)
+    return documents
+
+
+@pytest.mark.parametrize("categorical", [True, False])
+def test_create_documents_matches_the_row_by_row_version(categorical):
+    config_doc, traffic_doc = make_router_pair()
+    merged_df = merge_frames(create_stat_dataframe_from_document(traffic_doc, categorical),
+                             create_config_dataframe_from_document(config_doc, categorical))
+    documents = create_documents(merged_df)
+    expected = legacy_create_documents(merged_df)
+    assert len(expected) == 3 * 3 * 8  # Eight non-zero interface metrics per measurement
+    assert any(document["New_Stat_Description"] == "IP System Outbound Discarded Packets" for document in expected)
+    assert documents == expected
+    assert [list(document) for document in documents] == [list(document) for document in expected]
+
+
+# Reference copies of the dict-per-row frame builders that the column arrays replaced
+def legacy_stat_dataframe(stat_document):
+    df_list = []
+    for ip_address, ip_data in stat_document["routers"].items():
+        for measure_time, stats in ip_data["Measure_Time"].items():
+            for stat_description, stat_value in stats.items():
+                if stat_description == "Time":
+                    continue
+                interface_id = extract_interface_id(stat_description)
+                if interface_id != 0:
+                    stat_description = remove_interface_id(stat_description)
+                protocol_version = extract_protocol_version(stat_description)
+                stat_description = remove_protocol_version(stat_description)
+                df_list.append({'IP_Address': ip_address, 'Measure_Date': measure_time.split()[0],
+                                'Measure_Time': measure_time.split()[1], 'Protocol_Version': protocol_version,
+                                'Stat_Description': stat_description, 'Interface_ID': interface_id, 'Stat_Value': stat_value})
+    stat_df = pd.DataFrame(df_list)
+    stat_df['New_Stat_Description'] = stat_df['Stat_Description'].map(description_mapping).fillna(stat_df['Stat_Description'])
+    return stat_df
+
+
+def legacy_config_dataframe(config_document):
+    df_list = []
+    for ip_address, ip_data in config_document["routers"].items():
+        for measure_time, interfaces in ip_data["Measure_Time"].items():
+            for interface, interface_description in interfaces.items():
+                if interface == "Time":
+                    continue
+                df_list.append({'IP_Address': ip_address, 'Interface_ID': extract_interface_id(interface),
+                                'Interface_Name': interface.split('.')[0], 'Interface_Description': interface_description})
+    return pd.DataFrame(df_list)
+
+
+def as_objects(frame, columns):
+    # Categorical, string and int32 columns as object and int64, so frames of either layout compare by value
+    return frame[columns].astype({column: "int64" if frame[column].dtype == "int32" else object for column in columns
+                                  if frame[column].dtype == "int32" or not pd.api.types.is_numeric_dtype(frame[column])})
+
+
+@pytest.mark.parametrize("categorical", [True, False])
+def test_the_frames_match_the_dict_per_row_versions(categorical):
+    config_doc, traffic_doc = make_router_pair()
+    expected = legacy_stat_dataframe(traffic_doc)
+    assert set(expected["New_Stat_Description"]) >= {"Unmapped-Key", "IP System Outbound Discarded Packets"}
+    columns = list(expected.columns)
+    stat_df = create_stat_dataframe_from_document(traffic_doc, categorical)
+    pd.testing.assert_frame_equal(as_objects(stat_df, columns), as_objects(expected, columns))
+
+    expected = legacy_config_dataframe(config_doc)
+    columns = list(expected.columns)
+    config_df = create_config_dataframe_from_document(config_doc, categorical)
+    pd.testing.assert_frame_equal(as_objects(config_df, columns), as_objects(expected, columns))
+
+
+def make_metric_documents(days, ip_addresses=("10.0.0.1",)):
+    return [{"IP_Address": ip_address, "Measure_Date": f"{day:02d}/04/2024", "Measure_Time": "0:00:05",
+             "Measure_Timestamp": datetime(2024, 4, day), "Interface_ID": 1, "Interface_Name": "IF-MIB-ifDescr",
+             "Interface_Description": "GigabitEthernet0/1", "Protocol_Version": "ipv4",
+             "New_Stat_Description": "IP Interface Inbound Octets(High_Capacity)", "Stat_Value": 2**63 + day,
+             "Interval_Seconds": None if day == days[0] else 86400.0, "Stat_Delta": None if day == days[0] else 2**62,
+             "Stat_Rate": None if day == days[0] else 2**62 / 86400}
+            for day in days for ip_address in ip_addresses]
+
+
+def read_dataset(output_dir):
+    return pq.read_table(output_dir).to_pandas().sort_values(["Measure_Day", "IP_Address"], ignore_index=True)
+
+
+def test_parquet_export_is_partitioned_by_day_and_keeps_exact_deltas(tmp_path):
+    output_dir = str(tmp_path / "metrics")
+    export_documents_to_parquet(make_metric_documents([21, 22], ["10.0.0.1", "10.0.0.2"]), output_dir, "batch", partition_by_ip=True)
+    assert sorted(path.relative_to(output_dir).as_posix() for path in (tmp_path / "metrics").rglob("*.parquet")) == [
+        f"Measure_Day=2024-04-{day}/IP_Address={ip_address}/batch-0.parquet" for day in (21, 22) for ip_address in ("10.0.0.1", "10.0.0.2")]
+
+    frame = read_dataset(output_dir)
+    assert frame["Stat_Delta"].isna().tolist() == [True, True, False, False]
+    assert frame["Stat_Delta"].dropna().astype("int64").tolist() == [2**62, 2**62]
+    assert pq.read_table(output_dir, columns=["Stat_Value"]).column("Stat_Value").to_pylist()[0] >= 2**63
+
+
+def test_rerunning_a_batch_replaces_its_files(tmp_path):
+    output_dir = str(tmp_path / "metrics")
+    export_documents_to_parquet(make_metric_documents([21, 22]), output_dir, "batch")
+    export_documents_to_parquet(make_metric_documents([21]), output_dir, "batch1")
+    export_documents_to_parquet(make_metric_documents([21, 22]), output_dir, "batch")
+    assert len(read_dataset(output_dir)) == 3
+
+    # Re-run in parts, as under a memory budget: the whole-batch files go first
+    assert remove_parquet_batch(output_dir, "batch") == 2
+    export_documents_to_parquet(make_metric_documents([21]), output_dir, "batch_0")
+    export_documents_to_parquet(make_metric_documents([22]), output_dir, "batch_1")
+    assert len(read_dataset(output_dir)) == 3
+    assert remove_parquet_batch(output_dir, "batch") == 2
+    assert read_dataset(output_dir)["Measure_Date"].tolist() == ["21/04/2024"]
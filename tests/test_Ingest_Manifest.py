@@ -0,0 +1,84 @@
+import json
+import os
+
+import mongomock
+import pytest
+
+import Ingest_RouterData
+from Benchmark_Pipeline import make_router_documents
+from State_Store import INGESTED, StateStore
+
+
+@pytest.fixture
+def ingest(monkeypatch, tmp_path):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(Ingest_RouterData, "get_client", lambda uri: client)
+    monkeypatch.setattr(Ingest_RouterData, "_db", None)
+    monkeypatch.setattr(Ingest_RouterData, "_indexes_ready", False)
+    monkeypatch.setattr(Ingest_RouterData, "pending_fingerprints", {})
+    state_store = StateStore(str(tmp_path / "state.db"))
+    monkeypatch.setattr(Ingest_RouterData, "_state_store", state_store)
+    input_dir = tmp_path / "json"
+    input_dir.mkdir()
+    yield input_dir, client.Router_Ingested, state_store
+    state_store.close()
+
+
+def write_stat_file(input_dir, name="Stat_1.json", measure_date="21/04/2024", mtime_ns=None):
+    path = input_dir / name
+    path.write_text(json.dumps(make_router_documents(1, 1, 2, 2, measure_date)[1]))
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+def run(input_dir):
+    return Ingest_RouterData.main(streaming="never", input_dir=str(input_dir))
+
+
+def test_unchanged_and_touched_files_are_skipped(ingest, monkeypatch):
+    input_dir, db, _ = ingest
+    path = write_stat_file(input_dir, mtime_ns=10**18)
+    assert run(input_dir) == 1
+    assert db.Router_Traffic.count_documents({"File_Name": "Stat_1.json"}) == 1
+
+    opened = []
+    monkeypatch.setattr(Ingest_RouterData.json, "load", lambda f: opened.append(f.name))
+    assert run(input_dir) == 0
+    # A new mtime with the same content is re-recorded without a parse
+    os.utime(path, ns=(2 * 10**18, 2 * 10**18))
+    assert run(input_dir) == 0
+    assert opened == []
+
+
+def test_a_changed_file_replaces_its_earlier_version(ingest):
+    input_dir, db, _ = ingest
+    write_stat_file(input_dir, mtime_ns=10**18)
+    run(input_dir)
+    write_stat_file(input_dir, measure_date="22/04/2024", mtime_ns=2 * 10**18)
+    assert run(input_dir) == 1
+    stored = list(db.Router_Traffic.find({"File_Name": "Stat_1.json"}))
+    assert len(stored) == 1
+    assert list(stored[0]["routers"]["10.0.0.1"]["Measure_Time"])[0].startswith("22/04/2024")
+
+
+def test_files_in_a_legacy_list_are_adopted_without_ingesting(ingest, tmp_path):
+    input_dir, db, state_store = ingest
+    write_stat_file(input_dir)
+    legacy_dir = tmp_path / "legacy"
+    legacy_dir.mkdir()
+    (legacy_dir / Ingest_RouterData.INGESTED_FILES_LIST).write_text("Stat_1.json\n")
+
+    assert Ingest_RouterData.main(streaming="never", input_dir=str(input_dir), legacy_dir=str(legacy_dir)) == 0
+    assert db.Router_Traffic.count_documents({}) == 0
+    assert state_store.manifest_entry(str(input_dir / "Stat_1.json"))[3] == INGESTED
+
+
+def test_a_file_handed_over_directly_is_checked_before_parsing(ingest, monkeypatch):
+    input_dir, db, _ = ingest
+    path = write_stat_file(input_dir)
+    run(input_dir)
+
+    monkeypatch.setattr(Ingest_RouterData.json, "load", lambda f: pytest.fail("parsed an unchanged file"))
+    Ingest_RouterData.ingest_json_file(str(path))
+    assert db.Router_Traffic.count_documents({}) == 1
@@ -0,0 +1,86 @@
+from datetime import date, datetime
+
+import mongomock
+
+import Metrics_Writer
+from Metrics_Queries import MetricsQueries, QueryCache
+from Metrics_Writer import MetricsWriter
+
+DAY, OTHER_DAY = date(2024, 4, 21), date(2024, 4, 22)
+
+
+def test_invalidate_drops_only_the_results_reading_a_written_partition():
+    cache = QueryCache()
+    cache.put("router 1", "r1", 5, [DAY], ["10.0.0.1"], cache.generation)
+    cache.put("all routers", "all", 5, [DAY], None, cache.generation)
+    cache.put("other day", "r2", 5, [OTHER_DAY], ["10.0.0.2"], cache.generation)
+
+    assert cache.invalidate([(DAY.isoformat(), "10.0.0.2")]) == 1
+    assert (cache.get("router 1"), cache.get("all routers"), cache.get("other day")) == ("r1", None, "r2")
+    # A result whose query started after the change already saw it
+    assert cache.invalidate([(DAY.isoformat(), "10.0.0.1"), (OTHER_DAY.isoformat(), "10.0.0.2")], [5, 6]) == 1
+    assert (cache.get("router 1"), cache.get("other day")) == ("r1", None)
+
+
+def test_a_result_computed_across_an_invalidation_is_not_kept():
+    cache = QueryCache()
+    generation = cache.generation
+    cache.invalidate([(DAY.isoformat(), "10.0.0.1")])
+    cache.put("key", "stale", 1, [DAY], None, generation)
+    assert cache.get("key") is None
+
+
+def test_results_expire_and_the_least_recently_used_go_first():
+    cache = QueryCache(max_entries=2, ttl=0)
+    cache.put("key", "result", 1, [DAY], None, cache.generation)
+    assert cache.get("key") is None
+
+    cache = QueryCache(max_entries=2)
+    for key in ("first", "second"):
+        cache.put(key, key, 1, [DAY], None, cache.generation)
+    cache.get("first")
+    cache.put("third", "third", 1, [DAY], None, cache.generation)
+    assert (cache.get("first"), cache.get("second"), cache.get("third")) == ("first", None, "third")
+
+
+def make_documents(measure_date, ip_address="10.0.0.1", value=1):
+    day, month, year = map(int, measure_date.split("/"))
+    return [{"IP_Address": ip_address, "Measure_Date": measure_date, "Measure_Time": f"{hour}:00:05",
+             "Measure_Timestamp": datetime(year, month, day, hour - 1, 0, 5), "Interface_ID": 1, "Protocol_Version": "ipv4",
+             "New_Stat_Description": "IP Interface Inbound Octets(High_Capacity)", "Stat_Value": value * hour, "Stat_Rate": None}
+            for hour in (1, 2)]
+
+
+def series(queries, ip_address="10.0.0.1"):
+    return [row["Stat_Value"] for row in queries.run("interface_series", ip_address=ip_address, interface_id=1, start=DAY, end=DAY)]
+
+
+def test_writes_invalidate_the_cached_results_of_their_partitions():
+    client = mongomock.MongoClient()
+    writer = MetricsWriter(client=client)
+    writer.write(make_documents("21/04/2024") + make_documents("21/04/2024", "10.0.0.2"))
+    queries = MetricsQueries(client=client, refresh_interval=3600)
+    assert series(queries) == [1, 2] and series(queries, "10.0.0.2") == [1, 2]
+
+    # Writes to other partitions leave the results cached
+    writer.write(make_documents("22/04/2024", value=5) + make_documents("21/04/2024", "10.0.0.3"))
+    assert len(queries.cache.entries) == 2
+
+    writer.write(make_documents("21/04/2024", value=3))
+    assert len(queries.cache.entries) == 1
+    assert series(queries) == [3, 6]
+
+
+def test_writes_of_other_processes_are_read_from_the_change_log():
+    client = mongomock.MongoClient()
+    writer = MetricsWriter(client=client)
+    writer.write(make_documents("21/04/2024"))
+    queries = MetricsQueries(client=client, refresh_interval=0)
+    assert series(queries) == [1, 2]
+    # The writer of another process calls no listener of this one
+    Metrics_Writer._change_listeners.discard(queries.cache)
+
+    writer.write(make_documents("22/04/2024", value=5))
+    assert series(queries) == [1, 2] and queries.cache.entries
+    writer.write(make_documents("21/04/2024", value=3))
+    assert series(queries) == [3, 6]
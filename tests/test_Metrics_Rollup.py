@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import mongomock
+
+from Metrics_Rollup import RollupWriter
+
+
+def make_documents(values, hour=0, ip_address="10.0.0.1"):
+    return [{"IP_Address": ip_address, "Interface_ID": 1, "New_Stat_Description": "IP Interface Inbound Discarded Packets",
+             "Protocol_Version": "ipv4", "Measure_Date": "21/04/2024", "Measure_Time": f"{hour}:{minute:02d}:05", "Stat_Value": value}
+            for minute, value in enumerate(values)]
+
+
+def rollup_rows(writer, collection_name):
+    return sorted(({key: value for key, value in row.items() if key != "_id"} for row in writer.db[collection_name].find()),
+                  key=lambda row: (row["Period_Start"], row["IP_Address"]))
+
+
+def test_replaying_a_batch_leaves_the_rollups_unchanged():
+    writer = RollupWriter(client=mongomock.MongoClient())
+    writer.update(make_documents([4, 2, 6]), "batch-1")
+    writer.update(make_documents([5], hour=1), "batch-2")
+    expected = rollup_rows(writer, "Metrics_Rollup_Daily")
+    assert [(row["Count"], row["Sum"], row["Min"], row["Max"], row["Last"]) for row in expected] == [(4, 17, 2, 6, 5)]
+
+    writer.update(make_documents([4, 2, 6]), "batch-1")
+    writer.update(make_documents([5], hour=1), "batch-2")
+    assert rollup_rows(writer, "Metrics_Rollup_Daily") == expected
+    hourly = rollup_rows(writer, "Metrics_Rollup_Hourly")
+    assert [(row["Count"], row["Sum"], row["Last"], row["Batches"]) for row in hourly] == [(3, 12, 6, ["batch-1"]), (1, 5, 5, ["batch-2"])]
+
+
+def test_an_older_batch_does_not_replace_the_last_value():
+    writer = RollupWriter(client=mongomock.MongoClient())
+    writer.update(make_documents([5], hour=1), "later")
+    writer.update(make_documents([4, 2, 6]), "earlier")
+    assert [(row["Count"], row["Last"]) for row in rollup_rows(writer, "Metrics_Rollup_Daily")] == [(4, 5)]
+
+
+def test_replace_rewrites_the_span_and_deletes_rows_no_longer_produced():
+    writer = RollupWriter(client=mongomock.MongoClient())
+    writer.update(make_documents([4, 2, 6]) + make_documents([5], hour=1), "batch-1")
+    writer.update(make_documents([9], ip_address="10.0.0.2"), "batch-1")
+
+    written = writer.replace(make_documents([3, 1]), "backfill", "10.0.0.1", datetime(2024, 4, 21), datetime(2024, 4, 22))
+    assert written == 2  # One hourly and one daily row
+    hourly = rollup_rows(writer, "Metrics_Rollup_Hourly")
+    assert [(row["IP_Address"], row["Period_Start"].hour, row["Count"], row["Sum"], row["Batches"]) for row in hourly] == [
+        ("10.0.0.1", 0, 2, 4, ["backfill"]), ("10.0.0.2", 0, 1, 9, ["batch-1"])]
+    daily = rollup_rows(writer, "Metrics_Rollup_Daily")
+    assert sorted((row["IP_Address"], row["Count"]) for row in daily) == [("10.0.0.1", 2), ("10.0.0.2", 1)]
@@ -0,0 +1,58 @@
+import mongomock
+
+from Metrics_Writer import CHANGES_COLLECTION, NATURAL_KEY, MetricsWriter
+
+
+def make_documents(ip_address="10.0.0.1", measure_date="21/04/2024", count=5, value=1):
+    return [{"IP_Address": ip_address, "Measure_Date": measure_date, "Measure_Time": f"0:{minute:02d}:05", "Interface_ID": 1,
+             "Protocol_Version": "ipv4", "New_Stat_Description": "IP Interface Inbound Octets(High_Capacity)",
+             "Stat_Value": value * (minute + 1)} for minute in range(count)]
+
+
+def stored(writer):
+    return sorted((document for document in writer.collection.find({}, {"_id": 0})), key=lambda document: document["Measure_Time"])
+
+
+def test_rerunning_upserts_on_the_natural_key():
+    writer = MetricsWriter(client=mongomock.MongoClient())
+    first = writer.write(make_documents())
+    assert (first["upserted"], first["matched"], first["errors"]) == (5, 0, [])
+
+    again = writer.write(make_documents(value=2))
+    assert (again["upserted"], again["matched"], again["errors"]) == (0, 5, [])
+    assert writer.collection.count_documents({}) == 5
+    assert [document["Stat_Value"] for document in stored(writer)] == [2, 4, 6, 8, 10]
+    keys = {tuple(document[field] for field in NATURAL_KEY) for document in stored(writer)}
+    assert len(keys) == 5
+
+
+def test_batches_are_split_at_batch_size(monkeypatch):
+    writer = MetricsWriter(client=mongomock.MongoClient(), batch_size=2)
+    sizes = []
+    bulk_write = writer.collection.bulk_write
+    def spy(requests, **kwargs):
+        sizes.append(len(requests))
+        assert kwargs == {"ordered": False}
+        return bulk_write(requests, **kwargs)
+    monkeypatch.setattr(writer.collection, "bulk_write", spy)
+
+    writer.write(make_documents())
+    assert sizes == [2, 2, 1]
+    assert writer.collection.count_documents({}) == 5
+
+
+def test_a_failed_document_does_not_abort_its_batch():
+    writer = MetricsWriter(client=mongomock.MongoClient())
+    # A document clashing with another on a unique index fails on its own
+    writer.collection.create_index("Stat_Value", unique=True)
+    documents = make_documents() + make_documents(ip_address="10.0.0.2", count=1)
+
+    result = writer.write(documents)
+    assert len(result["errors"]) == 1
+    assert result["upserted"] == 5
+    assert writer.collection.count_documents({"IP_Address": "10.0.0.1"}) == 5
+
+    # Only the partitions written are recorded as changed
+    changed = {change["IP_Address"] for change in writer.client.Processed_DataBase[CHANGES_COLLECTION].find({"IP_Address": {"$exists": True}})}
+    assert changed == {"10.0.0.1"}
+
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import mongomock
+import numpy as np
+
+from ETL_Routers import measure_timestamps_utc
+from Metrics_Writer import LEGACY_QUERY_INDEXES, QUERY_INDEXES
+from Migrate_Timestamps import migrate
+
+
+def test_measure_times_are_converted_to_utc():
+    timestamps = measure_timestamps_utc(["21/04/2024  0:30:05", "01/01/2024  23:59:59", "21/04/2024  0:30:05"])
+    assert timestamps.dtype == np.dtype("datetime64[ns]")
+    # Tunisia is UTC+1 all year
+    assert timestamps.astype("datetime64[us]").tolist() == [datetime(2024, 4, 20, 23, 30, 5), datetime(2024, 1, 1, 22, 59, 59), datetime(2024, 4, 20, 23, 30, 5)]
+
+
+def test_repeated_and_skipped_local_hours_are_converted():
+    timestamps = measure_timestamps_utc(["27/10/2024  2:30:00", "31/03/2024  2:30:00"], timezone="Europe/Paris")
+    # The repeated hour is read as standard time, the skipped one is moved forward to 3:00 summer time
+    assert timestamps.astype("datetime64[us]").tolist() == [datetime(2024, 10, 27, 1, 30), datetime(2024, 3, 31, 1, 0)]
+
+
+def test_migration_backfills_timestamps_and_swaps_the_indexes():
+    client = mongomock.MongoClient()
+    collection = client.Processed_DataBase.Processed_Routers_Metrics
+    for name in LEGACY_QUERY_INDEXES:
+        collection.create_index(name[:-len("_1")])
+    collection.insert_many([{"IP_Address": "10.0.0.1", "Interface_ID": interface_id, "Measure_Date": "21/04/2024",
+                             "Measure_Time": measure_time, "Stat_Value": 1}
+                            for interface_id in (1, 2) for measure_time in ("0:30:05", "1:30:05")])
+    collection.insert_one({"IP_Address": "10.0.0.1", "Interface_ID": 3, "Measure_Date": "21/04/2024", "Measure_Time": "0:30:05",
+                           "Measure_Timestamp": datetime(2000, 1, 1)})
+
+    migrate(client)
+    timestamps = {(document["Interface_ID"], document["Measure_Time"]): document["Measure_Timestamp"] for document in collection.find()}
+    assert timestamps == {(1, "0:30:05"): datetime(2024, 4, 20, 23, 30, 5), (2, "0:30:05"): datetime(2024, 4, 20, 23, 30, 5),
+                          (1, "1:30:05"): datetime(2024, 4, 21, 0, 30, 5), (2, "1:30:05"): datetime(2024, 4, 21, 0, 30, 5),
+                          # Documents that already had the field are left alone
+                          (3, "0:30:05"): datetime(2000, 1, 1)}
+    indexes = collection.index_information()
+    assert set(QUERY_INDEXES) <= set(indexes) and not set(LEGACY_QUERY_INDEXES) & set(indexes)
+
+    # An interrupted migration is run again as is
+    migrate(client)
+    assert collection.count_documents({"Measure_Timestamp": {"$exists": False}}) == 0
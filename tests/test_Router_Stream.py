@@ -0,0 +1,62 @@
+import io
+import json
+
+import pytest
+
+from Router_Files import RouterStream
+
+
+def stream_routers(text, chunk_size=4):
+    # A small chunk size makes every value straddle reads
+    return [(ip_address, router_data) for ip_address, router_data, _ in RouterStream(io.StringIO(text), chunk_size).iter_routers()]
+
+
+def test_matches_json_load():
+    text = '{"routers": {"10.0.0.1": {"Measure_Time": {"21/04/2024  0:30:05": {"A.1": 1}}}, "10.0.0.2": {}}, "Other": [1]}  \n'
+    assert dict(stream_routers(text)) == json.loads(text)["routers"]
+
+
+@pytest.mark.parametrize("trailing", ['xx', '}', ' {"routers": {}}', '\n1'])
+def test_rejects_data_after_the_document(trailing):
+    text = '{"routers": {"10.0.0.1": {"Measure_Time": {}}}}' + trailing
+    with pytest.raises(json.JSONDecodeError):
+        json.loads(text)
+    with pytest.raises(json.JSONDecodeError):
+        stream_routers(text)
+
+
+def test_rejects_a_repeated_routers_key():
+    text = '{"routers": {"10.0.0.1": {"Measure_Time": {}}}, "routers": {"10.0.0.2": {"Measure_Time": {}}}}'
+    with pytest.raises(json.JSONDecodeError, match="Duplicate 'routers' key"):
+        stream_routers(text)
+
+
+class CountingReader(io.StringIO):
+    # Counts the characters RouterStream reads
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.characters_read = getattr(self, "characters_read", 0) + len(chunk)
+        return chunk
+
+
+def large_file(first_router):
+    router = json.dumps({"Measure_Time": {f"21/04/2024  0:{minute:02d}:05": {f"A.{oid}": str(oid) for oid in range(50)}
+                                          for minute in range(60)}})
+    return '{"routers": {"10.0.0.0": ' + first_router + ', ' + ', '.join(f'"10.0.{index // 250}.{index % 250 + 1}": {router}'
+                                                                        for index in range(200)) + '}}'
+
+
+def test_rejects_a_malformed_value_without_reading_the_rest_of_the_file():
+    file_obj = CountingReader(large_file('{"Measure_Time": {"21/04/2024  0:00:05": {"A.1": "1",, "A.2": "2"}}}'))
+    with pytest.raises(json.JSONDecodeError, match="Expecting property name"):
+        list(RouterStream(file_obj, 64 * 1024).iter_routers())
+    assert len(file_obj.getvalue()) > 5 * 1024 * 1024
+    assert file_obj.characters_read <= 2 * 64 * 1024
+
+
+def test_rejects_a_value_longer_than_the_limit():
+    # A string left open runs on into the next routers, and cannot be told from a long one until the limit
+    file_obj = CountingReader(large_file('{"Measure_Time": "' + "x" * 1024 * 1024))
+    with pytest.raises(json.JSONDecodeError, match="Value longer than"):
+        list(RouterStream(file_obj, 64 * 1024, max_value_chars=256 * 1024).iter_routers())
+    assert file_obj.characters_read <= 2 * 512 * 1024
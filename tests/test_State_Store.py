@@ -0,0 +1,57 @@
+import pytest
+from bson import ObjectId
+
+from State_Store import INGESTED, UNKNOWN, StateStore
+
+
+def test_marks_survive_a_reopen(tmp_path):
+    path = str(tmp_path / "state.db")
+    document_id = ObjectId()
+    with StateStore(path) as state_store:
+        state_store.mark_processed([document_id, "config-1"])
+        state_store.record_file("Stat_1.json", INGESTED)
+        state_store.record_partition("run", "2024-04-21", "10.0.0.1", 12)
+        state_store.update_counter_states([("series", "2024-04-21T00:00:05", 2**64 - 1, None, None)])
+
+    with StateStore(path) as state_store:
+        assert document_id in state_store.processed_documents and "config-1" in state_store.processed_documents
+        assert "config-2" not in state_store.processed_documents
+        assert "Stat_1.json" in state_store.files(INGESTED) and "Stat_1.json" not in state_store.files(UNKNOWN)
+        assert state_store.completed_partitions("run") == {("2024-04-21", "10.0.0.1")}
+        assert state_store.counter_states(["series"]) == {"series": ("2024-04-21T00:00:05", 2**64 - 1, None, None)}
+
+
+def test_a_failed_batch_marks_nothing(tmp_path):
+    with StateStore(str(tmp_path / "state.db")) as state_store:
+        with pytest.raises(RuntimeError):
+            with state_store.transaction():
+                state_store.mark_processed(["config-1"])
+                raise RuntimeError("write failed")
+        assert "config-1" not in state_store.processed_documents
+
+
+def test_counter_states_keep_the_newer_value(tmp_path):
+    with StateStore(str(tmp_path / "state.db")) as state_store:
+        state_store.update_counter_states([("series", "2024-04-21T00:01:05", 20, "2024-04-21T00:00:05", 10)])
+        state_store.update_counter_states([("series", "2024-04-21T00:00:05", 10, None, None)])
+        assert state_store.counter_states(["series", "other"]) == {"series": ("2024-04-21T00:01:05", 20, "2024-04-21T00:00:05", 10)}
+
+
+def test_a_legacy_list_is_imported_once(tmp_path):
+    processed = tmp_path / "Processed_documents.txt"
+    processed.write_text("config-1\n\nconfig-2\n")
+    ingested = tmp_path / "Ingested_Files.txt"
+    ingested.write_text("Stat_1.json\n")
+    with StateStore(str(tmp_path / "state.db")) as state_store:
+        state_store.import_legacy_file(str(processed))
+        state_store.import_legacy_file(str(ingested), INGESTED)
+        state_store.import_legacy_file(str(tmp_path / "Unknown_Files.txt"), UNKNOWN)  # Missing, so skipped
+        assert "config-1" in state_store.processed_documents and "config-2" in state_store.processed_documents
+        assert "" not in state_store.processed_documents
+        assert "Stat_1.json" in state_store.files(INGESTED)
+
+        # A second import does nothing, even of a changed file, so it cannot undo the store's own changes
+        processed.write_text("config-3\n")
+        state_store.unmark_processed(["config-1"])
+        state_store.import_legacy_file(str(processed))
+        assert "config-3" not in state_store.processed_documents and "config-1" not in state_store.processed_documents